@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     AdminActivity, SystemMetrics, UserAnalytics, SystemNotification,
     AdminSettings, BackupLog, MaintenanceWindow, UserSession, DashboardWidget,
-    UserPageView, UserAction, UserEngagement, RealTimeUserActivity, UserError, UserPerformance
+    UserPageView, UserAction, UserEngagement, RealTimeUserActivity, UserError, UserPerformance,
+    StatsRollup
 )
 
 @admin.register(AdminActivity)
@@ -132,3 +133,10 @@ class UserPerformanceAdmin(admin.ModelAdmin):
     list_filter = ['date']
     search_fields = ['user__email']
     ordering = ['-date']
+
+@admin.register(StatsRollup)
+class StatsRollupAdmin(admin.ModelAdmin):
+    list_display = ['metric', 'period', 'period_start', 'count', 'updated_at']
+    list_filter = ['period', 'metric']
+    readonly_fields = ['updated_at']
+    ordering = ['-period_start']
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from admindashboard.rollups import StatsCompactor
+
+
+class Command(BaseCommand):
+    help = 'Roll new analytics rows into the dashboard StatsRollup counters and refresh the totals'
+
+    def handle(self, *args, **options):
+        counted, folded = StatsCompactor.run()
+        self.stdout.write(
+            self.style.SUCCESS(f'Counted {counted} new rows, folded {folded} hourly rollups into days')
+        )
@@ -4,6 +4,7 @@ from .models import (
     UserSession, AdminActivity, UserPageView, UserAction, 
     UserEngagement, RealTimeUserActivity, UserError
 )
+from .tracking import EventBuffer
 import json
 
 User = get_user_model()
@@ -25,25 +26,16 @@ class AdminDashboardMiddleware:
         return response
     
     def track_user_session(self, request):
-        """Track user session for analytics"""
+        """Track user session for analytics (upserted by the event buffer)"""
         try:
-            # Get or create user session
             session_key = request.session.session_key
             if session_key:
-                session, created = UserSession.objects.get_or_create(
+                EventBuffer.touch_session(
+                    user=request.user,
                     session_key=session_key,
-                    defaults={
-                        'user': request.user,
-                        'ip_address': self.get_client_ip(request),
-                        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-                        'is_active': True
-                    }
+                    ip_address=self.get_client_ip(request),
+                    user_agent=request.META.get('HTTP_USER_AGENT', '')
                 )
-                
-                # Update existing session if not created
-                if not created:
-                    session.is_active = True
-                    session.save()
         except Exception as e:
             # Log error but don't break the request
             print(f"Error tracking user session: {e}")
@@ -154,7 +146,7 @@ class UserActivityTrackingMiddleware:
         """Track every page view"""
         try:
             if request.user.is_authenticated:
-                UserPageView.objects.create(
+                EventBuffer.add(UserPageView(
                     user=request.user,
                     page_url=request.path,
                     page_name=self.get_page_name(request.path),
@@ -162,31 +154,21 @@ class UserActivityTrackingMiddleware:
                     ip_address=self.get_client_ip(request),
                     user_agent=request.META.get('HTTP_USER_AGENT', ''),
                     referrer=request.META.get('HTTP_REFERER', '')
-                )
+                ))
         except Exception as e:
             print(f"Error tracking page view: {e}")
     
     def track_real_time_activity(self, request, response):
-        """Track real-time user activity"""
+        """Track real-time user activity (upserted by the event buffer)"""
         try:
             if request.user.is_authenticated:
-                # Update or create real-time activity
-                activity, created = RealTimeUserActivity.objects.get_or_create(
+                EventBuffer.touch_activity(
                     user=request.user,
                     session_key=request.session.session_key or '',
-                    defaults={
-                        'current_page': request.path,
-                        'current_action': self.get_current_action(request),
-                        'ip_address': self.get_client_ip(request),
-                        'is_active': True
-                    }
+                    current_page=request.path,
+                    current_action=self.get_current_action(request),
+                    ip_address=self.get_client_ip(request)
                 )
-                
-                if not created:
-                    activity.current_page = request.path
-                    activity.current_action = self.get_current_action(request)
-                    activity.is_active = True
-                    activity.save()
         except Exception as e:
             print(f"Error tracking real-time activity: {e}")
     
@@ -264,14 +246,14 @@ class UserActionTrackingMiddleware:
             if action_type:
                 action_data = self.get_action_data(request, response)
                 
-                UserAction.objects.create(
+                EventBuffer.add(UserAction(
                     user=request.user,
                     action_type=action_type,
                     action_data=action_data,
                     ip_address=self.get_client_ip(request),
                     user_agent=request.META.get('HTTP_USER_AGENT', ''),
                     session_key=request.session.session_key or ''
-                )
+                ))
         except Exception as e:
             print(f"Error tracking user action: {e}")
     
@@ -355,7 +337,7 @@ class UserErrorTrackingMiddleware:
         try:
             error_type = self.determine_error_type(response.status_code, request.path)
             
-            UserError.objects.create(
+            EventBuffer.add(UserError(
                 user=request.user if request.user.is_authenticated else None,
                 error_type=error_type,
                 error_message=f"HTTP {response.status_code}",
@@ -369,7 +351,7 @@ class UserErrorTrackingMiddleware:
                 page_url=request.path,
                 ip_address=self.get_client_ip(request),
                 user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
+            ))
         except Exception as e:
             print(f"Error tracking user error: {e}")
     
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:24
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_rows(apps, schema_editor):
+    """Keep only the newest row per session (get_or_create races could create duplicates)"""
+    UserSession = apps.get_model('admindashboard', 'UserSession')
+    RealTimeUserActivity = apps.get_model('admindashboard', 'RealTimeUserActivity')
+
+    for model, fields in ((UserSession, ['session_key']), (RealTimeUserActivity, ['user', 'session_key'])):
+        duplicates = model.objects.values(*fields).annotate(count=Count('id'), keep=Max('id')).filter(count__gt=1)
+        for row in duplicates:
+            model.objects.filter(**{field: row[field] for field in fields}).exclude(id=row['keep']).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admindashboard', '0002_realtimeuseractivity_useraction_usererror_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='realtimeuseractivity',
+            constraint=models.UniqueConstraint(fields=('user', 'session_key'), name='unique_realtime_user_session'),
+        ),
+        migrations.AddConstraint(
+            model_name='usersession',
+            constraint=models.UniqueConstraint(fields=('session_key',), name='unique_user_session_key'),
+        ),
+    ]
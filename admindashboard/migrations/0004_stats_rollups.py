@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admindashboard', '0003_unique_tracking_rows'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsRollupCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('total', 'Total')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Stats Rollups',
+                'ordering': ['-period_start'],
+                'constraints': [models.UniqueConstraint(fields=('metric', 'period', 'period_start'), name='unique_stats_rollup')],
+            },
+        ),
+    ]
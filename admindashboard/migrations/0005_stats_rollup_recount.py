@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admindashboard', '0004_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='statsrollupcursor',
+            name='last_id',
+        ),
+        migrations.AddField(
+            model_name='statsrollupcursor',
+            name='recount_from',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
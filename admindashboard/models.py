@@ -181,6 +181,9 @@ class UserSession(models.Model):
     class Meta:
         ordering = ['-login_time']
         verbose_name_plural = 'User Sessions'
+        constraints = [
+            models.UniqueConstraint(fields=['session_key'], name='unique_user_session_key'),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.login_time}"
@@ -296,6 +299,9 @@ class RealTimeUserActivity(models.Model):
     class Meta:
         ordering = ['-last_activity']
         verbose_name_plural = 'Real-time User Activity'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'session_key'], name='unique_realtime_user_session'),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.current_page}"
@@ -347,3 +353,36 @@ class UserPerformance(models.Model):
     
     def __str__(self):
         return f"{self.user.email} - {self.date}"
+
+class StatsRollup(models.Model):
+    """Pre-aggregated dashboard counters: hourly and daily event counts plus periodically refreshed totals"""
+    PERIODS = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+        ('total', 'Total'),
+    ]
+    
+    metric = models.CharField(max_length=50)
+    period = models.CharField(max_length=10, choices=PERIODS)
+    period_start = models.DateTimeField()
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-period_start']
+        verbose_name_plural = 'Stats Rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'period', 'period_start'], name='unique_stats_rollup'),
+        ]
+    
+    def __str__(self):
+        return f"{self.metric} {self.period} {self.period_start}: {self.count}"
+
+class StatsRollupCursor(models.Model):
+    """Start of the oldest hourly bucket the next rollup pass recounts for a metric"""
+    metric = models.CharField(max_length=50, unique=True)
+    recount_from = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.metric} @ {self.recount_from}"
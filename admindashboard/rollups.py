@@ -0,0 +1,254 @@
+import threading
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# period_start of the single 'total' row kept per metric
+TOTALS_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+def event_sources():
+    """metric -> (queryset, timestamp field) for the counters rolled up per hour"""
+    from .models import UserPageView, UserAction, UserError, AdminActivity
+
+    return {
+        'page_views': (UserPageView.objects.all(), 'created_at'),
+        'user_actions': (UserAction.objects.all(), 'created_at'),
+        'errors': (UserError.objects.all(), 'created_at'),
+        'admin_activities': (AdminActivity.objects.all(), 'created_at'),
+        'new_users': (get_user_model().objects.all(), 'date_joined'),
+    }
+
+def total_sources():
+    """metric -> queryset for the counters that are recounted on each compaction pass"""
+    from userdashboard.models import FileUpload, KMLData, UploadedParcel
+    from .models import UserSession
+
+    return {
+        'users': get_user_model().objects.all(),
+        'files': FileUpload.objects.all(),
+        'surveys': KMLData.objects.all(),
+        'parcels': UploadedParcel.objects.all(),
+        'active_sessions': UserSession.objects.filter(is_active=True),
+    }
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def hourly_cutoff(now=None):
+    """Hourly rows before this are folded into daily rows and never recounted"""
+    # The 7-day dashboard window is read from hourly rows, so keep at least 8 days of them
+    retention = max(getattr(settings, 'STATS_HOURLY_RETENTION_DAYS', 8), 8)
+    return (now or timezone.now()).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention)
+
+def add_counts(metric, period, counts):
+    """Add {period_start: count} to a metric's rollup rows, creating the rows that do not exist yet"""
+    from .models import StatsRollup
+
+    for period_start, count in counts.items():
+        if not count:
+            continue
+        rows = StatsRollup.objects.filter(metric=metric, period=period, period_start=period_start)
+        if rows.update(count=F('count') + count, updated_at=timezone.now()):
+            continue
+        try:
+            with transaction.atomic():
+                StatsRollup.objects.create(metric=metric, period=period, period_start=period_start, count=count)
+        except IntegrityError:
+            # Created concurrently by another writer
+            rows.update(count=F('count') + count, updated_at=timezone.now())
+
+def set_hour_counts(metric, since, counts):
+    """Make a metric's hourly rows from `since` on (all of them if None) exactly {period_start: count}"""
+    from .models import StatsRollup
+
+    hours = StatsRollup.objects.filter(metric=metric, period='hour')
+    if since is not None:
+        hours = hours.filter(period_start__gte=since)
+    # Buckets whose source rows were all deleted
+    hours.exclude(period_start__in=list(counts)).delete()
+    for period_start, count in counts.items():
+        rows = StatsRollup.objects.filter(metric=metric, period='hour', period_start=period_start)
+        if rows.update(count=count, updated_at=timezone.now()):
+            continue
+        try:
+            with transaction.atomic():
+                StatsRollup.objects.create(metric=metric, period='hour', period_start=period_start, count=count)
+        except IntegrityError:
+            # Created concurrently by another pass, which counted the same rows
+            rows.update(count=count, updated_at=timezone.now())
+
+class StatsCompactor:
+    """Keeps StatsRollup current: recounts recent hours, folds old hours into days and recounts totals"""
+
+    _lock = threading.Lock()
+
+    @classmethod
+    def roll_up_events(cls, now=None):
+        """Recount the hourly rollups from each metric's cursor up to now; returns the rows counted
+
+        Every pass recounts the hours since the previous one plus STATS_RECOUNT_HOURS before it, so rows
+        committed late and rows deleted (e.g. with their user) in that window are reflected. Older hourly
+        and daily buckets are left as they are.
+        """
+        from .models import StatsRollup, StatsRollupCursor
+
+        now = now or timezone.now()
+        cutoff = hourly_cutoff(now)
+        next_from = floor_hour(now) - timedelta(hours=getattr(settings, 'STATS_RECOUNT_HOURS', 2))
+        counted = 0
+        for metric, (queryset, field) in event_sources().items():
+            cursor, _ = StatsRollupCursor.objects.get_or_create(metric=metric)
+            if cursor.recount_from is None and not StatsRollup.objects.filter(metric=metric).exists():
+                # First pass: count the whole history, compact_hours folds the old part into days
+                since = None
+            else:
+                since = max(cursor.recount_from or cutoff, cutoff)
+
+            rows = queryset if since is None else queryset.filter(**{f'{field}__gte': since})
+            buckets = (
+                rows.annotate(bucket=TruncHour(field, tzinfo=dt_timezone.utc))
+                .values('bucket')
+                .annotate(count=Count('pk'))
+                .order_by('bucket')
+            )
+            counts = {row['bucket']: row['count'] for row in buckets}
+            with transaction.atomic():
+                set_hour_counts(metric, since, counts)
+                StatsRollupCursor.objects.filter(pk=cursor.pk).update(recount_from=next_from, updated_at=timezone.now())
+            counted += sum(counts.values())
+        return counted
+
+    @classmethod
+    def compact_hours(cls, now=None):
+        """Fold hourly rows older than STATS_HOURLY_RETENTION_DAYS into daily rows; returns the rows folded"""
+        from .models import StatsRollup
+
+        old = StatsRollup.objects.filter(period='hour', period_start__lt=hourly_cutoff(now))
+
+        with transaction.atomic():
+            days = (
+                old.annotate(day=TruncDay('period_start', tzinfo=dt_timezone.utc))
+                .values('metric', 'day')
+                .annotate(count=Sum('count'))
+                .order_by('metric', 'day')
+            )
+            by_metric = {}
+            for row in days:
+                by_metric.setdefault(row['metric'], {})[row['day']] = row['count']
+            ids = list(old.values_list('pk', flat=True))
+            if not ids:
+                return 0
+
+            deleted, _ = StatsRollup.objects.filter(pk__in=ids).delete()
+            if deleted != len(ids):
+                # Another pass folded some of these rows first; leave everything to it
+                transaction.set_rollback(True)
+                return 0
+            for metric, counts in by_metric.items():
+                add_counts(metric, 'day', counts)
+        return deleted
+
+    @classmethod
+    def refresh_totals(cls):
+        """Recount the table totals shown on the dashboard"""
+        from .models import StatsRollup
+
+        for metric, queryset in total_sources().items():
+            StatsRollup.objects.update_or_create(
+                metric=metric, period='total', period_start=TOTALS_EPOCH,
+                defaults={'count': queryset.count()},
+            )
+
+    @classmethod
+    def run(cls):
+        """One compaction pass; returns (rows counted, hourly rows folded)"""
+        counted = cls.roll_up_events()
+        folded = cls.compact_hours()
+        cls.refresh_totals()
+        logger.info(f"Stats compaction: {counted} new rows counted, {folded} hourly rollups folded")
+        return counted, folded
+
+    @classmethod
+    def run_in_background(cls):
+        """Start a compaction pass on a daemon thread unless this process is already running one"""
+        if not cls._lock.acquire(blocking=False):
+            return False
+
+        def target():
+            try:
+                close_old_connections()
+                cls.run()
+            except Exception as e:
+                logger.error(f"Stats compaction failed: {e}")
+            finally:
+                close_old_connections()
+                cls._lock.release()
+
+        threading.Thread(target=target, name='stats-compaction', daemon=True).start()
+        return True
+
+def dashboard_stats(now=None):
+    """Admin dashboard statistics read from the rollup rows instead of counting the source tables"""
+    from .models import StatsRollup, UserEngagement, SystemMetrics, SystemNotification
+
+    now = now or timezone.now()
+    totals = {row.metric: row for row in StatsRollup.objects.filter(period='total')}
+    if not totals:
+        # First load after deployment: build the rollups once before answering
+        StatsCompactor.run()
+        totals = {row.metric: row for row in StatsRollup.objects.filter(period='total')}
+    elif min(row.updated_at for row in totals.values()) < now - timedelta(seconds=getattr(settings, 'STATS_ROLLUP_INTERVAL', 60)):
+        StatsCompactor.run_in_background()
+
+    # Hour-aligned windows: the oldest bucket may reach up to an hour past 24h / 7d. Hours older than
+    # STATS_RECOUNT_HOURS are not recounted, so events removed with a deleted user stay in them until they age out
+    windows = {
+        row['metric']: row
+        for row in StatsRollup.objects.filter(period='hour', period_start__gte=floor_hour(now - timedelta(days=7)))
+        .values('metric')
+        .annotate(
+            last_24h=Sum('count', filter=Q(period_start__gte=floor_hour(now - timedelta(hours=24)))),
+            last_7d=Sum('count'),
+        )
+        .order_by('metric')
+    }
+
+    def total(metric):
+        return totals[metric].count if metric in totals else 0
+
+    def window(metric, key='last_24h'):
+        return (windows.get(metric) or {}).get(key) or 0
+
+    # User engagement statistics
+    avg_session_duration = UserEngagement.objects.filter(date=now.date()).aggregate(
+        avg_duration=Avg('total_time_spent')
+    )['avg_duration'] or 0
+
+    # System metrics
+    latest_metrics = SystemMetrics.objects.first()
+
+    return {
+        'total_users': total('users'),
+        'active_users': total('active_sessions'),
+        'new_users_24h': window('new_users'),
+        'new_users_7d': window('new_users', 'last_7d'),
+        'total_files': total('files'),
+        'total_surveys': total('surveys'),
+        'total_parcels': total('parcels'),
+        'total_page_views': window('page_views'),
+        'total_user_actions': window('user_actions'),
+        'total_errors': window('errors'),
+        'avg_session_duration': round(avg_session_duration, 2),
+        'cpu_usage': latest_metrics.cpu_usage if latest_metrics else 0.0,
+        'memory_usage': latest_metrics.memory_usage if latest_metrics else 0.0,
+        'disk_usage': latest_metrics.disk_usage if latest_metrics else 0.0,
+        'recent_activities_count': window('admin_activities'),
+        'unread_notifications': SystemNotification.objects.filter(is_read=False).count(),
+    }
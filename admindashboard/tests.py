@@ -1,3 +1,105 @@
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from .models import RealTimeUserActivity, StatsRollup, UserPageView, UserSession
+from .rollups import StatsCompactor, dashboard_stats
+from .tracking import EventBuffer
+
+User = get_user_model()
+
+class EventBufferTests(TestCase):
+    """Buffered tracking writes: upserts per key, and failures stay contained"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', email='viewer@example.com', password='secret')
+
+    def page_view(self, ip_address='127.0.0.1'):
+        return UserPageView(
+            user=self.user, page_url='/dashboard/', page_name='Dashboard',
+            session_key='abc', ip_address=ip_address, user_agent='test'
+        )
+
+    def touch(self, page):
+        EventBuffer.touch_session(self.user, 'abc', '127.0.0.1', 'test')
+        EventBuffer.touch_activity(self.user, 'abc', page, 'Page View', '127.0.0.1')
+
+    def test_repeated_touches_upsert_one_row(self):
+        for page in ['/dashboard/', '/dashboard/help/']:
+            self.touch(page)
+            EventBuffer.flush()
+
+        self.assertEqual(UserSession.objects.filter(session_key='abc').count(), 1)
+        self.assertEqual(
+            list(RealTimeUserActivity.objects.filter(user=self.user).values_list('current_page', flat=True)),
+            ['/dashboard/help/']
+        )
+
+    def test_row_by_row_fallback_without_upsert_support(self):
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(connection.features, 'supports_update_conflicts', False):
+            for page in ['/dashboard/', '/dashboard/help/']:
+                self.touch(page)
+                EventBuffer.add(self.page_view())
+                EventBuffer.flush()
+
+        self.assertEqual(UserPageView.objects.count(), 2)
+        self.assertEqual(UserSession.objects.filter(session_key='abc').count(), 1)
+        self.assertEqual(RealTimeUserActivity.objects.get(user=self.user).current_page, '/dashboard/help/')
+
+    def test_bad_event_does_not_discard_the_batch(self):
+        EventBuffer.add(self.page_view())
+        EventBuffer.add(self.page_view(ip_address=None))
+        EventBuffer.add(self.page_view())
+        self.touch('/dashboard/')
+
+        self.assertEqual(EventBuffer.flush(), 4)
+        self.assertEqual(UserPageView.objects.count(), 2)
+        self.assertEqual(UserSession.objects.filter(session_key='abc').count(), 1)
+
+class StatsRollupTests(TestCase):
+    """Hourly rollups follow rows committed late and rows deleted within the recount window"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', email='viewer@example.com', password='secret')
+
+    def page_views(self, user, count, created_at):
+        views = UserPageView.objects.bulk_create([
+            UserPageView(user=user, page_url='/dashboard/', page_name='Dashboard',
+                         session_key='abc', ip_address='127.0.0.1', user_agent='test')
+            for _ in range(count)
+        ])
+        UserPageView.objects.filter(pk__in=[view.pk for view in views]).update(created_at=created_at)
+
+    def hourly(self, metric='page_views'):
+        return sum(StatsRollup.objects.filter(metric=metric, period='hour').values_list('count', flat=True))
+
+    def test_late_and_deleted_rows_are_recounted(self):
+        now = timezone.now()
+        self.page_views(self.user, 3, now - timedelta(minutes=30))
+        StatsCompactor.roll_up_events(now)
+        self.assertEqual(self.hourly(), 3)
+
+        # A row that committed after the pass but is stamped with an already-counted hour
+        self.page_views(self.user, 1, now - timedelta(minutes=50))
+        other = User.objects.create_user(username='leaver', email='leaver@example.com', password='secret')
+        self.page_views(other, 2, now - timedelta(minutes=10))
+        StatsCompactor.roll_up_events(now + timedelta(minutes=1))
+        self.assertEqual(self.hourly(), 6)
+
+        other.delete()
+        StatsCompactor.roll_up_events(now + timedelta(minutes=2))
+        self.assertEqual(self.hourly(), 4)
+        self.assertEqual(self.hourly('new_users'), 1)
+        self.assertEqual(dashboard_stats(now + timedelta(minutes=2))['total_page_views'], 4)
+
+    def test_recounting_never_double_counts(self):
+        now = timezone.now()
+        self.page_views(self.user, 5, now - timedelta(hours=1))
+        StatsCompactor.run()
+        StatsCompactor.roll_up_events(now + timedelta(minutes=1))
+        StatsCompactor.roll_up_events(now + timedelta(minutes=2))
+        self.assertEqual(self.hourly(), 5)
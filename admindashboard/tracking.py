@@ -0,0 +1,189 @@
+import os
+import atexit
+import threading
+import logging
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+class EventBuffer:
+    """In-process buffer for the tracking middlewares, written to the database in bulk by a daemon thread
+
+    Page views, actions and errors are appended and bulk-inserted. Session and real-time activity
+    updates are merged per key so a burst of requests becomes one upsert per row.
+    """
+
+    _lock = threading.Lock()
+    _wake_event = threading.Event()
+    _thread = None
+    _pid = None
+    _inserts = []
+    _sessions = {}
+    _activities = {}
+
+    @classmethod
+    def pending(cls):
+        return len(cls._inserts) + len(cls._sessions) + len(cls._activities)
+
+    @classmethod
+    def add(cls, obj):
+        """Queue an unsaved UserPageView, UserAction or UserError for insertion"""
+        with cls._lock:
+            cls._inserts.append(obj)
+        cls._submitted()
+
+    @classmethod
+    def touch_session(cls, user, session_key, ip_address, user_agent):
+        """Mark a UserSession active, creating it on the next flush if it does not exist"""
+        with cls._lock:
+            cls._sessions[session_key] = {
+                'user_id': user.pk,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+            }
+        cls._submitted()
+
+    @classmethod
+    def touch_activity(cls, user, session_key, current_page, current_action, ip_address):
+        """Record the latest page and action of a user's session in RealTimeUserActivity"""
+        with cls._lock:
+            cls._activities[(user.pk, session_key)] = {
+                'current_page': current_page,
+                'current_action': current_action,
+                'ip_address': ip_address,
+            }
+        cls._submitted()
+
+    @classmethod
+    def _submitted(cls):
+        if getattr(settings, 'ANALYTICS_FLUSH_INTERVAL', 5) <= 0:
+            cls.flush()
+            return
+        cls.start()
+        if cls.pending() >= getattr(settings, 'ANALYTICS_BUFFER_SIZE', 500):
+            cls._wake_event.set()
+
+    @classmethod
+    def start(cls):
+        """Start the flush thread for this process if it is not running"""
+        if cls._thread is not None and cls._thread.is_alive() and cls._pid == os.getpid():
+            return
+        with cls._lock:
+            # A forked worker inherits the parent's thread object but not the thread
+            if cls._thread is None or not cls._thread.is_alive() or cls._pid != os.getpid():
+                if cls._pid is None:
+                    atexit.register(cls.flush)
+                cls._pid = os.getpid()
+                cls._thread = threading.Thread(target=cls._run, name='analytics-flush', daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            cls._wake_event.wait(getattr(settings, 'ANALYTICS_FLUSH_INTERVAL', 5))
+            cls._wake_event.clear()
+            close_old_connections()
+            cls.flush()
+            close_old_connections()
+
+    @classmethod
+    def flush(cls):
+        """Write everything buffered so far; returns the number of events written"""
+        from .models import UserSession, RealTimeUserActivity
+
+        with cls._lock:
+            inserts, cls._inserts = cls._inserts, []
+            sessions, cls._sessions = cls._sessions, {}
+            activities, cls._activities = cls._activities, {}
+        if not (inserts or sessions or activities):
+            return 0
+
+        # Each model is written on its own so a failing batch never takes the others with it
+        written = 0
+        by_model = {}
+        for obj in inserts:
+            by_model.setdefault(type(obj), []).append(obj)
+        for model, objs in by_model.items():
+            written += cls._insert(model, objs)
+
+        if sessions:
+            written += cls._upsert(
+                UserSession,
+                [
+                    UserSession(session_key=session_key, is_active=True, **fields)
+                    for session_key, fields in sessions.items()
+                ],
+                unique_fields=['session_key'],
+                update_fields=['is_active'],
+            )
+
+        if activities:
+            now = timezone.now()
+            written += cls._upsert(
+                RealTimeUserActivity,
+                [
+                    RealTimeUserActivity(
+                        user_id=user_id, session_key=session_key, is_active=True, last_activity=now, **fields
+                    )
+                    for (user_id, session_key), fields in activities.items()
+                ],
+                unique_fields=['user', 'session_key'],
+                update_fields=['current_page', 'current_action', 'is_active', 'last_activity'],
+            )
+        return written
+
+    @staticmethod
+    def _insert(model, objs):
+        """bulk_create append-only events, retrying row by row if the batch fails"""
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(objs, batch_size=500)
+            return len(objs)
+        except Exception as e:
+            logger.warning(f"Bulk insert of {len(objs)} {model.__name__} rows failed, retrying one by one: {e}")
+
+        written = 0
+        for obj in objs:
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+                written += 1
+            except Exception as e:
+                # Tracking must never take the site down; the bad row is dropped
+                logger.error(f"Dropped {model.__name__} analytics event: {e}")
+        return written
+
+    @staticmethod
+    def _upsert(model, objs, unique_fields, update_fields):
+        """Insert or update rows on their unique key, with a per-row fallback where the backend cannot"""
+        connection = connections[router.db_for_write(model)]
+        try:
+            with transaction.atomic(using=connection.alias):
+                if connection.features.supports_update_conflicts_with_target:
+                    model.objects.bulk_create(
+                        objs, batch_size=500, update_conflicts=True,
+                        unique_fields=unique_fields, update_fields=update_fields,
+                    )
+                    return len(objs)
+                if connection.features.supports_update_conflicts:
+                    # MySQL: ON DUPLICATE KEY UPDATE applies to any unique key and takes no target
+                    model.objects.bulk_create(objs, batch_size=500, update_conflicts=True, update_fields=update_fields)
+                    return len(objs)
+        except Exception as e:
+            logger.warning(f"Bulk upsert of {len(objs)} {model.__name__} rows failed, retrying one by one: {e}")
+
+        key_columns = [model._meta.get_field(name).attname for name in unique_fields]
+        written = 0
+        for obj in objs:
+            lookup = {column: getattr(obj, column) for column in key_columns}
+            try:
+                with transaction.atomic():
+                    updated = model.objects.filter(**lookup).update(**{name: getattr(obj, name) for name in update_fields})
+                    if not updated:
+                        obj.save(force_insert=True)
+                written += 1
+            except Exception as e:
+                logger.error(f"Dropped {model.__name__} analytics update: {e}")
+        return written
@@ -41,6 +41,7 @@ from .serializers import (
     DashboardStatsSerializer, UserManagementSerializer, SystemBackupSerializer,
     NotificationCreateSerializer
 )
+from .rollups import dashboard_stats
 from django.contrib.auth import get_user_model
 from userdashboard.models import FileUpload, KMLData, UploadedParcel
 
@@ -121,62 +122,8 @@ class AdminDashboardView(AdminRequiredMixin, View):
         return render(request, 'admindashboard/dashboard.html', context)
     
     def get_dashboard_stats(self):
-        """Get comprehensive dashboard statistics"""
-        now = timezone.now()
-        last_24h = now - timedelta(hours=24)
-        last_7d = now - timedelta(days=7)
-        
-        # User statistics
-        total_users = User.objects.count()
-        active_users = UserSession.objects.filter(is_active=True).count()
-        new_users_24h = User.objects.filter(date_joined__gte=last_24h).count()
-        new_users_7d = User.objects.filter(date_joined__gte=last_7d).count()
-        
-        # File statistics
-        total_files = FileUpload.objects.count()
-        total_surveys = KMLData.objects.count()
-        total_parcels = UploadedParcel.objects.count()
-        
-        # Enhanced activity statistics
-        total_page_views = UserPageView.objects.filter(created_at__gte=last_24h).count()
-        total_user_actions = UserAction.objects.filter(created_at__gte=last_24h).count()
-        total_errors = UserError.objects.filter(created_at__gte=last_24h).count()
-        
-        # User engagement statistics
-        avg_session_duration = UserEngagement.objects.filter(date=now.date()).aggregate(
-            avg_duration=Avg('total_time_spent')
-        )['avg_duration'] or 0
-        
-        # System metrics
-        latest_metrics = SystemMetrics.objects.first()
-        cpu_usage = latest_metrics.cpu_usage if latest_metrics else 0.0
-        memory_usage = latest_metrics.memory_usage if latest_metrics else 0.0
-        disk_usage = latest_metrics.disk_usage if latest_metrics else 0.0
-        
-        # Activity statistics
-        recent_activities_count = AdminActivity.objects.filter(created_at__gte=last_24h).count()
-        
-        # Notifications
-        unread_notifications = SystemNotification.objects.filter(is_read=False).count()
-        
-        return {
-            'total_users': total_users,
-            'active_users': active_users,
-            'new_users_24h': new_users_24h,
-            'new_users_7d': new_users_7d,
-            'total_files': total_files,
-            'total_surveys': total_surveys,
-            'total_parcels': total_parcels,
-            'total_page_views': total_page_views,
-            'total_user_actions': total_user_actions,
-            'total_errors': total_errors,
-            'avg_session_duration': round(avg_session_duration, 2),
-            'cpu_usage': cpu_usage,
-            'memory_usage': memory_usage,
-            'disk_usage': disk_usage,
-            'recent_activities_count': recent_activities_count,
-            'unread_notifications': unread_notifications,
-        }
+        """Get comprehensive dashboard statistics from the pre-aggregated rollups"""
+        return dashboard_stats()
 
 class UsersManagementView(AdminRequiredMixin, View):
     """User management view with enhanced analytics"""
@@ -487,62 +434,8 @@ class DashboardStatsAPIView(AdminRequiredMixin, APIView):
         return JsonResponse(stats)
     
     def get_dashboard_stats(self):
-        """Get comprehensive dashboard statistics"""
-        now = timezone.now()
-        last_24h = now - timedelta(hours=24)
-        last_7d = now - timedelta(days=7)
-        
-        # User statistics
-        total_users = User.objects.count()
-        active_users = UserSession.objects.filter(is_active=True).count()
-        new_users_24h = User.objects.filter(date_joined__gte=last_24h).count()
-        new_users_7d = User.objects.filter(date_joined__gte=last_7d).count()
-        
-        # File statistics
-        total_files = FileUpload.objects.count()
-        total_surveys = KMLData.objects.count()
-        total_parcels = UploadedParcel.objects.count()
-        
-        # Enhanced activity statistics
-        total_page_views = UserPageView.objects.filter(created_at__gte=last_24h).count()
-        total_user_actions = UserAction.objects.filter(created_at__gte=last_24h).count()
-        total_errors = UserError.objects.filter(created_at__gte=last_24h).count()
-        
-        # User engagement statistics
-        avg_session_duration = UserEngagement.objects.filter(date=now.date()).aggregate(
-            avg_duration=Avg('total_time_spent')
-        )['avg_duration'] or 0
-        
-        # System metrics
-        latest_metrics = SystemMetrics.objects.first()
-        cpu_usage = latest_metrics.cpu_usage if latest_metrics else 0.0
-        memory_usage = latest_metrics.memory_usage if latest_metrics else 0.0
-        disk_usage = latest_metrics.disk_usage if latest_metrics else 0.0
-        
-        # Activity statistics
-        recent_activities_count = AdminActivity.objects.filter(created_at__gte=last_24h).count()
-        
-        # Notifications
-        unread_notifications = SystemNotification.objects.filter(is_read=False).count()
-        
-        return {
-            'total_users': total_users,
-            'active_users': active_users,
-            'new_users_24h': new_users_24h,
-            'new_users_7d': new_users_7d,
-            'total_files': total_files,
-            'total_surveys': total_surveys,
-            'total_parcels': total_parcels,
-            'total_page_views': total_page_views,
-            'total_user_actions': total_user_actions,
-            'total_errors': total_errors,
-            'avg_session_duration': round(avg_session_duration, 2),
-            'cpu_usage': cpu_usage,
-            'memory_usage': memory_usage,
-            'disk_usage': disk_usage,
-            'recent_activities_count': recent_activities_count,
-            'unread_notifications': unread_notifications,
-        }
+        """Get comprehensive dashboard statistics from the pre-aggregated rollups"""
+        return dashboard_stats()
 
 class UsersAPIView(APIView):
     """API view for user management"""
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -158,6 +159,24 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 SESSION_SAVE_EVERY_REQUEST = True
 
+# Runtime caches (upload previews, precomputed GeoJSON) live outside the source tree
+CACHE_ROOT = Path(os.environ.get('GEOSURVEY_CACHE_ROOT', Path(tempfile.gettempdir()) / 'geosurvey-cache'))
+
+# 'previews' holds upload previews on local disk (userdashboard.previews.PreviewStore) so the
+# DB-backed session, rewritten on every request, only carries a short token.
+PREVIEW_TTL = 3600  # seconds an upload preview stays available
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'previews': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_ROOT / 'previews',
+        'TIMEOUT': PREVIEW_TTL,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
@@ -203,3 +222,52 @@ MEDIA_ROOT = BASE_DIR / 'media'
 LOGIN_URL = '/api/account/login-page/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/api/account/login-page/'
+
+# File ingestion
+# Number of parsed features buffered before each bulk_create flush
+INGEST_BATCH_SIZE = 1000
+# Process-pool extraction for large KML files (0 or 1 keeps ingestion in a single process)
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+INGEST_PARALLEL_MIN_BYTES = 5 * 1024 * 1024  # smaller files are parsed serially
+INGEST_PARALLEL_CHUNK_SIZE = 1000  # placemarks handed to a worker at a time
+
+# Kitta/owner/area extraction rules per municipality data source (userdashboard.extraction).
+# Keys are source names passed as ?source= / --source; values override entries of DEFAULT_RULES,
+# e.g. {'kitta': [r'kitta\s*no\.?\s*:?\s*(\S+)'], 'owner_keys': ['jagga_dhani']}.
+EXTRACTION_RULES = {}
+
+# Resumable uploads (/dashboard/api/files/uploads/): init, PUT chunks at an offset, finalize
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # chunk size suggested to clients
+UPLOAD_SESSION_TTL = 24 * 3600  # seconds an idle partial upload is kept before it is discarded
+
+# Background job queue (userdashboard.jobs)
+# In-process worker threads started on first enqueue; set to 0 and run
+# `python manage.py process_jobs` to use dedicated worker processes instead.
+JOB_QUEUE_LOCAL_WORKERS = int(os.environ.get('JOB_QUEUE_LOCAL_WORKERS', 2))
+JOB_QUEUE_POLL_INTERVAL = 2  # seconds an idle worker waits before polling again
+JOB_QUEUE_HEARTBEAT_SECONDS = 30  # how often a running job refreshes its updated_at
+JOB_QUEUE_STALE_SECONDS = 300  # running jobs without a heartbeat for this long are requeued
+
+# Spatial index
+SPATIAL_INDEX_CACHE_SIZE = 32  # STRtrees kept in memory (one per file or per user)
+
+# Map tiles (/dashboard/tiles/<source>/[<file_id>/]<z>/<x>/<y>.geojson|mvt)
+TILE_CACHE_TIMEOUT = 3600  # seconds a rendered tile stays in the Django cache
+TILE_SIMPLIFY_PIXELS = 1.0  # simplification tolerance in screen pixels at each zoom
+TILE_BUFFER_PIXELS = 8  # clip margin around each tile to hide seams
+
+# Precomputed, gzipped GeoJSON served by the map views (one file per upload and data version)
+GEOJSON_CACHE_DIR = CACHE_ROOT / 'geojson'
+
+# Rows fetched per database round trip by the streaming CSV/KML exporters
+EXPORT_CHUNK_SIZE = 2000
+
+# Analytics written by the admindashboard tracking middlewares (admindashboard.tracking.EventBuffer)
+ANALYTICS_FLUSH_INTERVAL = 5  # seconds between background flushes; 0 writes on every request
+ANALYTICS_BUFFER_SIZE = 500  # buffered events that trigger an early flush
+
+# Admin dashboard statistics read from StatsRollup (admindashboard.rollups); `python manage.py compact_stats`
+# runs a compaction pass from cron, otherwise a stale dashboard load starts one in the background
+STATS_ROLLUP_INTERVAL = 60  # seconds before the rollups are considered stale
+STATS_HOURLY_RETENTION_DAYS = 8  # hourly rows older than this are folded into daily rows
+STATS_RECOUNT_HOURS = 2  # closed hours recounted on every pass, for rows committed late or deleted
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     FileUpload, KMLFile, KMLData, FileShare, FileProcessingLog,
-    DownloadLog, ContactFormSubmission, SurveyHistoryLog
+    DownloadLog, ContactFormSubmission, SurveyHistoryLog, ProcessingJob
 )
 
 # Register your models here.
@@ -53,3 +53,14 @@ class SurveyHistoryLogAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user')
+
+@admin.register(ProcessingJob)
+class ProcessingJobAdmin(admin.ModelAdmin):
+    list_display = ['job_type', 'status', 'user', 'attempts', 'duration_seconds', 'created_at']
+    list_filter = ['job_type', 'status', 'created_at']
+    search_fields = ['id', 'user__email', 'error_message']
+    readonly_fields = ['created_at', 'started_at', 'completed_at', 'duration_seconds', 'worker_id']
+    ordering = ['-created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
@@ -0,0 +1,293 @@
+import re
+import logging
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Rules used when a data source has no entry in settings.EXTRACTION_RULES.
+# Each pattern list is tried in order; the first capture group (or the whole match) is the value.
+DEFAULT_RULES = {
+    'kitta_keys': ['kitta'],
+    'owner_keys': ['owner', 'name'],
+    'kitta': [
+        r'kitta\s*number\s*:?\s*([^\s\n\r]+)',
+        r'kitta\s*:?\s*([^\s\n\r]+)',
+        r'kml_\d+_\d+_\d+',  # Pattern like KML_1_11_10
+        r'kml-\d+-\d+-\d+',  # Pattern like KML-1-11-10
+    ],
+    'owner': [
+        r'owner\s*name\s*:?\s*([^\n\r]+)',
+        r'owner\s*:?\s*([^\n\r]+)',
+        r'name\s*:?\s*([^\n\r]+)',
+    ],
+    'area_hectares': [
+        r'area[:\s]*([0-9.]+)\s*(?:hectares|ha)\b',
+    ],
+    'area_sqm': [
+        r'area(?:\s*size)?[:\s]*([0-9.]+)\s*sq\s*m',
+    ],
+}
+
+# Text fields stripped of HTML tags and extra whitespace when stored rows are reprocessed
+CLEAN_FIELDS = ['owner_name', 'placemark_name', 'description', 'address', 'locality', 'administrative_area']
+
+def clean_text(text):
+    """Remove HTML tags and collapse whitespace"""
+    if not text:
+        return ''
+    return WHITESPACE_RE.sub(' ', HTML_TAG_RE.sub('', text)).strip()
+
+def clean_column(series):
+    """clean_text over a whole column; missing values stay missing"""
+    cleaned = series.astype(object).where(series.notna(), None)
+    present = cleaned.notna()
+    if present.any():
+        cleaned[present] = (
+            cleaned[present].astype(str)
+            .str.replace(HTML_TAG_RE, '', regex=True)
+            .str.replace(WHITESPACE_RE, ' ', regex=True)
+            .str.strip()
+        )
+    return cleaned
+
+def _compile(pattern):
+    """Compile case-insensitively, wrapping group-less patterns so group 1 is always the value"""
+    compiled = re.compile(pattern, re.IGNORECASE)
+    if compiled.groups == 0:
+        compiled = re.compile(f'({pattern})', re.IGNORECASE)
+    return compiled
+
+def _first_valid(candidates):
+    """Row-wise first non-null value across a list of aligned Series"""
+    result = candidates[0]
+    for candidate in candidates[1:]:
+        result = result.fillna(candidate)
+    return result
+
+class ExtractionRules:
+    """Precompiled kitta/owner/area patterns for one data source, applied to a placemark or a whole column"""
+
+    _cache = {}
+
+    def __init__(self, rules=None, source=''):
+        rules = {**DEFAULT_RULES, **(rules or {})}
+        self.source = source or ''
+        self.kitta_keys = [key.lower() for key in rules['kitta_keys']]
+        self.owner_keys = [key.lower() for key in rules['owner_keys']]
+        self.kitta = [_compile(pattern) for pattern in rules['kitta']]
+        self.owner = [_compile(pattern) for pattern in rules['owner']]
+        self.area_hectares = [_compile(pattern) for pattern in rules['area_hectares']]
+        self.area_sqm = [_compile(pattern) for pattern in rules['area_sqm']]
+
+    @classmethod
+    def for_source(cls, source=None):
+        """Rules for a municipality data source (a key of settings.EXTRACTION_RULES), compiled once per process"""
+        configured = getattr(settings, 'EXTRACTION_RULES', {})
+        key = source if source in configured else None
+        if key not in cls._cache:
+            cls._cache[key] = cls(configured.get(key), key)
+        return cls._cache[key]
+
+    @staticmethod
+    def _search(patterns, text):
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+        return None
+
+    def extract(self, data_pairs, description, placemark_name):
+        """Kitta number and owner name for one placemark: ExtendedData first, then the description"""
+        kitta_number = ''
+        owner_name = ''
+        for name, value in data_pairs:
+            key = name.lower()
+            if any(k in key for k in self.kitta_keys):
+                kitta_number = clean_text(value)
+            elif any(k in key for k in self.owner_keys):
+                owner_name = clean_text(value)
+
+        text = clean_text(description)
+        if not kitta_number:
+            kitta_number = self._search(self.kitta, text) or ''
+        if not owner_name:
+            for pattern in self.owner:
+                match = pattern.search(text)
+                if match:
+                    candidate = match.group(1).strip()
+                    # Skip if it's the same as kitta number or placemark name
+                    if candidate != kitta_number and candidate != placemark_name:
+                        owner_name = candidate
+                        break
+
+        # If still no owner name, use placemark name as fallback
+        if not owner_name and placemark_name:
+            owner_name = placemark_name
+
+        return {
+            'kitta_number': clean_text(kitta_number),
+            'owner_name': clean_text(owner_name),
+        }
+
+    def extract_area(self, description):
+        """Area in hectares stated in a description, or None"""
+        text = clean_text(description)
+        for patterns, scale in ((self.area_hectares, 1), (self.area_sqm, 10000)):
+            for pattern in patterns:
+                match = pattern.search(text)
+                if match:
+                    try:
+                        return float(match.group(1)) / scale
+                    except ValueError:
+                        continue
+        return None
+
+    def extract_frame(self, frame):
+        """Vectorized extraction over a DataFrame of stored rows
+
+        Expects description, placemark_name, kitta_number, owner_name and area_hectares columns and returns
+        the same three values extract()/extract_area() give per row, filling only the ones that are blank.
+        """
+        text = frame['description'].fillna('').astype(str)
+        placemark_name = frame['placemark_name'].fillna('').astype(str)
+
+        kitta_number = frame['kitta_number'].fillna('').astype(str).replace('', np.nan)
+        if self.kitta:
+            kitta_number = kitta_number.fillna(_first_valid([text.str.extract(p, expand=False) for p in self.kitta]))
+        kitta_number = kitta_number.fillna('')
+
+        owner_name = frame['owner_name'].fillna('').astype(str).replace('', np.nan)
+        candidates = []
+        for pattern in self.owner:
+            candidate = text.str.extract(pattern, expand=False).str.strip()
+            candidates.append(candidate.where((candidate != kitta_number) & (candidate != placemark_name)))
+        if candidates:
+            owner_name = owner_name.fillna(_first_valid(candidates))
+        owner_name = owner_name.fillna(placemark_name.replace('', np.nan)).fillna('')
+
+        areas = [pd.to_numeric(text.str.extract(p, expand=False), errors='coerce') for p in self.area_hectares]
+        areas += [pd.to_numeric(text.str.extract(p, expand=False), errors='coerce') / 10000 for p in self.area_sqm]
+        area_hectares = pd.to_numeric(frame['area_hectares'], errors='coerce').replace(0, np.nan)
+        if areas:
+            area_hectares = area_hectares.fillna(_first_valid(areas))
+
+        return pd.DataFrame({
+            'kitta_number': clean_column(kitta_number),
+            'owner_name': clean_column(owner_name),
+            'area_hectares': area_hectares,
+        }, index=frame.index)
+
+def reprocess_rows(queryset, rules=None, chunk_size=2000, progress_callback=None):
+    """Clean the text fields of stored KMLData rows and fill blank kitta/owner/area in column-wise batches
+
+    Returns (processed_count, cleaned_count); only rows whose values changed are written back.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    from .geojson_cache import GeoJSONCache
+    from .models import KMLFile
+    from .spatial import touch_owners
+
+    rules = rules or ExtractionRules.for_source()
+    value_fields = CLEAN_FIELDS + ['kitta_number', 'area_hectares']
+    update_fields = value_fields + ['area_sqm', 'dedup_key', 'updated_at']
+    processed_count = 0
+    cleaned_count = 0
+    changed_files = set()
+
+    def flush(chunk):
+        nonlocal processed_count, cleaned_count
+        frame = pd.DataFrame({field: [getattr(obj, field) for obj in chunk] for field in value_fields})
+        original = frame.copy()
+        for field in CLEAN_FIELDS:
+            frame[field] = clean_column(frame[field])
+        extracted = rules.extract_frame(frame)
+        for field in extracted.columns:
+            frame[field] = extracted[field]
+
+        changed = []
+        now = timezone.now()
+        for obj, row, old in zip(chunk, frame.to_dict('records'), original.to_dict('records')):
+            if all(_same(row[field], old[field]) for field in value_fields):
+                continue
+            for field in CLEAN_FIELDS + ['kitta_number']:
+                setattr(obj, field, row[field])
+            if not old['area_hectares'] and not _blank(row['area_hectares']):
+                obj.area_hectares = Decimal(f"{row['area_hectares']:.6f}")
+                if obj.area_sqm is None:
+                    obj.area_sqm = Decimal(f"{row['area_hectares'] * 10000:.2f}")
+            obj.fill_dedup_key()
+            obj.updated_at = now
+            changed.append(obj)
+            changed_files.add(obj.kml_file_id)
+
+        update_rows(queryset.model, changed, update_fields, using=queryset.db)
+        processed_count += len(chunk)
+        cleaned_count += len(changed)
+        if progress_callback:
+            progress_callback(processed_count)
+
+    with transaction.atomic():
+        chunk = []
+        for obj in queryset.only('pk', 'kml_file', 'area_sqm', 'dedup_key', *value_fields).order_by('pk').iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+        # Rows changed in place: bump their files' data version so cached GeoJSON, tiles and indexes rebuild
+        touch_owners('kml', changed_files)
+        # Record the rules the rows now reflect so identical uploads only reuse rows extracted the same way
+        KMLFile.objects.filter(pk__in=list(changed_files)).update(extraction_source=rules.source)
+
+    for kml_file_id in changed_files:
+        GeoJSONCache.invalidate('kml', kml_file_id)
+    logger.info(f"Reprocessed {processed_count} KML rows, {cleaned_count} changed")
+    return processed_count, cleaned_count
+
+def update_rows(model, objs, fields, using='default'):
+    """Write the given fields of many instances with one executemany UPDATE
+
+    bulk_update builds a CASE expression per field and row, which dominates the runtime for a few
+    thousand rows; a parameterized UPDATE ... WHERE pk = %s does not.
+    """
+    from django.db import connections
+
+    if not objs:
+        return
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    columns = [model._meta.get_field(name) for name in fields]
+    pk = model._meta.pk
+    sql = (
+        f"UPDATE {quote(model._meta.db_table)} "
+        f"SET {', '.join(f'{quote(field.column)} = %s' for field in columns)} "
+        f"WHERE {quote(pk.column)} = %s"
+    )
+    params = [
+        [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in columns]
+        + [pk.get_db_prep_value(obj.pk, connection)]
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+def _blank(value):
+    """None, NaN and the empty string all mean 'no value'"""
+    return value is None or value == '' or (isinstance(value, float) and np.isnan(value))
+
+def _same(a, b):
+    """Whether a reprocessed value equals the stored one (blanks are equal, numbers compare numerically)"""
+    if _blank(a) or _blank(b):
+        return _blank(a) and _blank(b)
+    if isinstance(a, (int, float, Decimal)) and isinstance(b, (int, float, Decimal)):
+        return float(a) == float(b)
+    return a == b
@@ -1,21 +1,39 @@
 import os
 import json
+import math
 import csv
 import zipfile
 import tempfile
+import hashlib
+import threading
+import uuid
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from shapely.geometry import Point, Polygon, LineString, mapping
 from shapely.wkt import loads
 import pyogrio
+import pyogrio.raw
+
+# Arrow-backed reads need pyarrow; without it layers are read column-wise through pyogrio.raw
+try:
+    import pyarrow
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+    pyarrow = None
 import xml.etree.ElementTree as ET
+from contextlib import contextmanager
 from io import StringIO, BytesIO
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.core.files.storage import default_storage
+from django.db import transaction
 import logging
 from decimal import Decimal
 import re
+from xml.sax.saxutils import escape
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +41,7 @@ class FileValidator:
     """Comprehensive file validation utility"""
     
     ALLOWED_EXTENSIONS = {
-        'kml': ['.kml'],
+        'kml': ['.kml', '.kmz'],
         'csv': ['.csv'],
         'shapefile': ['.shp', '.zip'],
         'geojson': ['.geojson', '.json'],
@@ -150,25 +168,17 @@ class FileValidator:
     
     @classmethod
     def _validate_kml(cls, file_obj):
-        """Validate KML file content"""
+        """Validate KML file content up to its first placemark; extraction finishes the parse"""
+        from .kml_utils import KMLParseSession
+        
         errors = []
         try:
-            tree = ET.parse(file_obj)
-            root = tree.getroot()
-            
-            # Check for KML namespace
-            if not root.tag.endswith('kml'):
-                errors.append("Invalid KML file: missing or incorrect root element")
-            
-            # Check for placemarks
-            placemarks = root.findall('.//{http://www.opengis.net/kml/2.2}Placemark')
-            if not placemarks:
-                errors.append("KML file contains no placemarks")
-                
-        except ET.ParseError:
-            errors.append("Invalid KML file: XML parsing error")
+            with KMLParseSession(file_obj) as session:
+                errors.extend(session.validate())
         except Exception as e:
             errors.append(f"KML validation error: {str(e)}")
+        finally:
+            file_obj.seek(0)
         
         return errors
     
@@ -285,17 +295,448 @@ class FileValidator:
         
         return errors
 
+class BulkInserter:
+    """Buffer model instances and flush them with bulk_create in fixed-size batches"""
+    
+    def __init__(self, model, batch_size=None, progress_callback=None, label=None, stats=None):
+        self.model = model
+        self.batch_size = batch_size or getattr(settings, 'INGEST_BATCH_SIZE', 1000)
+        self.progress_callback = progress_callback
+        self.label = label or model.__name__
+        self.stats = stats
+        self.buffer = []
+        self.count = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Only flush the tail when ingestion finished cleanly
+        if exc_type is None:
+            self.flush()
+        return False
+    
+    def add(self, instance):
+        """Queue an instance, flushing once the buffer reaches batch_size"""
+        # bulk_create skips save(), so derived columns (bbox, WKB, dedup key) are filled here
+        if hasattr(instance, 'fill_bbox') and instance.min_lon is None:
+            instance.fill_bbox()
+        if hasattr(instance, 'fill_geometry_wkb') and instance.geometry_wkb is None:
+            instance.fill_geometry_wkb()
+        if hasattr(instance, 'fill_dedup_key'):
+            instance.fill_dedup_key()
+        self.buffer.append(instance)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered instances in a single bulk_create"""
+        if not self.buffer:
+            return
+        self.model.objects.bulk_create(self.buffer, batch_size=self.batch_size)
+        if self.stats is not None:
+            self.stats.add_instances(self.buffer)
+        self.count += len(self.buffer)
+        self.buffer = []
+        logger.info(f"{self.label}: {self.count} rows inserted")
+        if self.progress_callback:
+            self.progress_callback(self.count)
+
+class IngestStats:
+    """Running bbox, vertex, per-type and area totals for one ingestion, kept in O(1) memory"""
+    
+    def __init__(self):
+        self.count = 0
+        self.vertex_count = 0
+        self.type_counts = {}
+        self.area_sqm = 0.0
+        self.min_lon = self.min_lat = float('inf')
+        self.max_lon = self.max_lat = float('-inf')
+    
+    def add(self, geometry_type, bbox=None, vertex_count=0, area_sqm=None):
+        """Fold one geometry into the totals; bbox is (min_lon, min_lat, max_lon, max_lat)"""
+        self.count += 1
+        self.type_counts[geometry_type] = self.type_counts.get(geometry_type, 0) + 1
+        self.vertex_count += vertex_count
+        if area_sqm:
+            self.area_sqm += float(area_sqm)
+        if bbox is not None and None not in bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            self.min_lon = min(self.min_lon, min_lon)
+            self.min_lat = min(self.min_lat, min_lat)
+            self.max_lon = max(self.max_lon, max_lon)
+            self.max_lat = max(self.max_lat, max_lat)
+    
+    def add_instances(self, instances):
+        """Fold a batch of *Data rows in, decoding their WKB once for vertex counts and missing areas"""
+        from .spatial import geodesic_areas
+        
+        geometries = shapely.from_wkb(
+            [bytes(instance.geometry_wkb) if instance.geometry_wkb else None for instance in instances],
+            on_invalid='ignore',
+        )
+        vertex_counts = shapely.get_num_coordinates(geometries).tolist()
+        areas = geodesic_areas(geometries).tolist()
+        for instance, vertex_count, area in zip(instances, vertex_counts, areas):
+            area_sqm = getattr(instance, 'area_sqm', None) or (area if np.isfinite(area) else None)
+            bbox = (instance.min_lon, instance.min_lat, instance.max_lon, instance.max_lat)
+            self.add(instance.geometry_type, bbox, vertex_count, area_sqm)
+    
+    @classmethod
+    def from_queryset(cls, queryset, chunk_size=2000):
+        """Totals for rows that are already stored, read from their bbox and WKB columns only"""
+        stats = cls()
+        fields = ['pk', 'geometry_type', 'geometry_wkb', 'min_lon', 'min_lat', 'max_lon', 'max_lat']
+        if any(field.name == 'area_sqm' for field in queryset.model._meta.concrete_fields):
+            fields.append('area_sqm')
+        chunk = []
+        for row in queryset.only(*fields).iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                stats.add_instances(chunk)
+                chunk = []
+        if chunk:
+            stats.add_instances(chunk)
+        return stats
+    
+    @property
+    def bounds(self):
+        if self.min_lon > self.max_lon:
+            return {}
+        return {
+            'min_lat': self.min_lat,
+            'max_lat': self.max_lat,
+            'min_lon': self.min_lon,
+            'max_lon': self.max_lon
+        }
+    
+    @property
+    def geometry_type(self):
+        """The single geometry type of the upload, 'Mixed' for several, None when empty"""
+        if not self.type_counts:
+            return None
+        if len(self.type_counts) == 1:
+            return next(iter(self.type_counts))
+        return 'Mixed'
+    
+    def summary(self):
+        return {
+            'vertex_count': self.vertex_count,
+            'type_counts': self.type_counts,
+            'area_sqm': round(self.area_sqm, 2),
+            'area_hectares': round(self.area_sqm / 10000, 6),
+        }
+    
+    def apply(self, file_upload, **fields):
+        """Write bounds, feature_count, geometry_type and the summary onto a FileUpload in a single UPDATE"""
+        file_upload.bounds = self.bounds
+        file_upload.feature_count = self.count
+        file_upload.geometry_type = self.geometry_type
+        file_upload.metadata = {**(file_upload.metadata or {}), 'geometry_stats': self.summary()}
+        for name, value in fields.items():
+            setattr(file_upload, name, value)
+        file_upload.save(update_fields=['bounds', 'feature_count', 'geometry_type', 'metadata', 'updated_at', *fields])
+
+class ContentStore:
+    """Content-addressed blob storage: each distinct upload is written once under blobs/"""
+    
+    BLOB_DIR = 'blobs'
+    CHUNK_SIZE = 64 * 1024
+    
+    @classmethod
+    def blob_name(cls, sha256, ext):
+        """Storage name for a blob with the given digest and extension"""
+        return f"{cls.BLOB_DIR}/{sha256[:2]}/{sha256}{ext.lower()}"
+    
+    @classmethod
+    @contextmanager
+    def storing(cls, uploaded_file):
+        """Stream an uploaded file to disk while hashing it; yields (storage name, sha256, size).
+        
+        The caller records the upload inside the block and the blob is moved into place afterwards,
+        so a concurrent release() of identical content always sees the new reference first.
+        """
+        ext = os.path.splitext(uploaded_file.name)[1]
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, cls.BLOB_DIR, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=ext)
+        try:
+            if hasattr(uploaded_file, 'seek'):
+                uploaded_file.seek(0)
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in uploaded_file.chunks(cls.CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            yield cls.blob_name(sha256, ext), sha256, size
+            cls._commit(tmp_path, sha256, ext)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if hasattr(uploaded_file, 'seek'):
+                uploaded_file.seek(0)
+    
+    @classmethod
+    def adopt(cls, name):
+        """Move an already stored file into the blob store; returns (blob name, sha256)"""
+        path = default_storage.path(name)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        blob = cls._commit(path, sha256, os.path.splitext(name)[1])
+        if os.path.exists(path) and os.path.abspath(path) != os.path.abspath(default_storage.path(blob)):
+            os.remove(path)
+        return blob, sha256
+    
+    @classmethod
+    def save_path(cls, path, sha256, ext):
+        """Move an already hashed local file (e.g. an assembled chunked upload) into the blob store"""
+        name = cls._commit(path, sha256, ext)
+        # An identical blob was already stored, so the local copy is redundant
+        if os.path.exists(path):
+            os.remove(path)
+        return name
+    
+    @classmethod
+    def _commit(cls, path, sha256, ext):
+        """Move a finished file to its blob path unless an identical blob already exists"""
+        name = cls.blob_name(sha256, ext)
+        final_path = default_storage.path(name)
+        if not os.path.exists(final_path):
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(path, final_path)
+        return name
+    
+    @classmethod
+    def is_referenced(cls, name):
+        """Whether any upload record still points at the stored file"""
+        from .models import FileUpload, KMLFile
+        
+        return (KMLFile.objects.filter(file=name).exists() or
+                FileUpload.objects.filter(file=name).exists())
+    
+    @classmethod
+    def release(cls, name):
+        """Delete a stored file once no upload record references it.
+        
+        The blob is moved aside before the final reference check, so an identical upload recorded
+        in between gets the content back instead of pointing at a deleted file.
+        """
+        if not name or cls.is_referenced(name):
+            return False
+        path = default_storage.path(name)
+        released = f"{path}.{uuid.uuid4().hex}.released"
+        try:
+            os.replace(path, released)
+        except FileNotFoundError:
+            return False
+        if cls.is_referenced(name):
+            # Same bytes either way, so overwriting a blob the new upload already wrote is harmless
+            os.replace(released, path)
+            return False
+        os.remove(released)
+        return True
+
+class UploadOffsetError(ValueError):
+    """A chunk was sent for an offset other than the number of bytes already received"""
+
+class ChunkedUpload:
+    """Resumable uploads: chunks are appended to a partial file on disk and hashed as they arrive"""
+    
+    PARTIAL_DIR = 'partial'
+    COPY_SIZE = 64 * 1024
+    
+    # Running SHA-256 per upload in this process: upload id -> (bytes hashed, hasher).
+    # Another worker (or a restart) finishing the upload falls back to hashing the file once.
+    _hashers = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def part_path(cls, session):
+        return os.path.join(str(settings.MEDIA_ROOT), ContentStore.BLOB_DIR, cls.PARTIAL_DIR, f'{session.id}.part')
+    
+    @classmethod
+    def start(cls, user, filename, total_size):
+        """Open an upload session after checking the name and declared size against FileValidator's limits"""
+        from .models import UploadSession
+        
+        filename = os.path.basename(filename or '')
+        extension = os.path.splitext(filename.lower())[1]
+        file_type = next((t for t, extensions in FileValidator.ALLOWED_EXTENSIONS.items() if extension in extensions), None)
+        if file_type is None:
+            raise ValueError(f"File extension '{extension}' is not allowed")
+        max_size = FileValidator.MAX_FILE_SIZES.get(file_type, 50) * 1024 * 1024
+        if total_size <= 0 or total_size > max_size:
+            raise ValueError(f"File size must be between 1 byte and {max_size // (1024 * 1024)}MB for {file_type} files")
+        
+        cls.expire_stale()
+        session = UploadSession.objects.create(user=user, filename=filename, file_type=file_type, total_size=total_size)
+        path = cls.part_path(session)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        with cls._lock:
+            cls._hashers[session.id] = (0, hashlib.sha256())
+        return session
+    
+    @classmethod
+    def append(cls, session, offset, stream):
+        """Append the bytes of stream at offset; returns the new offset
+
+        Bytes written before a dropped connection are kept, so the client resumes from the returned
+        (or GET-reported) offset rather than resending the whole chunk.
+        """
+        if session.status != 'uploading':
+            raise ValueError(f"Upload is {session.status}")
+        if offset != session.received_size:
+            raise UploadOffsetError(f"Expected offset {session.received_size}, got {offset}")
+        
+        with cls._lock:
+            hashed, hasher = cls._hashers.get(session.id, (None, None))
+        if hashed != offset:
+            hasher = None
+        
+        received = offset
+        try:
+            with open(cls.part_path(session), 'r+b') as f:
+                # Drop anything past the recorded offset left by an interrupted write
+                f.truncate(offset)
+                f.seek(offset)
+                for block in iter(lambda: stream.read(cls.COPY_SIZE), b''):
+                    if received + len(block) > session.total_size:
+                        raise ValueError(f"Chunk runs past the declared size of {session.total_size} bytes")
+                    f.write(block)
+                    if hasher is not None:
+                        hasher.update(block)
+                    received += len(block)
+        finally:
+            session.received_size = received
+            session.save(update_fields=['received_size', 'updated_at'])
+            with cls._lock:
+                if hasher is not None:
+                    cls._hashers[session.id] = (received, hasher)
+                else:
+                    cls._hashers.pop(session.id, None)
+        return received
+    
+    @classmethod
+    def validate(cls, session):
+        """FileValidator errors for a fully received upload"""
+        if session.received_size != session.total_size:
+            return [f"Upload incomplete: {session.received_size} of {session.total_size} bytes received"]
+        with open(cls.part_path(session), 'rb') as f:
+            return FileValidator.validate_file(f, session.filename, session.file_type)['errors']
+    
+    @classmethod
+    @contextmanager
+    def finish(cls, session):
+        """Yield (storage name, sha256, size) for the assembled file, then move it into the content store"""
+        path = cls.part_path(session)
+        with cls._lock:
+            hashed, hasher = cls._hashers.pop(session.id, (None, None))
+        if hashed != session.received_size:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(ContentStore.CHUNK_SIZE), b''):
+                    hasher.update(block)
+        sha256 = hasher.hexdigest()
+        ext = os.path.splitext(session.filename)[1]
+        yield ContentStore.blob_name(sha256, ext), sha256, session.received_size
+        ContentStore.save_path(path, sha256, ext)
+    
+    @classmethod
+    def abort(cls, session):
+        """Discard the partial file of an upload"""
+        with cls._lock:
+            cls._hashers.pop(session.id, None)
+        path = cls.part_path(session)
+        if os.path.exists(path):
+            os.remove(path)
+        session.status = 'aborted'
+        session.save(update_fields=['status', 'updated_at'])
+    
+    @classmethod
+    def expire_stale(cls):
+        """Abort uploads that have not received a chunk within UPLOAD_SESSION_TTL seconds"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import UploadSession
+        
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'UPLOAD_SESSION_TTL', 24 * 3600))
+        for session in UploadSession.objects.filter(status='uploading', updated_at__lt=cutoff):
+            cls.abort(session)
+
+def copy_parsed_rows(queryset, **overrides):
+    """Copy already-parsed rows onto another upload with bulk_create instead of reparsing"""
+    writer = BulkInserter(queryset.model)
+    with transaction.atomic(), writer:
+        for obj in queryset.order_by('pk').iterator(chunk_size=writer.batch_size):
+            obj.pk = None
+            obj._state.adding = True
+            for field, value in overrides.items():
+                setattr(obj, field, value)
+            writer.add(obj)
+    return writer.count
+
+class Echo:
+    """Pseudo-buffer whose write() hands the value back, so csv.writer can feed a generator"""
+    
+    def write(self, value):
+        return value
+
+def iter_export_rows(objects):
+    """Iterate a queryset in chunks (or any plain iterable) without caching the whole result"""
+    if hasattr(objects, 'iterator'):
+        return objects.iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+    return iter(objects)
+
+def stream_csv(header, rows, bom=False):
+    """Yield CSV text line by line for a StreamingHttpResponse"""
+    writer = csv.writer(Echo())
+    if bom:
+        yield '\ufeff'
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+def on_stream_complete(response, callback):
+    """Call callback(total_bytes) once a streaming response has been fully sent"""
+    def counted(chunks):
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+        callback(total)
+    response.streaming_content = counted(response.streaming_content)
+    return response
+
+# Geometry type names indexed by shapely.get_type_id
+GEOMETRY_TYPE_NAMES = [
+    'Point', 'LineString', 'LinearRing', 'Polygon', 'MultiPoint',
+    'MultiLineString', 'MultiPolygon', 'GeometryCollection',
+]
+
 class FileProcessor:
     """Comprehensive file processor for KML, CSV, and Shapefile handling"""
     
-    def __init__(self, file_upload):
+    def __init__(self, file_upload, progress_callback=None):
         self.file_upload = file_upload
+        self.progress_callback = progress_callback
         self.file_path = file_upload.file.path
         self.file_type = file_upload.file_type
         
     def process_file(self):
         """Process uploaded file based on its type"""
         try:
+            reused = self._reuse_duplicate()
+            if reused:
+                return reused
+            
             if self.file_type == 'kml':
                 return self._process_kml()
             elif self.file_type == 'csv':
@@ -308,77 +749,155 @@ class FileProcessor:
             logger.error(f"Error processing file {self.file_upload.id}: {e}")
             raise
     
-    def _process_kml(self):
-        """Process KML file and extract data"""
-        from .kml_utils import KMLParser
+    def _reuse_duplicate(self):
+        """Copy rows from an already processed upload with identical content, skipping the parse"""
+        content_hash = self.file_upload.content_hash
+        if not content_hash:
+            return None
         
-        parser = KMLParser(self.file_path)
-        parsed_data = parser.parse_kml()
+        from .models import FileUpload
         
-        if not parsed_data:
-            raise ValueError("No valid placemarks found in KML file")
+        if self.file_type == 'kml':
+            from .kml_utils import reuse_parsed_kml
+            
+            kml_file = self._get_kml_file()
+            if kml_file.parsed_data.exists():
+                # Rows already parsed for this exact content need no further work
+                if kml_file.content_hash != content_hash:
+                    return None
+            else:
+                if kml_file.content_hash != content_hash:
+                    kml_file.content_hash = content_hash
+                    kml_file.save(update_fields=['content_hash'])
+                if not reuse_parsed_kml(kml_file):
+                    return None
+            data_count = kml_file.parsed_data.count()
+            
+            source_upload = FileUpload.objects.filter(
+                content_hash=content_hash, file_type='kml', status='completed'
+            ).exclude(id=self.file_upload.id).first()
+        else:
+            source_upload = FileUpload.objects.filter(
+                content_hash=content_hash, file_type=self.file_type, status='completed'
+            ).exclude(id=self.file_upload.id).order_by('-created_at').first()
+            if source_upload is None:
+                return None
+            
+            if self.file_type == 'csv':
+                data_count = copy_parsed_rows(source_upload.csv_data.all(), file_upload=self.file_upload)
+            elif self.file_type == 'shapefile':
+                data_count = copy_parsed_rows(source_upload.shapefile_data.all(), file_upload=self.file_upload)
+            else:
+                return None
+        
+        if source_upload is not None:
+            self.file_upload.geometry_type = source_upload.geometry_type
+            self.file_upload.coordinate_system = source_upload.coordinate_system
+            self.file_upload.bounds = source_upload.bounds
+            if 'geometry_stats' in source_upload.metadata:
+                self.file_upload.metadata = {**self.file_upload.metadata, 'geometry_stats': source_upload.metadata['geometry_stats']}
+            self.file_upload.feature_count = data_count
+            self.file_upload.status = 'completed'
+            self.file_upload.save()
+        else:
+            # Source came from the KML upload page, so derive metadata from the copied rows' bbox/WKB columns
+            IngestStats.from_queryset(kml_file.parsed_data.all()).apply(self.file_upload, status='completed')
+        
+        logger.info(f"Reused {data_count} parsed rows for duplicate upload {self.file_upload.id}")
+        return {
+            'success': True,
+            'data_count': data_count,
+            'geometry_type': self.file_upload.geometry_type,
+            'bounds': self.file_upload.bounds,
+            'reused': True
+        }
+    
+    def _process_kml(self):
+        """Process KML file and extract data"""
+        from .kml_utils import iter_kml_placemarks
         
         # Save to KMLData model
         from .models import KMLData
-        kml_data_objects = []
+        kml_file = self._get_kml_file()
+        stats = IngestStats()
         
-        for data in parsed_data:
-            kml_data = KMLData.objects.create(
-                kml_file=self.file_upload.kml_files.first() if hasattr(self.file_upload, 'kml_files') else None,
-                placemark_name=data.get('placemark_name', ''),
-                kitta_number=data.get('kitta_number', ''),
-                owner_name=data.get('owner_name', ''),
-                geometry_type=data.get('geometry_type', ''),
-                coordinates=data.get('coordinates', ''),
-                area_hectares=data.get('area_hectares'),
-                area_sqm=data.get('area_sqm'),
-                description=data.get('description', ''),
-                extended_data=data.get('extended_data', {}),
-                time_begin=data.get('time_begin', ''),
-                time_end=data.get('time_end', ''),
-                time_when=data.get('time_when', ''),
-                altitude=data.get('altitude', ''),
-                altitude_mode=data.get('altitude_mode', ''),
-                tessellate=data.get('tessellate', ''),
-                extrude=data.get('extrude', ''),
-                style_id=data.get('style_id', ''),
-                style_url=data.get('style_url', ''),
-                address=data.get('address', ''),
-                country_code=data.get('country_code', ''),
-                administrative_area=data.get('administrative_area', ''),
-                sub_administrative_area=data.get('sub_administrative_area', ''),
-                locality=data.get('locality', ''),
-                sub_locality=data.get('sub_locality', ''),
-                thoroughfare=data.get('thoroughfare', ''),
-                postal_code=data.get('postal_code', ''),
-                phone_number=data.get('phone_number', ''),
-                snippet=data.get('snippet', ''),
-                visibility=data.get('visibility', ''),
-                open_status=data.get('open', ''),
-                atom_author=data.get('atom_author', ''),
-                atom_link=data.get('atom_link', ''),
-                xal_address_details=data.get('xal_address_details', ''),
-            )
-            kml_data_objects.append(kml_data)
+        # Validation of the whole document happens in this same pass
+        with transaction.atomic(), BulkInserter(KMLData, progress_callback=self.progress_callback, stats=stats) as writer:
+            for data in iter_kml_placemarks(self.file_path):
+                writer.add(self._build_kml_data(kml_file, data))
+        data_count = writer.count
+        
+        if not data_count:
+            raise ValueError("No valid placemarks found in KML file")
+        
+        kml_file.is_processed = True
+        kml_file.processing_status = 'completed'
+        kml_file.save(update_fields=['is_processed', 'processing_status', 'updated_at'])
         
         # Update file metadata
-        self.file_upload.geometry_type = self._get_geometry_type_from_data(parsed_data)
-        self.file_upload.feature_count = len(parsed_data)
-        self.file_upload.bounds = self._calculate_bounds(parsed_data)
-        self.file_upload.status = 'completed'
-        self.file_upload.save()
+        stats.apply(self.file_upload, status='completed')
         
         return {
             'success': True,
-            'data_count': len(parsed_data),
+            'data_count': data_count,
             'geometry_type': self.file_upload.geometry_type,
             'bounds': self.file_upload.bounds
         }
     
+    def _get_kml_file(self):
+        """Get or create the KMLFile that holds parsed rows for this upload"""
+        return get_kml_file_for_upload(self.file_upload, create=True)
+    
+    def _build_kml_data(self, kml_file, data):
+        """Build an unsaved KMLData instance from a parsed placemark dict"""
+        from .models import KMLData
+        
+        return KMLData(
+            kml_file=kml_file,
+            placemark_name=data.get('placemark_name', ''),
+            kitta_number=data.get('kitta_number', ''),
+            owner_name=data.get('owner_name', ''),
+            geometry_type=data.get('geometry_type', ''),
+            coordinates=data.get('coordinates', ''),
+            area_hectares=data.get('area_hectares'),
+            area_sqm=data.get('area_sqm'),
+            description=data.get('description', ''),
+            extended_data=data.get('extended_data', {}),
+            time_begin=data.get('time_begin', ''),
+            time_end=data.get('time_end', ''),
+            time_when=data.get('time_when', ''),
+            altitude=data.get('altitude', ''),
+            altitude_mode=data.get('altitude_mode', ''),
+            tessellate=data.get('tessellate', ''),
+            extrude=data.get('extrude', ''),
+            style_id=data.get('style_id', ''),
+            style_url=data.get('style_url', ''),
+            address=data.get('address', ''),
+            country_code=data.get('country_code', ''),
+            administrative_area=data.get('administrative_area', ''),
+            sub_administrative_area=data.get('sub_administrative_area', ''),
+            locality=data.get('locality', ''),
+            sub_locality=data.get('sub_locality', ''),
+            thoroughfare=data.get('thoroughfare', ''),
+            postal_code=data.get('postal_code', ''),
+            phone_number=data.get('phone_number', ''),
+            snippet=data.get('snippet', ''),
+            visibility=data.get('visibility', ''),
+            open_status=data.get('open', ''),
+            atom_author=data.get('atom_author', ''),
+            atom_link=data.get('atom_link', ''),
+            xal_address_details=data.get('xal_address_details', ''),
+            # Precomputed by parallel extraction workers; BulkInserter fills them otherwise
+            min_lon=data.get('min_lon'),
+            min_lat=data.get('min_lat'),
+            max_lon=data.get('max_lon'),
+            max_lat=data.get('max_lat'),
+            geometry_wkb=data.get('geometry_wkb'),
+        )
+    
     def _process_csv(self):
         """Process CSV file and extract data, supporting polygons via 'Coordinates' column"""
         try:
-            import ast
             # Read CSV file
             df = pd.read_csv(self.file_path)
             print('CSV Columns:', df.columns)
@@ -389,72 +908,71 @@ class FileProcessor:
             # Detect coordinate columns
             lat_col, lon_col = self._detect_coordinate_columns(df)
             print('Detected lat_col:', lat_col, 'lon_col:', lon_col)
-            if not lat_col and not lon_col and 'coordinates' not in [c.lower() for c in df.columns]:
+            coords_cols = [c for c in df.columns if c.lower() == 'coordinates']
+            if not (lat_col and lon_col) and not coords_cols:
                 print('No coordinates column found')
                 raise ValueError("Could not detect latitude and longitude columns or 'Coordinates' column")
 
-            from .models import CSVData
-            csv_data_objects = []
+            # Build the geometry columns for the whole frame at once
+            if lat_col and lon_col:
+                geometry_type = 'Point'
+                lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=float)
+                lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=float)
+                valid = np.isfinite(lat) & np.isfinite(lon)
+                coords_column = [[x, y] for x, y in zip(lon.tolist(), lat.tolist())]
+                bbox_column = [(x, y, x, y) for x, y in zip(lon.tolist(), lat.tolist())]
+                wkb_column = shapely.to_wkb(shapely.points(lon, lat)).tolist()
+            else:
+                geometry_type = 'Polygon'
+                coords_column = df[coords_cols[0]].map(self._parse_coordinate_cell).tolist()
+                valid = np.fromiter((bool(c) for c in coords_column), dtype=bool, count=len(coords_column))
+                rings = [np.asarray(c, dtype=float) if ok else None for c, ok in zip(coords_column, valid)]
+                bbox_column = [
+                    (*ring.min(axis=0).tolist(), *ring.max(axis=0).tolist()) if ring is not None else None
+                    for ring in rings
+                ]
+                wkb_column = [None] * len(rings)  # encoded per row by BulkInserter
 
-            for index, row in df.iterrows():
-                try:
-                    print(f'Processing row {index+1}')
-                    if lat_col and lon_col:
-                        lat = float(row[lat_col])
-                        lon = float(row[lon_col])
-                        geometry_type = 'Point'
-                        coords = [lon, lat]
-                    elif 'coordinates' in [c.lower() for c in df.columns]:
-                        # Parse the first coordinate pair from the string
-                        coords_val = row[[c for c in df.columns if c.lower() == 'coordinates'][0]]
-                        coords_list = ast.literal_eval(coords_val)
-                        if not coords_list or not isinstance(coords_list, list):
-                            print('Invalid coordinates list:', coords_list)
-                            continue
-                        lon, lat = coords_list[0]
-                        geometry_type = 'Polygon'
-                        coords = coords_list
-                    else:
-                        print('No valid coordinates for row', index+1)
-                        continue
+            skipped = int((~valid).sum())
+            if skipped:
+                print(f"Skipping {skipped} CSV rows without valid coordinates")
+
+            # Sanitize row data for JSONField: NaN/inf become None across the frame
+            clean = df.replace([np.inf, -np.inf], np.nan)
+            clean = clean.astype(object).where(clean.notna(), None)
+            records = clean.to_dict('records')
+
+            from .models import CSVData
 
-                    # Sanitize row data for JSONField
-                    row_data = {}
-                    for k, v in row.items():
-                        if pd.isna(v):
-                            row_data[k] = None
-                        elif isinstance(v, float) and (v == float('inf') or v == float('-inf')):
-                            row_data[k] = None
-                        elif k.lower() == 'coordinates' and isinstance(v, (list, dict)):
-                            row_data[k] = str(v)
-                        else:
-                            row_data[k] = v
+            stats = IngestStats()
+            with transaction.atomic(), BulkInserter(CSVData, progress_callback=self.progress_callback, stats=stats) as writer:
+                for index in np.flatnonzero(valid).tolist():
+                    coords = coords_column[index]
+                    min_lon, min_lat, max_lon, max_lat = bbox_column[index]
+                    row_data = records[index]
                     row_data['_geometry_type'] = geometry_type
                     row_data['_coordinates'] = coords
-
-                    csv_data = CSVData.objects.create(
+                    writer.add(CSVData(
                         file_upload=self.file_upload,
                         row_number=index + 1,
                         data=row_data,
                         geometry_type=geometry_type,
-                        coordinates=json.dumps(coords)
-                    )
-                    csv_data_objects.append(csv_data)
-                except (ValueError, TypeError, SyntaxError) as e:
-                    print(f"Error processing CSV row {index + 1}: {e}")
-                    continue
+                        coordinates=json.dumps(coords),
+                        min_lon=min_lon,
+                        min_lat=min_lat,
+                        max_lon=max_lon,
+                        max_lat=max_lat,
+                        geometry_wkb=wkb_column[index],
+                    ))
 
             # Update file metadata
-            self.file_upload.geometry_type = geometry_type if csv_data_objects else None
-            self.file_upload.feature_count = len(csv_data_objects)
-            self.file_upload.bounds = self._calculate_csv_bounds(csv_data_objects)
-            self.file_upload.status = 'completed'
-            self.file_upload.save()
+            data_count = writer.count
+            stats.apply(self.file_upload, status='completed')
 
             return {
                 'success': True,
-                'data_count': len(csv_data_objects),
-                'geometry_type': geometry_type if csv_data_objects else None,
+                'data_count': data_count,
+                'geometry_type': self.file_upload.geometry_type,
                 'bounds': self.file_upload.bounds,
                 'columns': list(df.columns)
             }
@@ -463,72 +981,84 @@ class FileProcessor:
             logger.error(f"Error processing CSV file: {e}")
             raise
     
+    def _parse_coordinate_cell(self, value):
+        """Parse a 'Coordinates' cell into a list of [lon, lat] pairs, or None if invalid"""
+        if not isinstance(value, str):
+            return None
+        try:
+            coords = json.loads(value)
+        except ValueError:
+            try:
+                import ast
+                coords = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                return None
+        if not coords or not isinstance(coords, (list, tuple)):
+            return None
+        
+        # Every position must be a list of at least two finite numbers; extra values (altitude) are dropped
+        ring = []
+        for position in coords:
+            if not isinstance(position, (list, tuple)) or len(position) < 2:
+                return None
+            x, y = position[0], position[1]
+            if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (x, y)):
+                return None
+            if not (math.isfinite(x) and math.isfinite(y)):
+                return None
+            ring.append([float(x), float(y)])
+        return ring
+    
     def _process_shapefile(self):
-        """Process Shapefile (ZIP) and extract data"""
+        """Process Shapefile (ZIP) and extract data, reading straight from the archive"""
         try:
-            # Extract ZIP file
-            temp_dir = tempfile.mkdtemp()
-            
-            with zipfile.ZipFile(self.file_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            
-            # Find .shp file
-            shp_files = [f for f in os.listdir(temp_dir) if f.endswith('.shp')]
-            if not shp_files:
-                raise ValueError("No .shp file found in ZIP")
+            crs, wkb, attributes = self._read_shapefile_columns(self._shapefile_source())
+            # Stored rows, bounds and geodesic areas are all lon/lat, whatever the layer's projection
+            from .spatial import to_lonlat
             
-            shp_path = os.path.join(temp_dir, shp_files[0])
-            
-            # Read shapefile using geopandas
-            gdf = gpd.read_file(shp_path, engine='pyogrio')
-            
-            if gdf.empty:
+            if not crs:
+                logger.warning(f"Shapefile for upload {self.file_upload.id} has no .prj; assuming lon/lat")
+            geometries = to_lonlat(shapely.from_wkb(wkb), crs)
+            present = ~shapely.is_missing(geometries)
+            if not len(geometries):
                 raise ValueError("Shapefile is empty")
             
-            # Process each feature
+            # Geometry-derived columns for the whole layer at once
+            type_names = [GEOMETRY_TYPE_NAMES[type_id] if type_id >= 0 else None for type_id in shapely.get_type_id(geometries).tolist()]
+            bounds_column = shapely.bounds(geometries).tolist()
+            wkb_column = shapely.to_wkb(shapely.force_2d(geometries)).tolist()
+            
             from .models import ShapefileData
-            shapefile_data_objects = []
             
-            for index, row in gdf.iterrows():
-                try:
-                    geometry = row.geometry
-                    if geometry is None:
+            stats = IngestStats()
+            with transaction.atomic(), BulkInserter(ShapefileData, progress_callback=self.progress_callback, stats=stats) as writer:
+                for index in np.flatnonzero(present).tolist():
+                    try:
+                        coords = self._geometry_to_coordinates(geometries[index])
+                        min_lon, min_lat, max_lon, max_lat = bounds_column[index]
+                        writer.add(ShapefileData(
+                            file_upload=self.file_upload,
+                            feature_id=index + 1,
+                            geometry_type=type_names[index],
+                            coordinates=json.dumps(coords),
+                            geometry_wkb=wkb_column[index],
+                            attributes=attributes[index],
+                            min_lon=min_lon,
+                            min_lat=min_lat,
+                            max_lon=max_lon,
+                            max_lat=max_lat,
+                        ))
+                    except Exception as e:
+                        logger.warning(f"Error processing shapefile feature {index + 1}: {e}")
                         continue
-                    
-                    # Convert geometry to coordinates
-                    coords = self._geometry_to_coordinates(geometry)
-                    
-                    # Store feature data
-                    attributes = row.drop('geometry').to_dict()
-                    
-                    shapefile_data = ShapefileData.objects.create(
-                        file_upload=self.file_upload,
-                        feature_id=index + 1,
-                        geometry_type=geometry.geom_type,
-                        coordinates=json.dumps(coords),
-                        attributes=attributes
-                    )
-                    shapefile_data_objects.append(shapefile_data)
-                    
-                except Exception as e:
-                    logger.warning(f"Error processing shapefile feature {index + 1}: {e}")
-                    continue
             
             # Update file metadata
-            self.file_upload.geometry_type = gdf.geometry.geom_type.iloc[0] if not gdf.empty else 'Unknown'
-            self.file_upload.coordinate_system = str(gdf.crs) if gdf.crs else 'Unknown'
-            self.file_upload.feature_count = len(shapefile_data_objects)
-            self.file_upload.bounds = self._calculate_shapefile_bounds(shapefile_data_objects)
-            self.file_upload.status = 'completed'
-            self.file_upload.save()
-            
-            # Cleanup
-            import shutil
-            shutil.rmtree(temp_dir)
+            data_count = writer.count
+            stats.apply(self.file_upload, coordinate_system=crs or 'Unknown', status='completed')
             
             return {
                 'success': True,
-                'data_count': len(shapefile_data_objects),
+                'data_count': data_count,
                 'geometry_type': self.file_upload.geometry_type,
                 'coordinate_system': self.file_upload.coordinate_system,
                 'bounds': self.file_upload.bounds
@@ -538,6 +1068,40 @@ class FileProcessor:
             logger.error(f"Error processing shapefile: {e}")
             raise
     
+    def _shapefile_source(self):
+        """GDAL path to the .shp: a /vsizip/ path into the uploaded ZIP, so nothing is extracted"""
+        if not zipfile.is_zipfile(self.file_path):
+            return self.file_path
+        with zipfile.ZipFile(self.file_path) as archive:
+            shp_files = [name for name in archive.namelist() if name.lower().endswith('.shp')]
+        if not shp_files:
+            raise ValueError("No .shp file found in ZIP")
+        shp_name = min(shp_files, key=lambda name: name.count('/'))
+        return f"/vsizip/{os.path.abspath(self.file_path)}/{shp_name}"
+    
+    def _read_shapefile_columns(self, path):
+        """Read a layer column-wise: returns (crs, WKB array, per-feature attribute dicts)"""
+        if ARROW_AVAILABLE:
+            meta, table = pyogrio.read_arrow(path)
+            geometry_name = meta.get('geometry_name') or 'wkb_geometry'
+            wkb = np.array(table.column(geometry_name).to_pylist(), dtype=object)
+            columns = {name: table.column(name).to_pylist() for name in table.column_names if name != geometry_name}
+        else:
+            meta, _, wkb, field_data = pyogrio.raw.read(path, datetime_as_string=True)
+            columns = {name: values.tolist() for name, values in zip(meta['fields'], field_data)}
+        
+        # JSONField rows: NaN becomes None and anything non-JSON (dates, bytes) becomes text
+        names = list(columns)
+        for name in names:
+            columns[name] = [
+                None if value is None or (isinstance(value, float) and not np.isfinite(value))
+                else value if isinstance(value, (str, int, float, bool))
+                else str(value)
+                for value in columns[name]
+            ]
+        attributes = [dict(zip(names, values)) for values in zip(*columns.values())] if names else [{} for _ in range(len(wkb))]
+        return meta.get('crs'), wkb, attributes
+    
     def _detect_coordinate_columns(self, df):
         """Detect latitude and longitude columns in CSV, or fallback to 'Coordinates' column for polygons"""
         columns = df.columns.str.lower()
@@ -583,122 +1147,30 @@ class FileProcessor:
             return list(types)[0]
         else:
             return 'Mixed'
-    
-    def _calculate_bounds(self, data):
-        """Calculate bounds from parsed data"""
-        min_lat, max_lat = float('inf'), float('-inf')
-        min_lon, max_lon = float('inf'), float('-inf')
-        
-        for item in data:
-            try:
-                coords = json.loads(item.get('coordinates', '[]'))
-                if isinstance(coords, list):
-                    if item.get('geometry_type') == 'Point':
-                        lon, lat = coords[0], coords[1]
-                        min_lat = min(min_lat, lat)
-                        max_lat = max(max_lat, lat)
-                        min_lon = min(min_lon, lon)
-                        max_lon = max(max_lon, lon)
-                    elif item.get('geometry_type') == 'Polygon':
-                        for coord in coords:
-                            lon, lat = coord[0], coord[1]
-                            min_lat = min(min_lat, lat)
-                            max_lat = max(max_lat, lat)
-                            min_lon = min(min_lon, lon)
-                            max_lon = max(max_lon, lon)
-            except:
-                continue
-        
-        if min_lat != float('inf'):
-            return {
-                'min_lat': min_lat,
-                'max_lat': max_lat,
-                'min_lon': min_lon,
-                'max_lon': max_lon
-            }
-        return {}
-    
-    def _calculate_csv_bounds(self, csv_data_objects):
-        """Calculate bounds from CSV data"""
-        min_lat, max_lat = float('inf'), float('-inf')
-        min_lon, max_lon = float('inf'), float('-inf')
-        
-        for obj in csv_data_objects:
-            try:
-                coords = json.loads(obj.coordinates)
-                lon, lat = coords[0], coords[1]
-                min_lat = min(min_lat, lat)
-                max_lat = max(max_lat, lat)
-                min_lon = min(min_lon, lon)
-                max_lon = max(max_lon, lon)
-            except:
-                continue
-        
-        if min_lat != float('inf'):
-            return {
-                'min_lat': min_lat,
-                'max_lat': max_lat,
-                'min_lon': min_lon,
-                'max_lon': max_lon
-            }
-        return {}
-    
-    def _calculate_shapefile_bounds(self, shapefile_data_objects):
-        """Calculate bounds from shapefile data"""
-        min_lat, max_lat = float('inf'), float('-inf')
-        min_lon, max_lon = float('inf'), float('-inf')
-        
-        for obj in shapefile_data_objects:
-            try:
-                coords = json.loads(obj.coordinates)
-                if isinstance(coords[0], list):  # Polygon or LineString
-                    for coord in coords:
-                        lon, lat = coord[0], coord[1]
-                        min_lat = min(min_lat, lat)
-                        max_lat = max(max_lat, lat)
-                        min_lon = min(min_lon, lon)
-                        max_lon = max(max_lon, lon)
-                else:  # Point
-                    lon, lat = coords[0], coords[1]
-                    min_lat = min(min_lat, lat)
-                    max_lat = max(max_lat, lat)
-                    min_lon = min(min_lon, lon)
-                    max_lon = max(max_lon, lon)
-            except:
-                continue
-        
-        if min_lat != float('inf'):
-            return {
-                'min_lat': min_lat,
-                'max_lat': max_lat,
-                'min_lon': min_lon,
-                'max_lon': max_lon
-            }
-        return {}
 
 class FileConverter:
     """File conversion utilities"""
     
     @staticmethod
     def kml_to_csv(kml_data_objects, filename):
-        """Convert KML data to CSV"""
+        """Convert KML data to CSV, streamed row by row"""
         try:
-            csv_data = []
-            for kml_data in kml_data_objects:
-                row_data = kml_data.get_all_fields_for_csv()
-                csv_data.append(row_data)
-            
-            if not csv_data:
+            rows = (kml_data.get_all_fields_for_csv() for kml_data in iter_export_rows(kml_data_objects))
+            first = next(rows, None)
+            if first is None:
                 raise ValueError("No data available for conversion")
             
-            df = pd.DataFrame(csv_data)
+            def csv_rows():
+                yield list(first.values())
+                for row_data in rows:
+                    yield list(row_data.values())
             
-            # Create response
-            response = HttpResponse(content_type='text/csv; charset=utf-8')
+            response = StreamingHttpResponse(
+                stream_csv(list(first.keys()), csv_rows(), bom=True),
+                content_type='text/csv; charset=utf-8'
+            )
             response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
             
-            df.to_csv(response, index=False, encoding='utf-8-sig')
-            
             return response
             
         except Exception as e:
@@ -714,18 +1186,12 @@ class FileConverter:
             shapefile_path = os.path.join(temp_dir, f"{filename}.shp")
             
             # Prepare data for GeoDataFrame
+            from .spatial import iter_geometries
+            
             features = []
-            for kml_data in kml_data_objects:
+            for kml_data, geom in iter_geometries(kml_data_objects):
                 try:
-                    coords = json.loads(kml_data.coordinates)
-                    
-                    if kml_data.geometry_type == 'Point':
-                        geom = Point(coords[0], coords[1])
-                    elif kml_data.geometry_type == 'Polygon':
-                        geom = Polygon(coords)
-                    elif kml_data.geometry_type == 'LineString':
-                        geom = LineString(coords)
-                    else:
+                    if geom is None or kml_data.geometry_type not in ('Point', 'Polygon', 'LineString'):
                         continue
                     
                     # Create feature with all available fields
@@ -811,58 +1277,39 @@ class FileConverter:
     
     @staticmethod
     def csv_to_kml(csv_data_objects, filename):
-        """Convert CSV data to KML"""
-        try:
-            from xml.dom.minidom import Document
-            
-            doc = Document()
-            kml_elem = doc.createElement('kml')
-            kml_elem.setAttribute('xmlns', 'http://www.opengis.net/kml/2.2')
-            doc.appendChild(kml_elem)
-            
-            document_elem = doc.createElement('Document')
-            kml_elem.appendChild(document_elem)
-            
-            for csv_data in csv_data_objects:
+        """Convert CSV data to KML, streamed placemark by placemark"""
+        def placemarks():
+            yield '<?xml version="1.0" encoding="utf-8"?>\n'
+            yield '<kml xmlns="http://www.opengis.net/kml/2.2">\n  <Document>\n'
+            for csv_data in iter_export_rows(csv_data_objects):
                 try:
                     data = csv_data.data
                     coords = json.loads(csv_data.coordinates)
-                    
-                    placemark = doc.createElement('Placemark')
-                    
-                    # Add name
-                    name_elem = doc.createElement('name')
-                    name_elem.appendChild(doc.createTextNode(str(data.get('name', f'Point {csv_data.row_number}'))))
-                    placemark.appendChild(name_elem)
-                    
-                    # Add description
-                    desc_elem = doc.createElement('description')
+                    name = str(data.get('name', f'Point {csv_data.row_number}'))
                     desc_text = ', '.join([f"{k}: {v}" for k, v in data.items() if k not in ['name', 'lat', 'lon', 'latitude', 'longitude']])
-                    desc_elem.appendChild(doc.createTextNode(desc_text))
-                    placemark.appendChild(desc_elem)
-                    
-                    # Add point geometry
-                    point_elem = doc.createElement('Point')
-                    coords_elem = doc.createElement('coordinates')
-                    coords_elem.appendChild(doc.createTextNode(f"{coords[0]},{coords[1]}"))
-                    point_elem.appendChild(coords_elem)
-                    placemark.appendChild(point_elem)
                     
-                    document_elem.appendChild(placemark)
+                    if isinstance(coords[0], (list, tuple)):
+                        ring = ' '.join(f"{c[0]},{c[1]}" for c in coords)
+                        geometry = f'<Polygon><outerBoundaryIs><LinearRing><coordinates>{ring}</coordinates></LinearRing></outerBoundaryIs></Polygon>'
+                    else:
+                        geometry = f'<Point><coordinates>{coords[0]},{coords[1]}</coordinates></Point>'
                     
+                    yield (
+                        '    <Placemark>\n'
+                        f'      <name>{escape(name)}</name>\n'
+                        f'      <description>{escape(desc_text)}</description>\n'
+                        f'      {geometry}\n'
+                        '    </Placemark>\n'
+                    )
                 except Exception as e:
                     logger.warning(f"Error processing CSV row for KML: {e}")
                     continue
-            
-            kml_str = doc.toprettyxml(indent='  ', encoding='utf-8')
-            response = HttpResponse(kml_str, content_type='application/vnd.google-earth.kml+xml')
-            response['Content-Disposition'] = f'attachment; filename="{filename}.kml"'
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Error converting CSV to KML: {e}")
-            raise
+            yield '  </Document>\n</kml>\n'
+        
+        response = StreamingHttpResponse(placemarks(), content_type='application/vnd.google-earth.kml+xml')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.kml"'
+        
+        return response
     
     @staticmethod
     def csv_to_shapefile(csv_data_objects, filename):
@@ -873,18 +1320,12 @@ class FileConverter:
             shapefile_path = os.path.join(temp_dir, f"{filename}.shp")
             
             # Prepare data for GeoDataFrame
+            from .spatial import iter_geometries
+            
             features = []
-            for csv_data in csv_data_objects:
+            for csv_data, geom in iter_geometries(csv_data_objects):
                 try:
-                    coords = json.loads(csv_data.coordinates)
-                    # Detect geometry type
-                    if isinstance(coords[0], (float, int)) and isinstance(coords[1], (float, int)):
-                        # Point geometry
-                        geom = Point(coords[0], coords[1])
-                    elif isinstance(coords[0], (list, tuple)) and len(coords[0]) == 2:
-                        # Polygon geometry (list of [lon, lat] pairs)
-                        geom = Polygon(coords)
-                    else:
+                    if geom is None:
                         raise ValueError("Invalid coordinates format for shapefile export")
                     # Create feature with all data
                     feature = {
@@ -1066,12 +1507,7 @@ class FileExporter:
         """Export file to CSV format"""
         if file_upload.file_type == 'kml':
             # Export KML data to CSV
-            from .models import KMLFile, KMLData
-            
-            kml_file = KMLFile.objects.filter(
-                user=file_upload.user,
-                original_filename=file_upload.original_filename
-            ).first()
+            kml_file = get_kml_file_for_upload(file_upload)
             
             if kml_file:
                 data = []
@@ -1150,13 +1586,9 @@ class FileExporter:
         """Export file to Shapefile format"""
         if file_upload.file_type == 'kml':
             # Convert KML to Shapefile
-            from .models import KMLFile, KMLData
             from .kml_utils import KMLExporter
             
-            kml_file = KMLFile.objects.filter(
-                user=file_upload.user,
-                original_filename=file_upload.original_filename
-            ).first()
+            kml_file = get_kml_file_for_upload(file_upload)
             
             if kml_file:
                 kml_data_list = []
@@ -1181,6 +1613,24 @@ class FileExporter:
         response['Content-Disposition'] = f'attachment; filename="{file_upload.original_filename}"'
         return response
 
+def get_kml_file_for_upload(file_upload, create=False):
+    """Return the KMLFile linked to a KML FileUpload, creating and linking one when create is set"""
+    from .models import KMLFile
+    
+    kml_file = file_upload.kml_file
+    if kml_file is None and create:
+        kml_file = KMLFile.objects.create(
+            user=file_upload.user,
+            file=file_upload.file.name,
+            original_filename=file_upload.original_filename,
+            file_size=file_upload.file_size,
+            processing_status='processing',
+            content_hash=file_upload.content_hash
+        )
+        file_upload.kml_file = kml_file
+        file_upload.save(update_fields=['kml_file'])
+    return kml_file
+
 def get_client_ip(request):
     """Get client IP address"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
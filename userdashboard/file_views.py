@@ -14,9 +14,15 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 import json
 import os
-from django.db import models
-from .models import FileUpload, FileConversion, CSVData, ShapefileData, KMLData, FileShare
-from .file_utils import FileValidator, FileProcessor, FileConverter
+from django.db import models, transaction
+from django.conf import settings
+from django.urls import reverse
+from .models import FileUpload, FileConversion, CSVData, ShapefileData, KMLData, FileShare, ProcessingJob, UploadSession
+from .file_utils import (FileValidator, FileProcessor, FileConverter, ContentStore, ChunkedUpload, UploadOffsetError,
+                         get_kml_file_for_upload, on_stream_complete)
+from .geojson_cache import GeoJSONCache
+from .previews import PreviewStore
+from .jobs import enqueue_job
 import logging
 
 logger = logging.getLogger(__name__)
@@ -51,43 +57,24 @@ class FileUploadView(LoginRequiredMixin, View):
                     messages.error(request, error)
                 return redirect('file_upload')
             
-            # Create file upload record
-            file_upload = FileUpload.objects.create(
-                user=request.user,
-                file=uploaded_file,
-                original_filename=uploaded_file.name,
-                file_type=file_type,
-                file_size=uploaded_file.size,
-                status='pending'
-            )
-            
-            # Process file
-            try:
-                processor = FileProcessor(file_upload)
-                result = processor.process_file()
-                
-                file_upload.status = 'completed'
-                file_upload.save()
-                
-                messages.success(request, f'File "{uploaded_file.name}" uploaded and processed successfully!')
-                
-                # Redirect based on file type
-                if file_type == 'kml':
-                    return redirect('kml_preview', kml_id=file_upload.id)
-                elif file_type == 'csv':
-                    return redirect('csv_preview', file_id=file_upload.id)
-                elif file_type == 'shapefile':
-                    return redirect('shapefile_preview', file_id=file_upload.id)
-                else:
-                    return redirect('file_detail', file_id=file_upload.id)
-                
-            except Exception as e:
-                file_upload.status = 'failed'
-                file_upload.error_message = str(e)
-                file_upload.save()
-                
-                messages.error(request, f'Error processing file: {str(e)}')
-                return redirect('file_upload')
+            # Store content once (hashed while writing) and create file upload record
+            with ContentStore.storing(uploaded_file) as (stored_name, content_hash, file_size):
+                file_upload = FileUpload.objects.create(
+                    user=request.user,
+                    file=stored_name,
+                    original_filename=uploaded_file.name,
+                    file_type=file_type,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    status='pending'
+                )
+            
+            # Queue processing so the request returns immediately
+            job = enqueue_job('process_file', user=request.user, file_upload=file_upload)
+            logger.info(f"Queued processing job {job.id} for file {file_upload.id}")
+            
+            messages.success(request, f'File "{uploaded_file.name}" uploaded. Processing is running in the background.')
+            return redirect(f"{reverse('file_detail', kwargs={'file_id': file_upload.id})}?job_id={job.id}")
                 
         except Exception as e:
             logger.error(f"Error in file upload: {e}")
@@ -147,17 +134,18 @@ class CSVPreviewView(LoginRequiredMixin, View):
             filename = f"{file_upload.original_filename.replace('.csv', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
             response = FileConverter.csv_to_kml(csv_data, filename)
             
-            # Log conversion
-            FileConversion.objects.create(
-                source_file=file_upload,
-                conversion_type='csv_to_kml',
-                status='completed',
-                output_filename=f"{filename}.kml",
-                file_size=len(response.content),
-                processing_completed=timezone.now()
-            )
+            # Log conversion once the streamed file has been fully sent
+            def log_conversion(file_size):
+                FileConversion.objects.create(
+                    source_file=file_upload,
+                    conversion_type='csv_to_kml',
+                    status='completed',
+                    output_filename=f"{filename}.kml",
+                    file_size=file_size,
+                    processing_completed=timezone.now()
+                )
             
-            return response
+            return on_stream_complete(response, log_conversion)
             
         except Exception as e:
             logger.error(f"Error exporting CSV to KML: {e}")
@@ -343,11 +331,11 @@ class FileDetailView(LoginRequiredMixin, View):
         return render(request, 'userdashboard/file_detail.html', context)
 
 class FilePreviewView(LoginRequiredMixin, View):
-    """Generic file preview view for session-based previews"""
+    """Generic file preview view for previews referenced from the session"""
     
     def get(self, request):
-        """Display file preview from session data"""
-        preview_data = request.session.get('preview_data')
+        """Display the preview stored for this session"""
+        preview_data = PreviewStore.get(request)
         
         if not preview_data:
             messages.error(request, 'No preview data available.')
@@ -372,7 +360,7 @@ class FilePreviewView(LoginRequiredMixin, View):
     
     def post(self, request):
         """Handle export requests from preview"""
-        preview_data = request.session.get('preview_data')
+        preview_data = PreviewStore.get(request)
         
         if not preview_data:
             messages.error(request, 'No preview data available.')
@@ -502,16 +490,23 @@ class FileDeleteView(LoginRequiredMixin, View):
         file_upload = get_object_or_404(FileUpload, id=file_id, user=request.user)
         
         try:
-            # Delete associated data
+            # Delete associated data and its cached GeoJSON
             if file_upload.file_type == 'kml':
-                KMLData.objects.filter(kml_file__file_upload=file_upload).delete()
+                kml_file = get_kml_file_for_upload(file_upload)
+                if kml_file:
+                    # The KMLFile belongs to this upload alone; deleting it removes its rows
+                    GeoJSONCache.invalidate('kml', kml_file.id)
+                    kml_file.delete()
             elif file_upload.file_type == 'csv':
                 CSVData.objects.filter(file_upload=file_upload).delete()
             elif file_upload.file_type == 'shapefile':
                 ShapefileData.objects.filter(file_upload=file_upload).delete()
+            GeoJSONCache.invalidate(file_upload.file_type, file_upload.id)
             
-            # Delete the file upload record
+            # Delete the file upload record, then its stored content if nothing else shares it
+            stored_name = file_upload.file.name
             file_upload.delete()
+            ContentStore.release(stored_name)
             
             messages.success(request, 'File deleted successfully.')
             return redirect('file_list')
@@ -612,26 +607,7 @@ class CSVGeoJSONView(View):
     def get(self, request, file_id):
         file_upload = get_object_or_404(FileUpload, id=file_id, user=request.user)
         csv_data = CSVData.objects.filter(file_upload=file_upload)
-        features = []
-        for row in csv_data:
-            coords = json.loads(row.coordinates)
-            geometry_type = row.geometry_type
-            if geometry_type == 'Point':
-                geometry = {"type": "Point", "coordinates": coords}
-            elif geometry_type == 'Polygon':
-                geometry = {"type": "Polygon", "coordinates": [coords]}
-            else:
-                continue
-            features.append({
-                "type": "Feature",
-                "geometry": geometry,
-                "properties": row.data,
-            })
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features,
-        }
-        return JsonResponse(geojson)
+        return GeoJSONCache.serve(request, 'csv', file_upload.id, csv_data)
 
 class ShapefileGeoJSONView(LoginRequiredMixin, View):
     """Serve GeoJSON data for shapefile map visualization"""
@@ -640,53 +616,34 @@ class ShapefileGeoJSONView(LoginRequiredMixin, View):
         try:
             file_upload = get_object_or_404(FileUpload, id=file_id, user=request.user)
             shapefile_data = ShapefileData.objects.filter(file_upload=file_upload)
-            
-            logger.info(f"Found {shapefile_data.count()} shapefile features for file {file_id}")
-            
-            features = []
-            for item in shapefile_data:
-                try:
-                    # Parse coordinates from the stored string
-                    coords = json.loads(item.coordinates)
-                    geometry_type = item.geometry_type
-                    
-                    geometry = None
-                    if geometry_type == 'Point':
-                        geometry = {"type": "Point", "coordinates": coords}
-                    elif geometry_type == 'LineString':
-                        geometry = {"type": "LineString", "coordinates": coords}
-                    elif geometry_type == 'Polygon':
-                        geometry = {"type": "Polygon", "coordinates": [coords]}
-                    elif geometry_type == 'MultiPolygon':
-                        geometry = {"type": "MultiPolygon", "coordinates": coords}
-                    
-                    if geometry:
-                        properties = {
-                            'feature_id': item.feature_id,
-                            'geometry_type': item.geometry_type,
-                            **item.attributes
-                        }
-                        features.append({
-                            "type": "Feature",
-                            "geometry": geometry,
-                            "properties": properties
-                        })
-                except (json.JSONDecodeError, KeyError) as e:
-                    logger.warning(f"Error parsing shapefile feature {item.feature_id}: {e}")
-                    continue
-            
-            geojson = {
-                "type": "FeatureCollection",
-                "features": features
-            }
-            
-            logger.info(f"Returning GeoJSON with {len(features)} features")
-            return JsonResponse(geojson)
+            return GeoJSONCache.serve(request, 'shapefile', file_upload.id, shapefile_data)
             
         except Exception as e:
             logger.error(f"Error in ShapefileGeoJSONView: {e}")
             return JsonResponse({"error": str(e)}, status=500)
 
+class VectorTileView(LoginRequiredMixin, View):
+    """Serve one clipped, simplified map tile (GeoJSON or MVT) of a file or of all the user's files"""
+    
+    def get(self, request, source, z, x, y, fmt, file_id=None):
+        from .spatial import data_version, source_queryset
+        from .tiles import CONTENT_TYPES, get_tile
+        
+        try:
+            queryset = source_queryset(request.user, source, file_id)
+            scope = str(file_id) if file_id else f'user:{request.user.pk}'
+            version = data_version(source, file_id, request.user)
+            content = get_tile(queryset, source, scope, version, z, x, y, fmt)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except Exception as e:
+            logger.error(f"Error rendering tile {source}/{z}/{x}/{y}: {e}")
+            return JsonResponse({"error": str(e)}, status=500)
+        
+        response = HttpResponse(content, content_type=CONTENT_TYPES[fmt])
+        response['Cache-Control'] = 'private, max-age=300'
+        return response
+
 # API Views for AJAX functionality
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -706,40 +663,124 @@ def upload_file_api(request):
         if validation_result['errors']:
             return Response({'errors': validation_result['errors']}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create file upload record
-        file_upload = FileUpload.objects.create(
-            user=request.user,
-            file=uploaded_file,
-            original_filename=uploaded_file.name,
-            file_type=file_type,
-            file_size=uploaded_file.size,
-            status='pending'
-        )
-        
-        # Process file asynchronously (in production, use Celery)
-        try:
-            processor = FileProcessor(file_upload)
-            result = processor.process_file()
-            
-            file_upload.status = 'completed'
-            file_upload.save()
-            
-            return Response({
-                'success': True,
-                'file_id': str(file_upload.id),
-                'file_type': file_type,
-                'result': result
-            }, status=status.HTTP_201_CREATED)
+        # Store content once (hashed while writing) and create file upload record
+        with ContentStore.storing(uploaded_file) as (stored_name, content_hash, file_size):
+            file_upload = _create_stored_upload(request.user, stored_name, uploaded_file.name, file_type, file_size, content_hash)
+        return _queue_stored_upload(file_upload)
             
-        except Exception as e:
-            file_upload.status = 'failed'
-            file_upload.error_message = str(e)
-            file_upload.save()
+    except Exception as e:
+        logger.error(f"Error in file upload API: {e}")
+        return Response({'error': 'An error occurred during upload'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _create_stored_upload(user, stored_name, original_filename, file_type, file_size, content_hash):
+    """Create the pending FileUpload for stored content"""
+    return FileUpload.objects.create(
+        user=user,
+        file=stored_name,
+        original_filename=original_filename,
+        file_type=file_type,
+        file_size=file_size,
+        content_hash=content_hash,
+        status='pending'
+    )
+
+def _queue_stored_upload(file_upload):
+    """Queue processing of a stored upload; returns the 202 response"""
+    # Process file in the background job queue
+    job = enqueue_job('process_file', user=file_upload.user, file_upload=file_upload)
+    
+    return Response({
+        'success': True,
+        'file_id': str(file_upload.id),
+        'file_type': file_upload.file_type,
+        'job_id': str(job.id),
+        'status': job.status
+    }, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def chunked_upload_start_api(request):
+    """Start a resumable upload: {filename, size} -> upload_id, offset and suggested chunk size"""
+    try:
+        size = int(request.data.get('size', 0))
+    except (TypeError, ValueError):
+        return Response({'error': 'size must be an integer number of bytes'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        session = ChunkedUpload.start(request.user, request.data.get('filename', ''), size)
+    except ValueError as e:
+        return Response({'errors': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        **session.to_dict(),
+        'chunk_size': getattr(settings, 'UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024),
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def chunked_upload_api(request, upload_id):
+    """GET: current offset to resume from; PUT ?offset=N: append the raw request body; DELETE: abort"""
+    if request.method == 'GET':
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        return Response(session.to_dict())
+    
+    if request.method == 'DELETE':
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user, status='uploading')
+        ChunkedUpload.abort(session)
+        return Response(session.to_dict())
+    
+    try:
+        offset = int(request.query_params.get('offset', ''))
+    except ValueError:
+        return Response({'error': 'offset query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    with transaction.atomic():
+        # Row lock so two retries of the same chunk cannot append concurrently
+        session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id, user=request.user)
+        try:
+            ChunkedUpload.append(session, offset, request.stream)
+        except UploadOffsetError as e:
+            return Response({'error': str(e), **session.to_dict()}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e), **session.to_dict()}, status=status.HTTP_400_BAD_REQUEST)
+        except OSError as e:
+            # Dropped connection: the bytes received so far are kept, resume from the returned offset
+            logger.warning(f"Chunk for upload {upload_id} interrupted at {session.received_size}: {e}")
+            return Response({'error': 'Chunk interrupted', **session.to_dict()}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(session.to_dict())
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def chunked_upload_finalize_api(request, upload_id):
+    """Validate a fully received upload, store it and queue processing exactly like upload_file_api"""
+    try:
+        with transaction.atomic():
+            session = get_object_or_404(UploadSession.objects.select_for_update(), id=upload_id, user=request.user)
+            if session.status != 'uploading':
+                return Response({'error': f'Upload is {session.status}', **session.to_dict()}, status=status.HTTP_409_CONFLICT)
             
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            errors = ChunkedUpload.validate(session)
+            if errors:
+                return Response({'errors': errors, **session.to_dict()}, status=status.HTTP_400_BAD_REQUEST)
             
+            # Claim the session so a retried finalize gets 409 while this one stores the file
+            session.status = 'completed'
+            session.save(update_fields=['status', 'updated_at'])
+        
+        # The FileUpload must be committed before the blob moves into place (see ContentStore.release)
+        try:
+            with ChunkedUpload.finish(session) as (stored_name, content_hash, file_size):
+                file_upload = _create_stored_upload(request.user, stored_name, session.filename, session.file_type, file_size, content_hash)
+        except Exception:
+            session.status = 'uploading'
+            session.save(update_fields=['status', 'updated_at'])
+            raise
+        session.file_upload = file_upload
+        session.save(update_fields=['file_upload', 'updated_at'])
+        return _queue_stored_upload(file_upload)
+    
     except Exception as e:
-        logger.error(f"Error in file upload API: {e}")
+        logger.error(f"Error finalizing chunked upload {upload_id}: {e}")
         return Response({'error': 'An error occurred during upload'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
@@ -753,64 +794,82 @@ def convert_file_api(request, file_id):
         if not conversion_type:
             return Response({'error': 'Conversion type required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create conversion record
+        if conversion_type not in dict(FileConversion.CONVERSION_TYPES):
+            return Response({'error': f'Unsupported conversion type: {conversion_type}'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Create conversion record and run it in the background job queue
         conversion = FileConversion.objects.create(
             source_file=file_upload,
             conversion_type=conversion_type,
             status='processing'
         )
+        job = enqueue_job('convert_file', user=request.user, file_upload=file_upload, conversion=conversion)
         
-        try:
-            # Perform conversion based on type
-            if conversion_type == 'kml_to_csv':
-                kml_data = KMLData.objects.filter(kml_file__file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.kml', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.kml_to_csv(kml_data, filename)
-                
-            elif conversion_type == 'kml_to_shapefile':
-                kml_data = KMLData.objects.filter(kml_file__file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.kml', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.kml_to_shapefile(kml_data, filename)
-                
-            elif conversion_type == 'csv_to_kml':
-                csv_data = CSVData.objects.filter(file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.csv', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.csv_to_kml(csv_data, filename)
-                
-            elif conversion_type == 'csv_to_shapefile':
-                csv_data = CSVData.objects.filter(file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.csv', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.csv_to_shapefile(csv_data, filename)
-                
-            elif conversion_type == 'shapefile_to_kml':
-                shapefile_data = ShapefileData.objects.filter(file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.zip', '').replace('.shp', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.shapefile_to_kml(shapefile_data, filename)
-                
-            elif conversion_type == 'shapefile_to_csv':
-                shapefile_data = ShapefileData.objects.filter(file_upload=file_upload)
-                filename = f"{file_upload.original_filename.replace('.zip', '').replace('.shp', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-                response = FileConverter.shapefile_to_csv(shapefile_data, filename)
-                
-            else:
-                raise ValueError(f"Unsupported conversion type: {conversion_type}")
-            
-            # Update conversion record
-            conversion.status = 'completed'
-            conversion.output_filename = response['Content-Disposition'].split('filename=')[1].strip('"')
-            conversion.file_size = len(response.content)
-            conversion.processing_completed = timezone.now()
-            conversion.save()
-            
-            return response
-            
-        except Exception as e:
-            conversion.status = 'failed'
-            conversion.error_message = str(e)
-            conversion.save()
-            
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({
+            'success': True,
+            'conversion_id': str(conversion.id),
+            'job_id': str(job.id),
+            'status': job.status
+        }, status=status.HTTP_202_ACCEPTED)
             
     except Exception as e:
         logger.error(f"Error in file conversion API: {e}")
-        return Response({'error': 'An error occurred during conversion'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR) 
\ No newline at end of file
+        return Response({'error': 'An error occurred during conversion'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_status_api(request, job_id):
+    """API endpoint for polling a background processing job"""
+    job = get_object_or_404(ProcessingJob, id=job_id, user=request.user)
+    return Response(job.to_dict())
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def spatial_query_api(request):
+    """API endpoint for viewport (bbox) and intersects queries over parsed features"""
+    from shapely.geometry import mapping
+    from .spatial import (
+        SpatialIndex, data_version, filter_viewport, iter_geometries, parse_bbox, parse_geometry,
+        source_queryset, feature_properties,
+    )
+
+    params = request.data if request.method == 'POST' else request.query_params
+    source = params.get('source', 'kml')
+    file_id = params.get('file_id')
+    predicate = params.get('predicate', 'intersects')
+
+    try:
+        queryset = source_queryset(request.user, source, file_id)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if predicate not in ('intersects', 'within', 'contains', 'covers', 'covered_by', 'overlaps', 'touches'):
+        return Response({'error': f'Unsupported predicate: {predicate}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        if params.get('geometry'):
+            # Exact predicate test against the cached STRtree for this file (or all of the user's files)
+            geometry = parse_geometry(params['geometry'])
+            key = (source, str(file_id) if file_id else f'user:{request.user.pk}')
+            version = data_version(source, file_id, request.user)
+            ids = SpatialIndex.for_queryset(key, queryset, version).query(geometry, predicate=predicate)
+            queryset = queryset.filter(pk__in=ids)
+        elif params.get('bbox'):
+            # Viewport query served straight from the indexed bbox columns
+            queryset = filter_viewport(queryset, *parse_bbox(params['bbox']))
+        else:
+            return Response({'error': 'Provide a bbox or a geometry'}, status=status.HTTP_400_BAD_REQUEST)
+    except (ValueError, TypeError, AttributeError, KeyError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    features = []
+    for item, geometry in iter_geometries(queryset):
+        if geometry is None:
+            continue
+        features.append({
+            'type': 'Feature',
+            'geometry': mapping(geometry),
+            'properties': feature_properties(source, item),
+        })
+
+    return Response({'type': 'FeatureCollection', 'features': features})
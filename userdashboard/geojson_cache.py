@@ -0,0 +1,155 @@
+import os
+import gzip
+import json
+import shutil
+import logging
+import tempfile
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from shapely.geometry import mapping
+from .spatial import data_version, iter_geometries
+
+logger = logging.getLogger(__name__)
+
+def build_kml_geojson(queryset):
+    """FeatureCollection for KMLGeoJSONView"""
+    features = []
+    for item, geom in iter_geometries(queryset):
+        if geom is None or item.geometry_type not in ('Point', 'Polygon', 'LineString'):
+            continue
+        features.append({
+            'type': 'Feature',
+            'geometry': mapping(geom),
+            'properties': {
+                'placemark_name': item.placemark_name,
+                'kitta_number': item.kitta_number,
+                'owner_name': item.owner_name,
+                'geometry_type': item.geometry_type,
+                'area_hectares': float(item.area_hectares) if item.area_hectares else None,
+                'area_sqm': float(item.area_sqm) if item.area_sqm else None,
+                'description': item.description,
+                'id': str(item.id)
+            }
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def build_csv_geojson(queryset):
+    """FeatureCollection for CSVGeoJSONView"""
+    features = []
+    for row, geom in iter_geometries(queryset):
+        if geom is None or row.geometry_type not in ('Point', 'Polygon'):
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(geom),
+            "properties": row.data,
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+def build_shapefile_geojson(queryset):
+    """FeatureCollection for ShapefileGeoJSONView"""
+    features = []
+    for item, geom in iter_geometries(queryset):
+        if geom is None:
+            logger.warning(f"Error decoding shapefile feature {item.feature_id}")
+            continue
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(geom),
+            "properties": {
+                'feature_id': item.feature_id,
+                'geometry_type': item.geometry_type,
+                **item.attributes
+            }
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+BUILDERS = {
+    'kml': build_kml_geojson,
+    'csv': build_csv_geojson,
+    'shapefile': build_shapefile_geojson,
+}
+
+class GeoJSONCache:
+    """Gzipped FeatureCollections on disk, one per file and data version"""
+
+    @staticmethod
+    def directory(kind, file_id):
+        return os.path.join(str(settings.GEOJSON_CACHE_DIR), kind, str(file_id))
+
+    @classmethod
+    def path(cls, kind, file_id, version):
+        return os.path.join(cls.directory(kind, file_id), f'{version}.geojson.gz')
+
+    @classmethod
+    def materialize(cls, kind, file_id, queryset, version=None):
+        """Build and store the FeatureCollection if this version is not on disk yet; returns its path"""
+        version = version or data_version(kind, file_id)
+        path = cls.path(kind, file_id, version)
+        if os.path.exists(path):
+            return path
+
+        content = json.dumps(BUILDERS[kind](queryset), default=str).encode('utf-8')
+        directory = cls.directory(kind, file_id)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(gzip.compress(content, compresslevel=6))
+        os.replace(tmp_path, path)
+
+        # Older versions of this file are never served again
+        for name in os.listdir(directory):
+            if name != os.path.basename(path) and name.endswith('.geojson.gz'):
+                os.remove(os.path.join(directory, name))
+        logger.info(f"Materialized {kind} GeoJSON for {file_id} ({len(content)} bytes)")
+        return path
+
+    @classmethod
+    def materialize_upload(cls, file_upload):
+        """Precompute the GeoJSON for a freshly processed FileUpload; failures only log"""
+        from .models import KMLData, CSVData, ShapefileData
+        from .file_utils import get_kml_file_for_upload
+
+        try:
+            if file_upload.file_type == 'kml':
+                kml_file = get_kml_file_for_upload(file_upload)
+                if kml_file:
+                    cls.materialize('kml', kml_file.id, KMLData.objects.filter(kml_file=kml_file))
+            elif file_upload.file_type == 'csv':
+                cls.materialize('csv', file_upload.id, CSVData.objects.filter(file_upload=file_upload))
+            elif file_upload.file_type == 'shapefile':
+                cls.materialize('shapefile', file_upload.id, ShapefileData.objects.filter(file_upload=file_upload))
+        except Exception as e:
+            logger.warning(f"Could not precompute GeoJSON for {file_upload.id}: {e}")
+
+    @classmethod
+    def invalidate(cls, kind, file_id):
+        """Remove every cached version for a file"""
+        shutil.rmtree(cls.directory(kind, file_id), ignore_errors=True)
+
+    @classmethod
+    def serve(cls, request, kind, file_id, queryset):
+        """Return the cached FeatureCollection with ETag/Last-Modified, or a 304 when the client is current"""
+        version = data_version(kind, file_id)
+        path = cls.materialize(kind, file_id, queryset, version)
+        etag = quote_etag(f'{kind}-{file_id}-{version}')
+        last_modified = int(os.stat(path).st_mtime)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+            response = HttpResponse(content_type='application/json')
+            if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+                response['Content-Encoding'] = 'gzip'
+            else:
+                content = gzip.decompress(content)
+            response.content = content
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Accept-Encoding, Cookie'
+        return response
@@ -0,0 +1,352 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Which FileProcessingLog.processing_type each job type is recorded under
+PROCESSING_TYPES = {
+    'process_file': 'parsing',
+    'parse_kml': 'parsing',
+    'convert_file': 'conversion',
+}
+
+def enqueue_job(job_type, user=None, file_upload=None, kml_file=None, conversion=None, payload=None):
+    """Create a queued ProcessingJob and wake the local worker pool once it is committed"""
+    from .models import ProcessingJob
+
+    job = ProcessingJob.objects.create(
+        job_type=job_type,
+        user=user,
+        file_upload=file_upload,
+        kml_file=kml_file,
+        conversion=conversion,
+        payload=payload or {},
+    )
+    logger.info(f"Queued {job_type} job {job.id}")
+    transaction.on_commit(LocalWorkerPool.notify)
+    return job
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest queued job to running and return it, or None"""
+    from .models import ProcessingJob
+
+    candidates = ProcessingJob.objects.filter(status='queued').order_by('created_at').values_list('id', flat=True)[:5]
+    for job_id in candidates:
+        # Compare-and-set on status so concurrent workers never claim the same job
+        claimed = ProcessingJob.objects.filter(id=job_id, status='queued').update(
+            status='running',
+            worker_id=worker_id,
+            started_at=timezone.now(),
+            updated_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ProcessingJob.objects.select_related('file_upload', 'kml_file', 'conversion').get(id=job_id)
+    return None
+
+def requeue_stale_jobs(max_age_seconds=None):
+    """Put running jobs whose heartbeat stopped back in the queue, failing those out of attempts"""
+    from .models import ProcessingJob
+
+    max_age_seconds = max_age_seconds or getattr(settings, 'JOB_QUEUE_STALE_SECONDS', 300)
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+    stale = ProcessingJob.objects.filter(status='running', updated_at__lt=cutoff)
+
+    failed = 0
+    requeued = 0
+    for job in stale.only('id', 'attempts', 'max_attempts'):
+        # Conditional on the heartbeat still being old, so a job that just reported in is left alone
+        if job.attempts >= job.max_attempts:
+            failed += stale.filter(id=job.id).update(
+                status='failed',
+                error_message='Worker stopped before the job finished',
+                completed_at=timezone.now(),
+                updated_at=timezone.now(),
+            )
+        else:
+            requeued += stale.filter(id=job.id).update(status='queued', worker_id='', updated_at=timezone.now())
+    if requeued or failed:
+        logger.warning(f"Recovered stale jobs: {requeued} requeued, {failed} failed")
+    return requeued, failed
+
+class JobHeartbeat:
+    """Daemon thread refreshing a running job's updated_at, so requeue_stale_jobs can tell it is alive"""
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or getattr(settings, 'JOB_QUEUE_HEARTBEAT_SECONDS', 30)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._run, name=f"job-heartbeat-{self.job.id}", daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        from django.db import connection
+        from .models import ProcessingJob
+
+        try:
+            while not self.stop_event.wait(self.interval):
+                try:
+                    ProcessingJob.objects.filter(id=self.job.id, status='running').update(updated_at=timezone.now())
+                except Exception as e:
+                    logger.warning(f"Heartbeat for job {self.job.id} failed: {e}")
+        finally:
+            connection.close()
+
+def run_job(job):
+    """Execute a claimed job, recording status, timing and a FileProcessingLog entry"""
+    from .models import FileProcessingLog
+
+    handler = JOB_HANDLERS.get(job.job_type)
+    started = time.monotonic()
+    processing_log = None
+
+    # Only the processing job owns FileUpload.status; conversions just log against the file
+    tracks_upload = job.file_upload_id and job.job_type == 'process_file'
+    if tracks_upload:
+        file_upload = job.file_upload
+        file_upload.status = 'processing'
+        file_upload.processing_started = job.started_at
+        file_upload.save(update_fields=['status', 'processing_started'])
+    if job.file_upload_id:
+        processing_log = FileProcessingLog.objects.create(
+            file_upload_id=job.file_upload_id,
+            processing_type=PROCESSING_TYPES.get(job.job_type, 'parsing'),
+            status='processing',
+            details={'job_id': str(job.id), 'job_type': job.job_type},
+        )
+
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job type: {job.job_type}")
+        with JobHeartbeat(job):
+            result = handler(job) or {}
+        job.status = 'completed'
+        job.result = result
+        job.error_message = None
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.job_type}) failed: {e}", exc_info=True)
+        result = {}
+        job.status = 'failed'
+        job.error_message = str(e)
+
+    completed_at = timezone.now()
+    duration = time.monotonic() - started
+    job.completed_at = completed_at
+    job.duration_seconds = duration
+    job.save(update_fields=['status', 'result', 'error_message', 'completed_at', 'duration_seconds', 'updated_at'])
+
+    upload_status = 'completed' if job.status == 'completed' else 'failed'
+    if tracks_upload:
+        file_upload.status = upload_status
+        file_upload.processing_completed = completed_at
+        file_upload.error_message = job.error_message
+        file_upload.save(update_fields=['status', 'processing_completed', 'error_message'])
+    if processing_log is not None:
+        processing_log.status = upload_status
+        processing_log.completed_at = completed_at
+        processing_log.duration_seconds = duration
+        processing_log.error_message = job.error_message
+        processing_log.details = {**processing_log.details, **_json_safe(result)}
+        processing_log.save(update_fields=['status', 'completed_at', 'duration_seconds', 'error_message', 'details'])
+
+    logger.info(f"Job {job.id} ({job.job_type}) {job.status} in {duration:.2f}s")
+    return job
+
+def _json_safe(result):
+    """Keep only the JSON-serializable scalar/collection entries of a handler result"""
+    return {k: v for k, v in result.items() if isinstance(v, (str, int, float, bool, list, dict, type(None)))}
+
+def _process_file(job):
+    """Run FileProcessor for an uploaded FileUpload"""
+    from .file_utils import FileProcessor
+    from .geojson_cache import GeoJSONCache
+
+    result = FileProcessor(job.file_upload).process_file()
+    GeoJSONCache.materialize_upload(job.file_upload)
+    return result
+
+def _parse_kml(job):
+    """Parse a KMLFile uploaded through the KML upload page"""
+    from .models import KMLData
+    from .kml_utils import ingest_kml_file
+    from .geojson_cache import GeoJSONCache
+
+    result = ingest_kml_file(job.kml_file)
+    try:
+        GeoJSONCache.materialize('kml', job.kml_file.id, KMLData.objects.filter(kml_file=job.kml_file))
+    except Exception as e:
+        logger.warning(f"Could not precompute GeoJSON for KML file {job.kml_file.id}: {e}")
+    return result
+
+def _convert_file(job):
+    """Run a FileConversion and store the output under exports/"""
+    from django.core.files import File
+    from .models import KMLData, CSVData, ShapefileData
+    from .file_utils import FileConverter, get_kml_file_for_upload
+
+    conversion = job.conversion
+    file_upload = conversion.source_file
+    base_name = os.path.splitext(file_upload.original_filename)[0]
+    filename = f"{base_name}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+
+    try:
+        source_type = conversion.conversion_type.split('_to_')[0]
+        if source_type == 'kml':
+            source_data = KMLData.objects.filter(kml_file=get_kml_file_for_upload(file_upload))
+        elif source_type == 'csv':
+            source_data = CSVData.objects.filter(file_upload=file_upload)
+        elif source_type == 'shapefile':
+            source_data = ShapefileData.objects.filter(file_upload=file_upload)
+        else:
+            raise ValueError(f"Unsupported conversion type: {conversion.conversion_type}")
+
+        converter = getattr(FileConverter, conversion.conversion_type, None)
+        if converter is None:
+            raise ValueError(f"Unsupported conversion type: {conversion.conversion_type}")
+        response = converter(source_data, filename)
+
+        output_filename = response['Content-Disposition'].split('filename=')[1].strip('"')
+        # Spool streamed exports to a temp file instead of joining them in memory
+        with tempfile.TemporaryFile() as output:
+            for chunk in (response.streaming_content if response.streaming else [response.content]):
+                output.write(chunk)
+            conversion.file_size = output.tell()
+            output.seek(0)
+            conversion.output_file.save(output_filename, File(output), save=False)
+        conversion.output_filename = output_filename
+        conversion.status = 'completed'
+        conversion.processing_completed = timezone.now()
+        conversion.save()
+    except Exception as e:
+        conversion.status = 'failed'
+        conversion.error_message = str(e)
+        conversion.save(update_fields=['status', 'error_message'])
+        raise
+
+    return {
+        'conversion_id': str(conversion.id),
+        'output_filename': conversion.output_filename,
+        'output_url': conversion.output_file.url,
+        'file_size': conversion.file_size,
+    }
+
+JOB_HANDLERS = {
+    'process_file': _process_file,
+    'parse_kml': _parse_kml,
+    'convert_file': _convert_file,
+}
+
+class JobWorker:
+    """Loop that claims and runs queued jobs until stopped"""
+
+    def __init__(self, name=None, poll_interval=None, wake_event=None):
+        self.worker_id = name or f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+        self.poll_interval = poll_interval or getattr(settings, 'JOB_QUEUE_POLL_INTERVAL', 2)
+        self.wake_event = wake_event or threading.Event()
+        self.stop_event = threading.Event()
+        self.last_recovery = None
+
+    def run_once(self):
+        """Run a single queued job; returns the job or None if the queue was empty"""
+        close_old_connections()
+        try:
+            job = claim_next_job(self.worker_id)
+            if job is not None:
+                run_job(job)
+            return job
+        finally:
+            close_old_connections()
+
+    def run_forever(self):
+        """Process jobs until stop() is called, sleeping while the queue is empty"""
+        while not self.stop_event.is_set():
+            try:
+                job = self.run_once()
+            except Exception as e:
+                logger.error(f"Job worker {self.worker_id} error: {e}", exc_info=True)
+                job = None
+            if job is None:
+                self.recover_stale_jobs()
+                self.wake_event.wait(self.poll_interval)
+                self.wake_event.clear()
+
+    def recover_stale_jobs(self):
+        """Requeue jobs orphaned by dead workers elsewhere, at most once every JOB_QUEUE_STALE_SECONDS"""
+        interval = getattr(settings, 'JOB_QUEUE_STALE_SECONDS', 300)
+        now = time.monotonic()
+        if self.last_recovery is not None and now - self.last_recovery < interval:
+            return
+        self.last_recovery = now
+        try:
+            requeue_stale_jobs()
+        except Exception as e:
+            logger.error(f"Job worker {self.worker_id} could not requeue stale jobs: {e}")
+        finally:
+            close_old_connections()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+class LocalWorkerPool:
+    """In-process pool of daemon worker threads, started lazily on first enqueue"""
+
+    _lock = threading.Lock()
+    _threads = []
+    _workers = []
+    _wake_event = threading.Event()
+
+    @classmethod
+    def start(cls, size=None):
+        """Start the pool if it is not already running"""
+        size = getattr(settings, 'JOB_QUEUE_LOCAL_WORKERS', 2) if size is None else size
+        with cls._lock:
+            cls._threads = [t for t in cls._threads if t.is_alive()]
+            if len(cls._threads) < size:
+                # Jobs left running by a worker process that died would otherwise never be picked up again
+                try:
+                    requeue_stale_jobs()
+                except Exception as e:
+                    logger.error(f"Could not requeue stale jobs: {e}")
+            for i in range(len(cls._threads), size):
+                worker = JobWorker(
+                    name=f"{socket.gethostname()}-{os.getpid()}-local-{i}",
+                    wake_event=cls._wake_event,
+                )
+                thread = threading.Thread(target=worker.run_forever, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                cls._workers.append(worker)
+                cls._threads.append(thread)
+
+    @classmethod
+    def notify(cls):
+        """Wake idle local workers, starting the pool if configured"""
+        if getattr(settings, 'JOB_QUEUE_LOCAL_WORKERS', 2) > 0:
+            cls.start()
+        cls._wake_event.set()
+
+    @classmethod
+    def stop(cls):
+        """Signal all local workers to exit"""
+        with cls._lock:
+            for worker in cls._workers:
+                worker.stop()
+            cls._workers = []
+            cls._threads = []
@@ -4,6 +4,11 @@ import zipfile
 import os
 import tempfile
 import re
+import threading
+import numpy as np
+from functools import lru_cache
+import shapely
+from collections import deque
 from io import StringIO, BytesIO
 from django.conf import settings
 from django.http import HttpResponse
@@ -17,14 +22,269 @@ import pyogrio
 from decimal import Decimal
 import logging
 from datetime import datetime
+from .extraction import ExtractionRules, clean_text
 
 logger = logging.getLogger(__name__)
 
+KML_NS = '{http://www.opengis.net/kml/2.2}'
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+XAL_NS = '{urn:oasis:names:tc:ciq:xsdschema:xAL:2.0}'
+# Namespaces of older KML versions (and none at all), read as if they were KML 2.2
+LEGACY_KML_NAMESPACES = ('', 'http://earth.google.com/kml/2.0', 'http://earth.google.com/kml/2.1', 'http://earth.google.com/kml/2.2')
+
+@lru_cache(maxsize=256)
+def kml_tag(tag):
+    """The KML 2.2 form of a KML 2.0/2.1 or namespace-less tag; tags in other namespaces are returned unchanged"""
+    namespace, _, local = tag[1:].rpartition('}') if tag.startswith('{') else ('', '', tag)
+    return KML_NS + local if namespace in LEGACY_KML_NAMESPACES else tag
+
+# A comma next to whitespace or at the very end: spacing that needs _coordinate_tokens' joining pass
+LOOSE_COMMA_RE = re.compile(r',\s|\s,|,$')
+
+def _coordinate_tokens(text):
+    """Split a <coordinates> block into 'lon,lat[,alt]' tuples, tolerating hand-edited spacing
+
+    Spaces around commas ("85.3, 27.7") and trailing commas ("85.3,27.7,") are both common, so a
+    piece is joined onto the previous one while that tuple is still missing its lat or its altitude.
+    """
+    text = text.strip() if text else ''
+    if not LOOSE_COMMA_RE.search(text):
+        # Well-formed tuples: nothing to join
+        return text.split()
+    tokens = []
+    for piece in text.split():
+        previous = tokens[-1] if tokens else ''
+        if tokens and (piece.startswith(',') or (
+            previous.endswith(',') and (len([part for part in previous.split(',') if part]) < 2 or ',' not in piece)
+        )):
+            tokens[-1] = previous.rstrip(',') + ',' + piece.lstrip(',')
+        else:
+            tokens.append(piece)
+    return [token.rstrip(',') for token in tokens if token.strip(',')]
+
+def parse_coordinates(text):
+    """Decode a KML <coordinates> block into an (N, 2) or (N, 3) float64 array; (0, 2) if it is invalid"""
+    tokens = _coordinate_tokens(text)
+    if not tokens:
+        return np.empty((0, 2))
+    width = tokens[0].count(',') + 1
+    if width >= 2 and all(token.count(',') == width - 1 for token in tokens):
+        try:
+            # Uniform tuples: one C-level float conversion over every value, then a reshape
+            return np.array(','.join(tokens).split(','), dtype=np.float64).reshape(-1, width)[:, :3]
+        except ValueError:
+            pass
+    # Mixed 2D/3D tuples or a bad value: keep lon/lat of every tuple that parses
+    positions = []
+    for token in tokens:
+        try:
+            lon, lat = token.split(',')[:2]
+            positions.append((float(lon), float(lat)))
+        except ValueError:
+            logger.warning(f"Skipping invalid coordinate tuple: {token[:50]}")
+    return np.array(positions, dtype=np.float64).reshape(-1, 2)
+
+def assign_polygon_areas(rows):
+    """Fill area_sqm/area_hectares on a batch of Polygon placemark dicts with one bulk geodesic pass"""
+    from .spatial import geodesic_areas
+    
+    polygons = [row for row in rows if row.get('geometry_type') == 'Polygon' and row.get('geometry_wkb')]
+    if not polygons:
+        return rows
+    areas = geodesic_areas(shapely.from_wkb([row['geometry_wkb'] for row in polygons], on_invalid='ignore'))
+    for row, area_sqm in zip(polygons, areas.tolist()):
+        if np.isfinite(area_sqm):
+            row['area_sqm'] = Decimal(f"{area_sqm:.2f}")
+            row['area_hectares'] = Decimal(f"{area_sqm / 10000:.6f}")
+    return rows
+
+def _text(elem):
+    return elem.text.strip() if elem is not None and elem.text else ''
+
+class PlacemarkVisitor:
+    """Walk a Placemark subtree exactly once, filling fields from a tag-to-handler table"""
+    
+    # Structured address paths below AddressDetails (kept in the KML namespace, as before)
+    ADDRESS_PATHS = {
+        'country_code': ('Country', 'countryCode'),
+        'administrative_area': ('AdministrativeArea', 'administrativeAreaName'),
+        'sub_administrative_area': ('SubAdministrativeArea', 'subAdministrativeAreaName'),
+        'locality': ('Locality', 'localityName'),
+        'sub_locality': ('SubLocality', 'subLocalityName'),
+        'thoroughfare': ('Thoroughfare', 'thoroughfareName'),
+        'postal_code': ('PostalCode', 'postalCodeNumber'),
+    }
+    
+    def __init__(self):
+        self.fields = {}  # direct-child text fields
+        self.point = None
+        self.polygon = None
+        self.linestring = None
+        self.polygon_coords = None
+        self.polygon_altitude = {}
+        self.data_pairs = []  # (name, raw value) from ExtendedData/Data
+        self.simple_data = []  # (name, raw value) from ExtendedData/SimpleData
+        self.time = {}
+        self.style_url = None
+        self.style_id = None
+        self.address = {}
+        self._seen = set()
+    
+    def visit(self, placemark):
+        """Fill this visitor from a Placemark element and return it"""
+        self._walk(placemark, 1, None)
+        return self
+    
+    def _walk(self, elem, depth, scope):
+        for child in elem:
+            handler = self.HANDLERS.get(child.tag)
+            child_scope = scope
+            if handler is not None:
+                child_scope = handler(self, child, depth, scope)
+            if len(child):
+                self._walk(child, depth + 1, child_scope)
+    
+    def _first(self, tag):
+        """True the first time a tag is met; later occurrences are ignored like find('.//tag')"""
+        if tag in self._seen:
+            return False
+        self._seen.add(tag)
+        return True
+    
+    # Handlers return the scope passed to the element's children
+    
+    def _direct_text(self, elem, depth, scope):
+        if depth == 1:
+            self.fields.setdefault(elem.tag, _text(elem))
+        return scope
+    
+    def _style_url(self, elem, depth, scope):
+        if depth == 1 and self.style_url is None and elem.text:
+            self.style_url = elem.text.strip()
+        return scope
+    
+    def _point(self, elem, depth, scope):
+        if self._first('Point'):
+            self.point = elem
+        return scope
+    
+    def _linestring(self, elem, depth, scope):
+        if self._first('LineString'):
+            self.linestring = elem
+        return scope
+    
+    def _polygon(self, elem, depth, scope):
+        if self._first('Polygon'):
+            self.polygon = elem
+            return 'polygon'
+        return scope
+    
+    def _outer_boundary(self, elem, depth, scope):
+        return 'outer' if scope == 'polygon' else scope
+    
+    def _coordinates(self, elem, depth, scope):
+        if scope == 'outer' and self.polygon_coords is None and elem.text:
+            self.polygon_coords = elem.text.strip()
+        return scope
+    
+    def _polygon_property(self, elem, depth, scope):
+        if scope in ('polygon', 'outer') and elem.text:
+            self.polygon_altitude.setdefault(elem.tag[len(KML_NS):], elem.text.strip())
+        return scope
+    
+    def _extended_data(self, elem, depth, scope):
+        if self._first('ExtendedData'):
+            for child in elem:
+                name = child.get('name')
+                if child.tag == KML_NS + 'Data':
+                    value = child.find(KML_NS + 'value')
+                    if name and value is not None and value.text:
+                        self.data_pairs.append((name, value.text.strip()))
+                elif child.tag == KML_NS + 'SimpleData':
+                    if name and child.text:
+                        self.simple_data.append((name, child.text.strip()))
+        return scope
+    
+    def _timespan(self, elem, depth, scope):
+        if self._first('TimeSpan'):
+            self.time['begin'] = _text(elem.find(KML_NS + 'begin'))
+            self.time['end'] = _text(elem.find(KML_NS + 'end'))
+        return scope
+    
+    def _timestamp(self, elem, depth, scope):
+        if self._first('TimeStamp'):
+            self.time['when'] = _text(elem.find(KML_NS + 'when'))
+        return scope
+    
+    def _style(self, elem, depth, scope):
+        if self._first('Style'):
+            self.style_id = elem.get('id', '')
+        return scope
+    
+    def _address(self, elem, depth, scope):
+        if self._first('address') and elem.text:
+            self.address['address'] = elem.text.strip()
+        return scope
+    
+    def _address_details(self, elem, depth, scope):
+        if self._first('AddressDetails'):
+            for field, (outer, inner) in self.ADDRESS_PATHS.items():
+                self.address[field] = _text(elem.find(f'{KML_NS}{outer}/{KML_NS}{inner}'))
+        return scope
+    
+    def direct_text(self, tag):
+        """Text of a direct child of the placemark, '' if absent"""
+        return self.fields.get(tag, '')
+    
+    def altitude_data(self):
+        """altitudeMode/tessellate/extrude with the same precedence as before: Point, LineString, Polygon"""
+        altitude_data = {}
+        if self.point is not None:
+            mode = _text(self.point.find(KML_NS + 'altitudeMode'))
+            if mode:
+                altitude_data['altitude_mode'] = mode
+        if self.linestring is not None:
+            for key, tag in (('altitude_mode', 'altitudeMode'), ('tessellate', 'tessellate'), ('extrude', 'extrude')):
+                value = _text(self.linestring.find(KML_NS + tag))
+                if value:
+                    altitude_data[key] = value
+        for key, tag in (('altitude_mode', 'altitudeMode'), ('tessellate', 'tessellate'), ('extrude', 'extrude')):
+            if tag in self.polygon_altitude:
+                altitude_data[key] = self.polygon_altitude[tag]
+        return altitude_data
+
+PlacemarkVisitor.HANDLERS = {
+    KML_NS + 'name': PlacemarkVisitor._direct_text,
+    KML_NS + 'description': PlacemarkVisitor._direct_text,
+    KML_NS + 'snippet': PlacemarkVisitor._direct_text,
+    KML_NS + 'visibility': PlacemarkVisitor._direct_text,
+    KML_NS + 'open': PlacemarkVisitor._direct_text,
+    ATOM_NS + 'author': PlacemarkVisitor._direct_text,
+    ATOM_NS + 'link': PlacemarkVisitor._direct_text,
+    XAL_NS + 'AddressDetails': PlacemarkVisitor._direct_text,
+    KML_NS + 'styleUrl': PlacemarkVisitor._style_url,
+    KML_NS + 'Point': PlacemarkVisitor._point,
+    KML_NS + 'LineString': PlacemarkVisitor._linestring,
+    KML_NS + 'Polygon': PlacemarkVisitor._polygon,
+    KML_NS + 'outerBoundaryIs': PlacemarkVisitor._outer_boundary,
+    KML_NS + 'coordinates': PlacemarkVisitor._coordinates,
+    KML_NS + 'altitudeMode': PlacemarkVisitor._polygon_property,
+    KML_NS + 'tessellate': PlacemarkVisitor._polygon_property,
+    KML_NS + 'extrude': PlacemarkVisitor._polygon_property,
+    KML_NS + 'ExtendedData': PlacemarkVisitor._extended_data,
+    KML_NS + 'TimeSpan': PlacemarkVisitor._timespan,
+    KML_NS + 'TimeStamp': PlacemarkVisitor._timestamp,
+    KML_NS + 'Style': PlacemarkVisitor._style,
+    KML_NS + 'address': PlacemarkVisitor._address,
+    KML_NS + 'AddressDetails': PlacemarkVisitor._address_details,
+}
+
 class KMLParser:
     """Enhanced utility class for parsing KML files with all available fields"""
     
-    def __init__(self, kml_file_path):
+    def __init__(self, kml_file_path, extraction_rules=None):
         self.kml_file_path = kml_file_path
+        self.extraction_rules = extraction_rules or ExtractionRules.for_source()
         self.namespace = {
             'kml': 'http://www.opengis.net/kml/2.2',
             'atom': 'http://www.w3.org/2005/Atom',
@@ -36,61 +296,38 @@ class KMLParser:
         print(f"🔍 KMLParser.parse_kml() called for file: {self.kml_file_path}")
         logger.info(f"KMLParser.parse_kml() called for file: {self.kml_file_path}")
         
-        try:
-            tree = ET.parse(self.kml_file_path)
-            root = tree.getroot()
-            print(f"✅ XML tree parsed, root tag: {root.tag}")
-            logger.info(f"XML tree parsed, root tag: {root.tag}")
-            
-            placemarks = root.findall('.//kml:Placemark', self.namespace)
-            print(f"🔍 Found {len(placemarks)} placemarks in KML file")
-            logger.info(f"Found {len(placemarks)} placemarks in KML file")
-            
-            if not placemarks:
-                print("❌ No placemarks found in KML file")
-                logger.warning("No placemarks found in KML file")
-                return []
-            
-            parsed_data = []
-            for i, placemark in enumerate(placemarks):
-                print(f"🔍 Processing placemark {i+1}/{len(placemarks)}")
-                try:
-                    data = self._extract_comprehensive_placemark_data(placemark)
-                    if data:
-                        parsed_data.append(data)
-                        print(f"  ✅ Placemark {i+1} processed successfully")
-                    else:
-                        print(f"  ⚠️ Placemark {i+1} returned no data (skipped)")
-                except Exception as e:
-                    print(f"  ❌ Error processing placemark {i+1}: {str(e)}")
-                    logger.error(f"Error processing placemark {i+1}: {str(e)}")
-                    continue
-            
-            print(f"✅ KML parsing completed. Successfully processed {len(parsed_data)} placemarks")
-            logger.info(f"KML parsing completed. Successfully processed {len(parsed_data)} placemarks")
-            return parsed_data
-            
-        except ET.ParseError as e:
-            print(f"❌ KML parsing error: {e}")
-            logger.error(f"KML parsing error: {e}")
-            raise ValueError(f"Invalid KML file format: {e}")
-        except Exception as e:
-            print(f"❌ Unexpected error parsing KML: {e}")
-            logger.error(f"Unexpected error parsing KML: {e}")
-            raise ValueError(f"Error parsing KML file: {e}")
+        parsed_data = list(self.iter_placemarks())
+        
+        if not parsed_data:
+            print("❌ No placemarks found in KML file")
+            logger.warning("No placemarks found in KML file")
+            return []
+        
+        print(f"✅ KML parsing completed. Successfully processed {len(parsed_data)} placemarks")
+        logger.info(f"KML parsing completed. Successfully processed {len(parsed_data)} placemarks")
+        return parsed_data
+    
+    def iter_placemarks(self):
+        """Stream placemarks one at a time using iterparse, freeing each element once extracted"""
+        with KMLParseSession(self.kml_file_path, parser=self) as session:
+            yield from session.placemarks()
+            logger.info(f"KML streaming completed. Successfully processed {session.processed} placemarks")
     
     def _extract_comprehensive_placemark_data(self, placemark):
         """Extract comprehensive data from a single placemark including all available fields"""
         try:
+            # One walk over the subtree collects everything the fields below need
+            visitor = PlacemarkVisitor().visit(placemark)
+            
             # Extract basic information
-            name = self._get_element_text(placemark, 'kml:name')
-            description = self._get_element_text(placemark, 'kml:description')
+            name = visitor.direct_text(KML_NS + 'name')
+            description = visitor.direct_text(KML_NS + 'description')
             clean_description = self._clean_html_tags(description)
             
             print(f"    📝 Placemark name: {name or 'Unnamed'}")
             
             # Extract geometry
-            geometry_data = self._extract_geometry(placemark)
+            geometry_data = self._extract_geometry(visitor)
             if not geometry_data:
                 print(f"    ❌ No geometry found for placemark: {name or 'Unnamed'}")
                 return None
@@ -98,22 +335,17 @@ class KMLParser:
             print(f"    🗺️ Geometry type: {geometry_data['type']}")
             
             # Extract custom data (kitta number, owner name)
-            custom_data = self._extract_custom_data(placemark, description, name)
+            custom_data = self._extract_custom_data(visitor.data_pairs, description, name)
             
             # Extract extended data
-            extended_data = self._extract_extended_data(placemark)
-            
-            # Extract time information
-            time_data = self._extract_time_data(placemark)
-            
-            # Extract style information
-            style_data = self._extract_style_data(placemark)
-            
-            # Extract altitude and other geometric properties
-            altitude_data = self._extract_altitude_data(placemark)
+            extended_data = {
+                key: self._clean_html_tags(value)
+                for key, value in visitor.data_pairs + visitor.simple_data
+            }
             
-            # Extract address information
-            address_data = self._extract_address_data(placemark)
+            time_data = visitor.time
+            altitude_data = visitor.altitude_data()
+            address_data = visitor.address
             
             # Extract phone number and website
             contact_data = {
@@ -128,8 +360,13 @@ class KMLParser:
                 'owner_name': custom_data.get('owner_name', ''),
                 'geometry_type': geometry_data['type'],
                 'coordinates': json.dumps(geometry_data['coordinates']),
-                'area_hectares': geometry_data.get('area_hectares'),
-                'area_sqm': geometry_data.get('area_sqm'),
+                'area_hectares': None,
+                'area_sqm': None,
+                'min_lon': geometry_data['bbox'][0],
+                'min_lat': geometry_data['bbox'][1],
+                'max_lon': geometry_data['bbox'][2],
+                'max_lat': geometry_data['bbox'][3],
+                'geometry_wkb': geometry_data['wkb'],
                 'description': clean_description,
                 
                 # Extended data (hidden in preview, included in CSV)
@@ -141,8 +378,8 @@ class KMLParser:
                 'altitude_mode': altitude_data.get('altitude_mode'),
                 'tessellate': altitude_data.get('tessellate'),
                 'extrude': altitude_data.get('extrude'),
-                'style_id': style_data.get('style_id'),
-                'style_url': style_data.get('style_url'),
+                'style_id': visitor.style_id,
+                'style_url': visitor.style_url,
                 'address': address_data.get('address'),
                 'country_code': address_data.get('country_code'),
                 'administrative_area': address_data.get('administrative_area'),
@@ -153,12 +390,12 @@ class KMLParser:
                 'postal_code': address_data.get('postal_code'),
                 'phone_number': contact_data.get('phone_number'),
                 'website': '', # Removed website field
-                'snippet': self._get_element_text(placemark, 'kml:snippet'),
-                'visibility': self._get_element_text(placemark, 'kml:visibility'),
-                'open': self._get_element_text(placemark, 'kml:open'),
-                'atom_author': self._get_element_text(placemark, 'atom:author'),
-                'atom_link': self._get_element_text(placemark, 'atom:link'),
-                'xal_address_details': self._get_element_text(placemark, 'xal:AddressDetails'),
+                'snippet': visitor.direct_text(KML_NS + 'snippet'),
+                'visibility': visitor.direct_text(KML_NS + 'visibility'),
+                'open': visitor.direct_text(KML_NS + 'open'),
+                'atom_author': visitor.direct_text(ATOM_NS + 'author'),
+                'atom_link': visitor.direct_text(ATOM_NS + 'link'),
+                'xal_address_details': visitor.direct_text(XAL_NS + 'AddressDetails'),
             }
             
             return comprehensive_data
@@ -167,120 +404,6 @@ class KMLParser:
             logger.error(f"Error extracting comprehensive placemark data: {e}")
             return None
     
-    def _extract_extended_data(self, placemark):
-        """Extract all extended data from placemark"""
-        extended_data = {}
-        extended_data_elem = placemark.find('.//kml:ExtendedData', self.namespace)
-        
-        if extended_data_elem is not None:
-            # Extract Data elements
-            for data_elem in extended_data_elem.findall('kml:Data', self.namespace):
-                name = data_elem.get('name')
-                value_elem = data_elem.find('kml:value', self.namespace)
-                if name and value_elem is not None and value_elem.text:
-                    extended_data[name] = self._clean_html_tags(value_elem.text.strip())
-            
-            # Extract SimpleData elements
-            for simple_data_elem in extended_data_elem.findall('kml:SimpleData', self.namespace):
-                name = simple_data_elem.get('name')
-                if name and simple_data_elem.text:
-                    extended_data[name] = self._clean_html_tags(simple_data_elem.text.strip())
-        
-        return extended_data
-    
-    def _extract_time_data(self, placemark):
-        """Extract time information from placemark"""
-        time_data = {}
-        
-        # Check for TimeSpan
-        timespan = placemark.find('.//kml:TimeSpan', self.namespace)
-        if timespan is not None:
-            time_data['begin'] = self._get_element_text(timespan, 'kml:begin')
-            time_data['end'] = self._get_element_text(timespan, 'kml:end')
-        
-        # Check for TimeStamp
-        timestamp = placemark.find('.//kml:TimeStamp', self.namespace)
-        if timestamp is not None:
-            time_data['when'] = self._get_element_text(timestamp, 'kml:when')
-        
-        return time_data
-    
-    def _extract_style_data(self, placemark):
-        """Extract style information from placemark"""
-        style_data = {}
-        
-        # Check for styleUrl
-        style_url = placemark.find('kml:styleUrl', self.namespace)
-        if style_url is not None and style_url.text:
-            style_data['style_url'] = style_url.text.strip()
-        
-        # Check for inline styles
-        style = placemark.find('.//kml:Style', self.namespace)
-        if style is not None:
-            style_data['style_id'] = style.get('id', '')
-        
-        return style_data
-    
-    def _extract_altitude_data(self, placemark):
-        """Extract altitude and geometric properties"""
-        altitude_data = {}
-        
-        # Check for altitude in Point
-        point = placemark.find('.//kml:Point', self.namespace)
-        if point is not None:
-            altitude_mode = point.find('kml:altitudeMode', self.namespace)
-            if altitude_mode is not None and altitude_mode.text:
-                altitude_data['altitude_mode'] = altitude_mode.text.strip()
-        
-        # Check for altitude in LineString
-        linestring = placemark.find('.//kml:LineString', self.namespace)
-        if linestring is not None:
-            altitude_mode = linestring.find('kml:altitudeMode', self.namespace)
-            if altitude_mode is not None and altitude_mode.text:
-                altitude_data['altitude_mode'] = altitude_mode.text.strip()
-            tessellate = linestring.find('kml:tessellate', self.namespace)
-            if tessellate is not None and tessellate.text:
-                altitude_data['tessellate'] = tessellate.text.strip()
-            extrude = linestring.find('kml:extrude', self.namespace)
-            if extrude is not None and extrude.text:
-                altitude_data['extrude'] = extrude.text.strip()
-        
-        # Check for altitude in Polygon
-        polygon = placemark.find('.//kml:Polygon', self.namespace)
-        if polygon is not None:
-            altitude_mode = polygon.find('.//kml:altitudeMode', self.namespace)
-            if altitude_mode is not None and altitude_mode.text:
-                altitude_data['altitude_mode'] = altitude_mode.text.strip()
-            tessellate = polygon.find('.//kml:tessellate', self.namespace)
-            if tessellate is not None and tessellate.text:
-                altitude_data['tessellate'] = tessellate.text.strip()
-            extrude = polygon.find('.//kml:extrude', self.namespace)
-            if extrude is not None and extrude.text:
-                altitude_data['extrude'] = extrude.text.strip()
-        
-        return altitude_data
-    
-    def _extract_address_data(self, placemark):
-        """Extract address information"""
-        address_data = {}
-        
-        address = placemark.find('.//kml:address', self.namespace)
-        if address is not None and address.text:
-            address_data['address'] = address.text.strip()
-        
-        # Check for structured address
-        structured_address = placemark.find('.//kml:AddressDetails', self.namespace)
-        if structured_address is not None:
-            address_data['country_code'] = self._get_element_text(structured_address, 'kml:Country/kml:countryCode')
-            address_data['administrative_area'] = self._get_element_text(structured_address, 'kml:AdministrativeArea/kml:administrativeAreaName')
-            address_data['sub_administrative_area'] = self._get_element_text(structured_address, 'kml:SubAdministrativeArea/kml:subAdministrativeAreaName')
-            address_data['locality'] = self._get_element_text(structured_address, 'kml:Locality/kml:localityName')
-            address_data['sub_locality'] = self._get_element_text(structured_address, 'kml:SubLocality/kml:subLocalityName')
-            address_data['thoroughfare'] = self._get_element_text(structured_address, 'kml:Thoroughfare/kml:thoroughfareName')
-            address_data['postal_code'] = self._get_element_text(structured_address, 'kml:PostalCode/kml:postalCodeNumber')
-        
-        return address_data
-    
     def _extract_contact_data(self, placemark):
         """Extract contact information from placemark"""
         contact_data = {
@@ -300,6 +423,7 @@ class KMLParser:
         """Legacy method for backward compatibility - extracts limited data for preview"""
         comprehensive_data = self._extract_comprehensive_placemark_data(placemark)
         if comprehensive_data:
+            assign_polygon_areas([comprehensive_data])
             # Return only the fields needed for preview
             return {
                 'placemark_name': comprehensive_data['placemark_name'],
@@ -322,160 +446,362 @@ class KMLParser:
             logger.warning(f"Failed to get element text for {element_name}: {e}")
             return ''
     
-    def _extract_geometry(self, placemark):
-        """Extract geometry data from placemark"""
+    def _extract_geometry(self, visitor):
+        """Build geometry data from the first Point, Polygon or LineString found by the visitor"""
         # Check for Point geometry
-        point = placemark.find('.//kml:Point', self.namespace)
-        if point is not None:
-            coords_elem = point.find('kml:coordinates', self.namespace)
+        if visitor.point is not None:
+            coords_elem = visitor.point.find(KML_NS + 'coordinates')
             if coords_elem is not None and coords_elem.text:
-                coords = self._parse_coordinates(coords_elem.text.strip())
-                if coords:
-                    return {
-                        'type': 'Point',
-                        'coordinates': coords[0]  # Take first coordinate pair
-                    }
+                coords = self._parse_coordinates(coords_elem.text)
+                if len(coords):
+                    return self._geometry_data('Point', coords[0])  # Take first coordinate pair
         
         # Check for Polygon geometry
-        polygon = placemark.find('.//kml:Polygon', self.namespace)
-        if polygon is not None:
-            outer_boundary = polygon.find('.//kml:outerBoundaryIs//kml:coordinates', self.namespace)
-            if outer_boundary is not None and outer_boundary.text:
-                coords = self._parse_coordinates(outer_boundary.text.strip())
-                if coords:
-                    area_hectares, area_sqm = self._calculate_polygon_area(coords)
-                    return {
-                        'type': 'Polygon',
-                        'coordinates': coords,
-                        'area_hectares': area_hectares,
-                        'area_sqm': area_sqm
-                    }
+        if visitor.polygon_coords:
+            coords = self._parse_coordinates(visitor.polygon_coords)
+            if len(coords):
+                # Areas are filled in per batch by assign_polygon_areas
+                return self._geometry_data('Polygon', coords)
         
         # Check for LineString geometry
-        linestring = placemark.find('.//kml:LineString', self.namespace)
-        if linestring is not None:
-            coords_elem = linestring.find('kml:coordinates', self.namespace)
+        if visitor.linestring is not None:
+            coords_elem = visitor.linestring.find(KML_NS + 'coordinates')
             if coords_elem is not None and coords_elem.text:
-                coords = self._parse_coordinates(coords_elem.text.strip())
-                if coords:
-                    return {
-                        'type': 'LineString',
-                        'coordinates': coords
-                    }
+                coords = self._parse_coordinates(coords_elem.text)
+                if len(coords):
+                    return self._geometry_data('LineString', coords)
         
         return None
     
+    def _geometry_data(self, geometry_type, coords):
+        """Geometry fields derived straight from the coordinate array: JSON list, bbox and WKB"""
+        from .spatial import wkb_from_coordinates
+        
+        positions = coords.reshape(-1, 2)
+        return {
+            'type': geometry_type,
+            'coordinates': coords.tolist(),
+            'bbox': (*positions.min(axis=0).tolist(), *positions.max(axis=0).tolist()),
+            'wkb': wkb_from_coordinates(geometry_type, coords) or b'',
+        }
+    
     def _parse_coordinates(self, coords_text):
-        """Parse coordinate string into list of [lon, lat] pairs"""
+        """Parse coordinate string into an (N, 2) array of lon/lat pairs"""
+        return parse_coordinates(coords_text)[:, :2]
+    
+    def _clean_html_tags(self, text):
+        """Remove HTML tags from text"""
+        return clean_text(text)
+    
+    def _extract_custom_data(self, data_pairs, description, placemark_name):
+        """Extract custom data like kitta number and owner name from ExtendedData (name, value) pairs"""
+        return self.extraction_rules.extract(data_pairs, description, placemark_name)
+
+def is_kmz(source):
+    """Whether a path or file object holds a KMZ (zipped KML) rather than plain KML"""
+    if isinstance(source, str):
+        if source.lower().endswith('.kmz'):
+            return True
         try:
-            coords = []
-            for coord_pair in coords_text.split():
-                parts = coord_pair.split(',')
-                if len(parts) >= 2:
-                    lon = float(parts[0])
-                    lat = float(parts[1])
-                    coords.append([lon, lat])
-            return coords
-        except Exception as e:
-            logger.error(f"Error parsing coordinates: {e}")
-            return []
+            with open(source, 'rb') as f:
+                return f.read(4) == b'PK\x03\x04'
+        except OSError:
+            return False
+    position = source.tell()
+    header = source.read(4)
+    source.seek(position)
+    return header == b'PK\x03\x04'
+
+def kmz_document(archive):
+    """Name of the KML document inside a KMZ: doc.kml, else the first top-level .kml member"""
+    names = [name for name in archive.namelist() if name.lower().endswith('.kml')]
+    if not names:
+        raise ValueError("Invalid KMZ file: no KML document found in archive")
+    for name in names:
+        if name.lower() == 'doc.kml':
+            return name
+    return min(names, key=lambda name: name.count('/'))
+
+class KMLParseSession:
+    """A single streaming pass over a KML document that validates it while extracting placemarks"""
+    
+    def __init__(self, source, parser=None):
+        # source is a filesystem path or a binary file object (e.g. an UploadedFile), KML or KMZ
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        self.parser = parser or KMLParser(source if isinstance(source, str) else getattr(source, 'name', ''))
+        self._archive = None
+        self._member = None
+        if is_kmz(source):
+            # Parse straight from the decompressing zip stream; nothing is extracted to disk
+            try:
+                self._archive = zipfile.ZipFile(source)
+                self._member = self._archive.open(kmz_document(self._archive))
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"Invalid KMZ file: {e}")
+            except ValueError:
+                self._archive.close()
+                raise
+            source = self._member
+        self.source = source
+        self.placemark_count = 0
+        self.processed = 0
+        self._events = None
+        self._root_checked = False
+        self._done = False
+        self._pending = deque()
+        self._open = []  # elements whose end tag has not been read yet, root first
+    
+    def __enter__(self):
+        return self
     
-    def _calculate_polygon_area(self, coordinates):
-        """Calculate area of polygon in hectares and square meters"""
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        """Stop parsing; only the bytes read so far have been consumed"""
+        self._done = True
+        self._events = None
+        if self._member is not None:
+            self._member.close()
+            self._archive.close()
+            self._member = self._archive = None
+    
+    def validate(self):
+        """Parse just far enough to find the root and the first placemark; returns a list of errors"""
         try:
-            if len(coordinates) < 3:
-                return None, None
-            
-            # Create polygon from coordinates
-            polygon = Polygon(coordinates)
-            
-            # Calculate area in square meters (approximate)
-            # This is a simplified calculation - for accurate results, 
-            # you'd need proper projection and geodesic calculations
-            area_sqm = polygon.area * 111320 * 111320  # Rough conversion
-            area_hectares = area_sqm / 10000
-            
-            return Decimal(str(area_hectares)), Decimal(str(area_sqm))
-            
-        except Exception as e:
-            logger.error(f"Error calculating polygon area: {e}")
-            return None, None
+            while not self.placemark_count and not self._done:
+                self._advance()
+        except ValueError as e:
+            return [str(e)]
+        if not self.placemark_count:
+            return ["KML file contains no placemarks"]
+        return []
     
-    def _clean_html_tags(self, text):
-        """Remove HTML tags from text"""
-        if not text:
-            return ''
-        # Remove HTML tags
-        clean_text = re.sub(r'<[^>]+>', '', text)
-        # Remove extra whitespace
-        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-        return clean_text
-    
-    def _extract_custom_data(self, placemark, description, placemark_name):
-        """Extract custom data like kitta number and owner name"""
-        custom_data = {
-            'kitta_number': '',
-            'owner_name': ''
-        }
+    def placemarks(self, batch_size=500):
+        """Yield extracted placemark dicts, carrying on from wherever validation stopped
+
+        Placemarks are gathered batch_size at a time so their polygon areas are computed in one bulk pass.
+        """
+        while self._pending or not self._done:
+            while len(self._pending) < batch_size and not self._done:
+                self._advance()
+            batch = list(self._pending)
+            self._pending.clear()
+            yield from assign_polygon_areas(batch)
+    
+    def _advance(self):
+        """Consume events up to the end of the next Placemark (or the end of the document)"""
+        if self._events is None:
+            self._events = ET.iterparse(self.source, events=('start', 'end'))
         
-        # Clean description from HTML tags
-        clean_description = self._clean_html_tags(description)
+        try:
+            for event, elem in self._events:
+                if not self._root_checked:
+                    self._root_checked = True
+                    if not elem.tag.endswith('kml'):
+                        raise ValueError("Invalid KML file: missing or incorrect root element")
+                if event == 'start':
+                    # The extractors key on KML 2.2 tags, so older versions are renamed as they stream in
+                    if not elem.tag.startswith(KML_NS):
+                        elem.tag = kml_tag(elem.tag)
+                    self._open.append(elem)
+                    continue
+                self._open.pop()
+                if elem.tag.rsplit('}', 1)[-1] != 'Placemark':
+                    continue
+                self.placemark_count += 1
+                try:
+                    data = self.parser._extract_comprehensive_placemark_data(elem)
+                    if data:
+                        self.processed += 1
+                        self._pending.append(data)
+                    else:
+                        logger.info(f"Placemark {self.placemark_count} returned no data (skipped)")
+                except Exception as e:
+                    logger.error(f"Error processing placemark {self.placemark_count}: {str(e)}")
+                finally:
+                    # Drop the subtree and detach it from its Document/Folder so memory stays flat
+                    elem.clear()
+                    if self._open:
+                        self._open[-1].remove(elem)
+                return
+        except ET.ParseError as e:
+            self.close()
+            logger.error(f"KML parsing error: {e}")
+            raise ValueError(f"Invalid KML file: XML parsing error ({e})")
+        except OSError as e:
+            self.close()
+            logger.error(f"Unexpected error parsing KML: {e}")
+            raise ValueError(f"Error parsing KML file: {e}")
+        except ValueError:
+            self.close()
+            raise
+        self.close()
+
+# Markup tokens outside the placemarks, matched on bytes: comments, CDATA, PIs/doctype, whole Placemarks
+# (self-closing or not), end tags and start tags. Placemark text inside comments and CDATA is never matched.
+KML_TOKEN_RE = re.compile(
+    rb'<!--.*?-->'
+    rb'|<!\[CDATA\[.*?\]\]>'
+    rb'|<[?!][^>]*>'
+    rb'|(?P<placemark><(?:[\w.-]+:)?Placemark\b(?:[^>]*?/>|.*?</(?:[\w.-]+:)?Placemark\s*>))'
+    rb'|</(?P<end>[\w.:-]+)\s*>'
+    rb'|<(?P<start>[\w.:-]+)[^>]*?(?P<empty>/)?>',
+    re.S,
+)
+
+def _extract_placemark_chunk(path, prefix, suffix, start, end):
+    """Process-pool worker: extract the placemarks between two byte offsets of a KML file"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start)
+    
+    # prefix re-opens the prolog, root and enclosing Document/Folder tags, so their namespaces still apply
+    with KMLParseSession(BytesIO(prefix + body + suffix)) as session:
+        return list(session.placemarks())
+
+class ParallelKMLIngest:
+    """Split a large KML into placemark chunks and extract them in a shared process pool"""
+    
+    _executor = None
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def workers():
+        return getattr(settings, 'INGEST_WORKERS', 0) or 0
+    
+    @classmethod
+    def should_use(cls, path):
+        """Whether a file is large enough, and the pool configured, for parallel extraction"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        # KMZ members are compressed, so they cannot be split by byte offset
+        return (cls.workers() > 1 and size >= getattr(settings, 'INGEST_PARALLEL_MIN_BYTES', 5 * 1024 * 1024)
+                and not is_kmz(path))
+    
+    @classmethod
+    def executor(cls):
+        """The process pool, started on first use and shared by every ingestion job"""
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
         
-        # Try to extract from ExtendedData first
-        extended_data = placemark.find('.//kml:ExtendedData', self.namespace)
-        if extended_data is not None:
-            for data in extended_data.findall('kml:Data', self.namespace):
-                name = data.get('name')
-                value_elem = data.find('kml:value', self.namespace)
-                if name and value_elem is not None and value_elem.text:
-                    clean_value = self._clean_html_tags(value_elem.text.strip())
-                    if 'kitta' in name.lower():
-                        custom_data['kitta_number'] = clean_value
-                    elif 'owner' in name.lower() or 'name' in name.lower():
-                        custom_data['owner_name'] = clean_value
+        with cls._lock:
+            if cls._executor is None:
+                # spawn: the parent runs job threads, which fork() does not copy safely
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=cls.workers(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return cls._executor
+    
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=False, cancel_futures=True)
+                cls._executor = None
+    
+    @staticmethod
+    def split(path, chunk_size=None):
+        """Return (prefix, suffix, start, end) chunks holding chunk_size placemarks each
+
+        Each chunk is the raw bytes between two placemark boundaries; prefix and suffix open and close
+        the elements enclosing it (root, Document, Folder...), so every chunk parses as a document of its own.
+        """
+        import mmap
         
-        # Try to extract from description if not found in ExtendedData
-        if not custom_data['kitta_number'] or not custom_data['owner_name']:
-            # Look for kitta number patterns in clean description
-            kitta_patterns = [
-                r'kitta\s*number\s*:?\s*([^\s\n\r]+)',
-                r'kitta\s*:?\s*([^\s\n\r]+)',
-                r'kml_\d+_\d+_\d+',  # Pattern like KML_1_11_10
-                r'kml-\d+-\d+-\d+',  # Pattern like KML-1-11-10
-            ]
-            
-            for pattern in kitta_patterns:
-                match = re.search(pattern, clean_description, re.IGNORECASE)
-                if match:
-                    custom_data['kitta_number'] = match.group(1) if len(match.groups()) > 0 else match.group(0)
-                    break
+        chunk_size = chunk_size or getattr(settings, 'INGEST_PARALLEL_CHUNK_SIZE', 1000)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            prolog = None
+            stack = []  # (name, start tag) of the open elements below the root
+            root = None
+            chunks = []
+            chunk = None
+            count = 0
             
-            # Look for owner name patterns
-            owner_patterns = [
-                r'owner\s*name\s*:?\s*([^\n\r]+)',
-                r'owner\s*:?\s*([^\n\r]+)',
-                r'name\s*:?\s*([^\n\r]+)',
-            ]
+            def enclosing():
+                return (
+                    prolog + b''.join(tag for _, tag in stack),
+                    b''.join(b'</' + name + b'>' for name, _ in reversed(stack)) + b'</' + root + b'>',
+                )
             
-            for pattern in owner_patterns:
-                match = re.search(pattern, clean_description, re.IGNORECASE)
-                if match:
-                    potential_owner = match.group(1).strip()
-                    # Skip if it's the same as kitta number or placemark name
-                    if (potential_owner != custom_data['kitta_number'] and 
-                        potential_owner != placemark_name):
-                        custom_data['owner_name'] = potential_owner
+            for match in KML_TOKEN_RE.finditer(data):
+                if match.group('placemark'):
+                    if root is None:
                         break
+                    if chunk is None:
+                        chunk = [enclosing()[0], match.start()]
+                    count += 1
+                    if count == chunk_size:
+                        chunks.append((chunk[0], enclosing()[1], chunk[1], match.end()))
+                        chunk, count = None, 0
+                    last = match.end()
+                elif match.group('start'):
+                    if root is None:
+                        root = match.group('start')
+                        prolog = data[:match.end()]
+                        if not root.endswith(b'kml') or match.group('empty'):
+                            break
+                    elif not match.group('empty'):
+                        stack.append((match.group('start'), match.group(0)))
+                elif match.group('end') and stack:
+                    name = match.group('end')
+                    # Pop back to the matching start tag; stray end tags are left to the XML parser
+                    for depth in range(len(stack) - 1, -1, -1):
+                        if stack[depth][0] == name:
+                            del stack[depth:]
+                            break
+            
+            if root is None or not root.endswith(b'kml'):
+                raise ValueError("Invalid KML file: missing or incorrect root element")
+            if chunk is not None:
+                chunks.append((chunk[0], enclosing()[1], chunk[1], last))
+        return chunks
+    
+    @classmethod
+    def iter_placemarks(cls, path):
+        """Yield extracted placemark dicts in document order, chunks extracted concurrently
+
+        If a chunk does not parse on its own, the rest of the file is read by the serial streaming path.
+        """
+        chunks = cls.split(path)
+        logger.info(f"Parallel KML extraction of {path}: {len(chunks)} chunks, {cls.workers()} workers")
         
-        # If still no owner name, use placemark name as fallback
-        if not custom_data['owner_name'] and placemark_name:
-            custom_data['owner_name'] = placemark_name
-        
-        # Clean up any remaining HTML artifacts
-        custom_data['kitta_number'] = self._clean_html_tags(custom_data['kitta_number'])
-        custom_data['owner_name'] = self._clean_html_tags(custom_data['owner_name'])
+        executor = cls.executor()
+        futures = [executor.submit(_extract_placemark_chunk, path, *chunk) for chunk in chunks]
+        yielded = 0
+        try:
+            # Results are consumed in submission order, so rows keep their document order
+            for future in futures:
+                try:
+                    rows = future.result()
+                except ValueError as e:
+                    logger.warning(f"Parallel KML extraction of {path} failed on a chunk, continuing serially: {e}")
+                    break
+                yield from rows
+                yielded += len(rows)
+            else:
+                return
+        finally:
+            for future in futures:
+                future.cancel()
         
-        return custom_data
+        # The serial pass yields the same rows in the same order, so skip the ones already produced
+        with KMLParseSession(path) as session:
+            for index, data in enumerate(session.placemarks()):
+                if index >= yielded:
+                    yield data
+
+def iter_kml_placemarks(path):
+    """Placemark dicts for a stored KML file: parallel chunks for large files, one streaming session otherwise"""
+    if ParallelKMLIngest.should_use(path):
+        yield from ParallelKMLIngest.iter_placemarks(path)
+        return
+    with KMLParseSession(path) as session:
+        yield from session.placemarks()
 
 class KMLExporter:
     """Utility class for exporting KML data to various formats"""
@@ -691,6 +1017,68 @@ class KMLExporter:
             logger.error(f"Error exporting to KML: {e}")
             raise ValueError(f"Error creating KML export: {e}")
 
+def ingest_kml_file(kml_file, progress_callback=None):
+    """Validate and extract a stored KMLFile (in parallel when large) and bulk-insert its placemarks as KMLData"""
+    from django.db import transaction
+    from .models import KMLData
+    from .file_utils import BulkInserter
+    
+    file_path = kml_file.file.path
+    if not os.path.exists(file_path):
+        raise ValueError(f"KML file not found: {file_path}")
+    
+    kml_file.processing_status = 'processing'
+    kml_file.save(update_fields=['processing_status'])
+    
+    # Only pass fields the KMLData model actually has
+    allowed_fields = set(f.name for f in KMLData._meta.get_fields() if f.concrete and not f.auto_created and f.name != 'id')
+    
+    try:
+        with transaction.atomic(), BulkInserter(KMLData, progress_callback=progress_callback, label=kml_file.original_filename) as writer:
+            for data in iter_kml_placemarks(file_path):
+                filtered_data = {k: v for k, v in data.items() if k in allowed_fields}
+                writer.add(KMLData(kml_file=kml_file, **filtered_data))
+        
+        if not writer.count:
+            raise ValueError("No valid placemarks found in KML file")
+    except Exception as e:
+        kml_file.processing_status = 'error'
+        kml_file.error_message = str(e)
+        kml_file.save(update_fields=['processing_status', 'error_message'])
+        raise
+    
+    kml_file.is_processed = True
+    kml_file.processing_status = 'completed'
+    kml_file.error_message = None
+    kml_file.save(update_fields=['is_processed', 'processing_status', 'error_message', 'updated_at'])
+    
+    logger.info(f"Saved {writer.count} placemarks for {kml_file.original_filename}")
+    return {
+        'kml_file_id': str(kml_file.id),
+        'data_count': writer.count,
+    }
+
+def reuse_parsed_kml(kml_file):
+    """Copy KMLData from an already parsed KMLFile with the same content hash and extraction rules; returns True if reused"""
+    from .models import KMLFile
+    from .file_utils import copy_parsed_rows
+    
+    if not kml_file.content_hash:
+        return False
+    
+    source = KMLFile.objects.filter(
+        content_hash=kml_file.content_hash, extraction_source=kml_file.extraction_source, is_processed=True
+    ).exclude(id=kml_file.id).exclude(parsed_data=None).order_by('-uploaded_at').first()
+    if source is None:
+        return False
+    
+    data_count = copy_parsed_rows(source.parsed_data.all(), kml_file=kml_file)
+    kml_file.is_processed = True
+    kml_file.processing_status = 'completed'
+    kml_file.save(update_fields=['is_processed', 'processing_status', 'updated_at'])
+    logger.info(f"Reused {data_count} parsed placemarks from {source.id} for {kml_file.id}")
+    return True
+
 def get_client_ip(request):
     """Get client IP address"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -8,10 +8,14 @@ from django.db.models import Q
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.urls import reverse
 import json
 import os
 from .models import KMLFile, KMLData, DownloadLog
-from .kml_utils import KMLParser, KMLExporter, log_download, cleanup_temp_files
+from .kml_utils import KMLParser, KMLExporter, log_download, cleanup_temp_files, reuse_parsed_kml
+from .file_utils import ContentStore
+from .geojson_cache import GeoJSONCache
+from .jobs import enqueue_job
 import logging
 
 logger = logging.getLogger(__name__)
@@ -49,62 +53,34 @@ class KMLUploadView(LoginRequiredMixin, View):
             print("✅ File validation passed")
             logger.info("KML file validation passed")
             
-            # Save KML file
+            # Save KML file (content-addressed, so identical uploads share one blob)
             print("📁 Saving KML file to database...")
-            kml_instance = KMLFile.objects.create(
-                user=request.user,
-                file=kml_file,
-                original_filename=kml_file.name,
-                file_size=kml_file.size,
-                processing_status='processing'
-            )
+            with ContentStore.storing(kml_file) as (stored_name, content_hash, file_size):
+                kml_instance = KMLFile.objects.create(
+                    user=request.user,
+                    file=stored_name,
+                    original_filename=kml_file.name,
+                    file_size=file_size,
+                    content_hash=content_hash,
+                    processing_status='pending'
+                )
             print(f"✅ KML file saved with ID: {kml_instance.id}")
             logger.info(f"KML file saved with ID: {kml_instance.id}")
             
-            # Parse KML file
-            try:
-                print("🔍 Parsing KML file...")
-                parsed_data = self._parse_kml_file(kml_instance)
-                print(f"✅ Parsed {len(parsed_data)} placemarks")
-                logger.info(f"KML parsing successful: {len(parsed_data)} placemarks found")
-                
-                # Save parsed data
-                print("💾 Saving parsed data to database...")
-                # Get allowed fields from KMLData model
-                allowed_fields = set(f.name for f in KMLData._meta.get_fields() if f.concrete and not f.auto_created and f.name != 'id')
-                for i, data in enumerate(parsed_data):
-                    filtered_data = {k: v for k, v in data.items() if k in allowed_fields}
-                    KMLData.objects.create(
-                        kml_file=kml_instance,
-                        **filtered_data
-                    )
-                    if i < 3:  # Log first 3 items
-                        print(f"  - Saved placemark {i+1}: {data.get('placemark_name', 'Unnamed')}")
-                
-                print(f"✅ Saved {len(parsed_data)} placemarks to database")
-                logger.info(f"Saved {len(parsed_data)} placemarks to database")
-                
-                kml_instance.is_processed = True
-                kml_instance.processing_status = 'completed'
-                kml_instance.save()
-                
-                print("✅ KML processing completed successfully")
-                logger.info("KML processing completed successfully")
-                
+            # Identical content was parsed before: copy its rows instead of reparsing
+            if reuse_parsed_kml(kml_instance):
+                print(f"♻️ Reused parsed data for identical content {content_hash[:12]}")
+                logger.info(f"Reused parsed KML data for kml_id: {kml_instance.id}")
                 messages.success(request, f'KML file "{kml_file.name}" uploaded and parsed successfully!')
-                print(f"🔄 Redirecting to kml_preview with kml_id: {kml_instance.id}")
-                logger.info(f"Redirecting to kml_preview with kml_id: {kml_instance.id}")
                 return redirect('kml_preview', kml_id=kml_instance.id)
-                
-            except Exception as e:
-                print(f"❌ Error parsing KML file: {str(e)}")
-                logger.error(f"Error parsing KML file: {str(e)}", exc_info=True)
-                kml_instance.processing_status = 'error'
-                kml_instance.error_message = str(e)
-                kml_instance.save()
-                
-                messages.error(request, f'Error parsing KML file: {str(e)}')
-                return redirect('kml_upload')
+            
+            # Queue parsing so the request returns immediately
+            job = enqueue_job('parse_kml', user=request.user, kml_file=kml_instance)
+            print(f"✅ Queued parse job {job.id}")
+            logger.info(f"Queued KML parse job {job.id} for kml_id: {kml_instance.id}")
+            
+            messages.success(request, f'KML file "{kml_file.name}" uploaded. Parsing is running in the background.')
+            return redirect(f"{reverse('kml_preview', kwargs={'kml_id': kml_instance.id})}?job_id={job.id}")
                 
         except Exception as e:
             print(f"❌ General error in KML upload: {str(e)}")
@@ -115,7 +91,7 @@ class KMLUploadView(LoginRequiredMixin, View):
     def _validate_kml_file(self, file):
         """Validate KML file"""
         # Check file extension
-        if not file.name.lower().endswith('.kml'):
+        if not file.name.lower().endswith(('.kml', '.kmz')):
             return False
         
         # Check file size (50MB limit)
@@ -123,49 +99,6 @@ class KMLUploadView(LoginRequiredMixin, View):
             return False
         
         return True
-    
-    def _parse_kml_file(self, kml_instance):
-        """Parse KML file and return comprehensive parsed data"""
-        print(f"🔍 Starting KML parsing for file: {kml_instance.original_filename}")
-        logger.info(f"Starting KML parsing for file: {kml_instance.original_filename}")
-        
-        try:
-            # Get file path
-            file_path = kml_instance.file.path
-            print(f"📂 File path: {file_path}")
-            logger.info(f"KML file path: {file_path}")
-            
-            # Check if file exists
-            if not os.path.exists(file_path):
-                print(f"❌ File does not exist: {file_path}")
-                logger.error(f"KML file does not exist: {file_path}")
-                raise ValueError(f"KML file not found: {file_path}")
-            
-            print("✅ File exists, proceeding with parsing")
-            
-            # Parse KML with comprehensive data extraction
-            parser = KMLParser(file_path)
-            print("🔧 KMLParser created, calling parse_kml()...")
-            parsed_data = parser.parse_kml()
-            
-            print(f"✅ KML parsing completed. Found {len(parsed_data)} placemarks")
-            logger.info(f"KML parsing completed. Found {len(parsed_data)} placemarks")
-            
-            if not parsed_data:
-                print("❌ No placemarks found in KML file")
-                logger.warning("No placemarks found in KML file")
-                raise ValueError("No valid placemarks found in KML file")
-            
-            # Log first few placemarks for debugging
-            for i, data in enumerate(parsed_data[:3]):
-                print(f"  Placemark {i+1}: {data.get('placemark_name', 'Unnamed')} - {data.get('geometry_type', 'Unknown')}")
-            
-            return parsed_data
-            
-        except Exception as e:
-            print(f"❌ Error in _parse_kml_file: {str(e)}")
-            logger.error(f"Error in _parse_kml_file: {str(e)}", exc_info=True)
-            raise ValueError(f"Failed to parse KML file: {str(e)}")
 
 class KMLPreviewView(LoginRequiredMixin, View):
     """View for KML data preview"""
@@ -238,7 +171,7 @@ class KMLPreviewView(LoginRequiredMixin, View):
             if not kml_data.exists():
                 messages.error(request, 'No data available for export.')
                 return redirect('kml_preview', kml_id=kml_file.id)
-            filename = f"{kml_file.original_filename.replace('.kml', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+            filename = f"{os.path.splitext(kml_file.original_filename)[0]}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
             response = KMLExporter.export_to_csv(kml_data, filename)
             if not hasattr(response, 'content') or not response.content:
                 logger.error('CSV export: No content in response!')
@@ -266,7 +199,7 @@ class KMLPreviewView(LoginRequiredMixin, View):
             if not kml_data.exists():
                 messages.error(request, 'No data available for export.')
                 return redirect('kml_preview', kml_id=kml_file.id)
-            filename = f"{kml_file.original_filename.replace('.kml', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+            filename = f"{os.path.splitext(kml_file.original_filename)[0]}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
             response = KMLExporter.export_to_shapefile(kml_data, filename)
             if not hasattr(response, 'content') or not response.content:
                 logger.error('Shapefile export: No content in response!')
@@ -294,7 +227,7 @@ class KMLPreviewView(LoginRequiredMixin, View):
             if not kml_data.exists():
                 messages.error(request, 'No data available for export.')
                 return redirect('kml_preview', kml_id=kml_file.id)
-            filename = f"{kml_file.original_filename.replace('.kml', '')}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+            filename = f"{os.path.splitext(kml_file.original_filename)[0]}_export_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
             response = KMLExporter.export_to_kml(kml_data, filename)
             log_download(
                 user=request.user,
@@ -431,12 +364,11 @@ class KMLDeleteView(LoginRequiredMixin, View):
             KMLData.objects.filter(kml_file=kml_file).delete()
             DownloadLog.objects.filter(kml_file=kml_file).delete()
             
-            # Delete file from storage
-            if kml_file.file:
-                kml_file.file.delete(save=False)
-            
-            # Delete KML file record
+            # Delete KML file record, then the stored file if no other upload shares it
+            stored_name = kml_file.file.name if kml_file.file else ''
             kml_file.delete()
+            ContentStore.release(stored_name)
+            GeoJSONCache.invalidate('kml', kml_id)
             
             messages.success(request, f'KML file "{kml_file.original_filename}" deleted successfully.')
             return redirect('kml_list')
@@ -449,43 +381,6 @@ class KMLDeleteView(LoginRequiredMixin, View):
 class KMLGeoJSONView(LoginRequiredMixin, View):
     """Return all KML geometries as GeoJSON for Leaflet preview"""
     def get(self, request, kml_id):
-        from shapely.geometry import mapping
-        import json
         kml_file = get_object_or_404(KMLFile, id=kml_id, user=request.user)
         kml_data = KMLData.objects.filter(kml_file=kml_file)
-        features = []
-        for item in kml_data:
-            try:
-                coords = json.loads(item.coordinates)
-                if item.geometry_type == 'Point':
-                    from shapely.geometry import Point
-                    geom = Point(coords[0], coords[1])
-                elif item.geometry_type == 'Polygon':
-                    from shapely.geometry import Polygon
-                    geom = Polygon(coords)
-                elif item.geometry_type == 'LineString':
-                    from shapely.geometry import LineString
-                    geom = LineString(coords)
-                else:
-                    continue
-                features.append({
-                    'type': 'Feature',
-                    'geometry': mapping(geom),
-                    'properties': {
-                        'placemark_name': item.placemark_name,
-                        'kitta_number': item.kitta_number,
-                        'owner_name': item.owner_name,
-                        'geometry_type': item.geometry_type,
-                        'area_hectares': float(item.area_hectares) if item.area_hectares else None,
-                        'area_sqm': float(item.area_sqm) if item.area_sqm else None,
-                        'description': item.description,
-                        'id': str(item.id)
-                    }
-                })
-            except Exception as e:
-                continue
-        geojson = {
-            'type': 'FeatureCollection',
-            'features': features
-        }
-        return JsonResponse(geojson) 
\ No newline at end of file
+        return GeoJSONCache.serve(request, 'kml', kml_file.id, kml_data)
@@ -0,0 +1,52 @@
+import os
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from userdashboard.models import FileUpload, KMLFile
+from userdashboard.file_utils import ContentStore
+
+
+class Command(BaseCommand):
+    help = 'Move existing uploads into the content-addressed blob store and drop byte-identical copies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without touching files')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Deduplicating stored uploads...')
+        dry_run = options['dry_run']
+        moved = 0
+        missing = 0
+
+        # Collect every stored name that has not been hashed yet, across both upload models
+        names = set()
+        for model in (KMLFile, FileUpload):
+            names.update(
+                model.objects.filter(content_hash='').exclude(file='').values_list('file', flat=True)
+            )
+
+        for name in sorted(names):
+            if name.startswith(f'{ContentStore.BLOB_DIR}/'):
+                continue
+            if not default_storage.exists(name):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'Missing file: {name}'))
+                continue
+            if dry_run:
+                self.stdout.write(f'Would move {name}')
+                continue
+
+            blob, sha256 = ContentStore.adopt(name)
+            for model in (KMLFile, FileUpload):
+                model.objects.filter(file=name).update(file=blob, content_hash=sha256)
+            moved += 1
+            self.stdout.write(f'{name} -> {os.path.basename(blob)}')
+
+        blobs = set()
+        for model in (KMLFile, FileUpload):
+            blobs.update(model.objects.exclude(content_hash='').values_list('file', flat=True))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Done. Processed {moved} files into {len(blobs)} unique blobs ({missing} missing).'
+            )
+        )
@@ -0,0 +1,51 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from userdashboard.jobs import JobWorker, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = 'Run background workers that process queued file uploads and conversions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        requeued, failed = requeue_stale_jobs()
+        if requeued or failed:
+            self.stdout.write(f'Recovered stale jobs: {requeued} requeued, {failed} failed')
+
+        if options['once']:
+            worker = JobWorker(poll_interval=options['poll_interval'])
+            processed = 0
+            while worker.run_once() is not None:
+                processed += 1
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs'))
+            return
+
+        wake_event = threading.Event()
+        workers = [
+            JobWorker(poll_interval=options['poll_interval'], wake_event=wake_event)
+            for _ in range(max(1, options['workers']))
+        ]
+        threads = []
+        for i, worker in enumerate(workers):
+            worker.worker_id = f'{worker.worker_id}-{i}'
+            thread = threading.Thread(target=worker.run_forever, name=f'job-worker-{i}')
+            thread.start()
+            threads.append(thread)
+
+        def shutdown(signum, frame):
+            self.stdout.write('Stopping workers after their current job...')
+            for worker in workers:
+                worker.stop()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+
+        self.stdout.write(self.style.SUCCESS(f'Started {len(workers)} job workers'))
+        for thread in threads:
+            thread.join()
+        self.stdout.write(self.style.SUCCESS('Job workers stopped'))
@@ -0,0 +1,146 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+import json
+import math
+
+from django.db import migrations, models
+
+
+def bbox_from_coordinates(coords):
+    """(min_lon, min_lat, max_lon, max_lat) of stored JSON coordinates, or None (frozen copy for this migration)"""
+    try:
+        coords = json.loads(coords)
+    except ValueError:
+        return None
+
+    def positions(value):
+        if not value:
+            return
+        if isinstance(value[0], (int, float)):
+            yield value[0], value[1]
+            return
+        for part in value:
+            yield from positions(part)
+
+    try:
+        points = [(float(x), float(y)) for x, y in positions(coords)]
+    except (TypeError, ValueError, IndexError):
+        return None
+    points = [(x, y) for x, y in points if math.isfinite(x) and math.isfinite(y)]
+    if not points:
+        return None
+    xs, ys = zip(*points)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def backfill_bbox(apps, schema_editor):
+    fields = ['min_lon', 'min_lat', 'max_lon', 'max_lat']
+    for model_name in ('KMLData', 'CSVData', 'ShapefileData'):
+        model = apps.get_model('userdashboard', model_name)
+        batch = []
+        for obj in model.objects.filter(min_lon__isnull=True).only('pk', 'coordinates').iterator(chunk_size=1000):
+            bbox = bbox_from_coordinates(obj.coordinates) if obj.coordinates else None
+            if bbox is None:
+                continue
+            obj.min_lon, obj.min_lat, obj.max_lon, obj.max_lat = bbox
+            batch.append(obj)
+            if len(batch) >= 1000:
+                model.objects.bulk_update(batch, fields)
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0010_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvdata',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvdata',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvdata',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvdata',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kmldata',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kmldata',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kmldata',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kmldata',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shapefiledata',
+            name='max_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shapefiledata',
+            name='max_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shapefiledata',
+            name='min_lat',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shapefiledata',
+            name='min_lon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='csvdata',
+            index=models.Index(fields=['file_upload', 'min_lon', 'max_lon'], name='userdashboa_file_up_458a96_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='csvdata',
+            index=models.Index(fields=['file_upload', 'min_lat', 'max_lat'], name='userdashboa_file_up_d337d8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kmldata',
+            index=models.Index(fields=['kml_file', 'min_lon', 'max_lon'], name='userdashboa_kml_fil_180201_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kmldata',
+            index=models.Index(fields=['kml_file', 'min_lat', 'max_lat'], name='userdashboa_kml_fil_aecaad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shapefiledata',
+            index=models.Index(fields=['file_upload', 'min_lon', 'max_lon'], name='userdashboa_file_up_b25782_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shapefiledata',
+            index=models.Index(fields=['file_upload', 'min_lat', 'max_lat'], name='userdashboa_file_up_9ea115_idx'),
+        ),
+        migrations.RunPython(backfill_bbox, migrations.RunPython.noop),
+    ]
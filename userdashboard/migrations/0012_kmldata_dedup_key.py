@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:55
+
+import hashlib
+import re
+
+from django.db import migrations, models
+
+
+DEDUP_FIELDS = ('kitta_number', 'owner_name', 'placemark_name', 'area_hectares')
+
+
+def make_dedup_key(kitta_number, owner_name, placemark_name, area_hectares):
+    """Frozen copy of userdashboard.models.make_dedup_key as of this migration"""
+    parts = []
+    for value in (kitta_number, owner_name, placemark_name):
+        text = re.sub(r'<[^>]+>', '', value or '')
+        parts.append(' '.join(text.split()).casefold())
+    parts.append(f'{float(area_hectares):.6f}' if area_hectares not in (None, '') else '')
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def backfill_dedup_key(apps, schema_editor):
+    KMLData = apps.get_model('userdashboard', 'KMLData')
+    batch = []
+    for obj in KMLData.objects.only('pk', *DEDUP_FIELDS).iterator(chunk_size=1000):
+        obj.dedup_key = make_dedup_key(*(getattr(obj, field) for field in DEDUP_FIELDS))
+        batch.append(obj)
+        if len(batch) >= 1000:
+            KMLData.objects.bulk_update(batch, ['dedup_key'])
+            batch = []
+    if batch:
+        KMLData.objects.bulk_update(batch, ['dedup_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0011_feature_bbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kmldata',
+            name='dedup_key',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddIndex(
+            model_name='kmldata',
+            index=models.Index(fields=['dedup_key', 'created_at', 'id'], name='userdashboa_dedup_k_ef3fc3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='kmldata',
+            index=models.Index(fields=['kml_file', 'created_at', 'id'], name='userdashboa_kml_fil_d78302_idx'),
+        ),
+        migrations.RunPython(backfill_dedup_key, migrations.RunPython.noop),
+    ]
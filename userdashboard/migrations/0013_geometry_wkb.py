@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:01
+
+import json
+
+import shapely
+from django.db import migrations, models
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon
+
+
+def wkb_from_coordinates(geometry_type, coords):
+    """2D WKB of stored JSON coordinates, or None (frozen copy for this migration)"""
+    try:
+        coords = json.loads(coords)
+        if not coords:
+            return None
+        if geometry_type == 'Point':
+            geometry = Point(coords[0], coords[1])
+        elif geometry_type == 'LineString':
+            geometry = LineString([c[:2] for c in coords])
+        elif geometry_type == 'Polygon':
+            geometry = Polygon([c[:2] for c in coords])
+        elif geometry_type == 'MultiPolygon':
+            geometry = MultiPolygon([Polygon([c[:2] for c in ring]) for ring in coords])
+        else:
+            return None
+    except (ValueError, TypeError, IndexError, shapely.errors.GEOSException):
+        return None
+    if geometry.is_empty:
+        return None
+    return shapely.to_wkb(geometry)
+
+
+def backfill_geometry_wkb(apps, schema_editor):
+    for model_name in ('KMLData', 'CSVData', 'ShapefileData'):
+        model = apps.get_model('userdashboard', model_name)
+        batch = []
+        queryset = model.objects.filter(geometry_wkb__isnull=True).exclude(coordinates__isnull=True).exclude(coordinates='')
+        for obj in queryset.only('pk', 'geometry_type', 'coordinates').iterator(chunk_size=1000):
+            obj.geometry_wkb = wkb_from_coordinates(obj.geometry_type, obj.coordinates) or b''
+            batch.append(obj)
+            if len(batch) >= 1000:
+                model.objects.bulk_update(batch, ['geometry_wkb'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['geometry_wkb'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0012_kmldata_dedup_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvdata',
+            name='geometry_wkb',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='kmldata',
+            name='geometry_wkb',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='shapefiledata',
+            name='geometry_wkb',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_geometry_wkb, migrations.RunPython.noop),
+    ]
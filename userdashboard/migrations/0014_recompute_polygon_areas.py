@@ -0,0 +1,14 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Kept for the migration graph: the geodesic area recompute runs in 0019, once KMLFile.updated_at
+    exists to invalidate the cached map data, and also refreshes the dedup keys that depend on the area"""
+
+    dependencies = [
+        ('userdashboard', '0013_geometry_wkb'),
+    ]
+
+    operations = []
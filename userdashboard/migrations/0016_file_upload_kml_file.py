@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_kml_files(apps, schema_editor):
+    """Pair existing KML uploads with the KMLFile they were matched to by user and filename, oldest first"""
+    FileUpload = apps.get_model('userdashboard', 'FileUpload')
+    KMLFile = apps.get_model('userdashboard', 'KMLFile')
+
+    linked = set()
+    for upload in FileUpload.objects.filter(file_type='kml', kml_file__isnull=True).order_by('created_at'):
+        kml_file = (
+            KMLFile.objects.filter(user_id=upload.user_id, original_filename=upload.original_filename)
+            .exclude(id__in=linked)
+            .order_by('uploaded_at')
+            .first()
+        )
+        if kml_file is not None:
+            linked.add(kml_file.id)
+            upload.kml_file = kml_file
+            upload.save(update_fields=['kml_file'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0015_upload_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='kml_file',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='file_upload', to='userdashboard.kmlfile'),
+        ),
+        migrations.RunPython(link_kml_files, migrations.RunPython.noop),
+    ]
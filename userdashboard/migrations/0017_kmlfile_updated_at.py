@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0016_file_upload_kml_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kmlfile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0017_kmlfile_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
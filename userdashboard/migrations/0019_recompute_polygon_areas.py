@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:10
+
+import hashlib
+import re
+from decimal import Decimal
+
+import numpy as np
+import shapely
+from django.db import migrations
+from django.utils import timezone
+from pyproj import Transformer
+
+DEDUP_FIELDS = ('kitta_number', 'owner_name', 'placemark_name', 'area_hectares')
+AREA_CELL_DEGREES = 6
+BATCH_SIZE = 1000
+
+
+def make_dedup_key(kitta_number, owner_name, placemark_name, area_hectares):
+    """Frozen copy of userdashboard.models.make_dedup_key as of this migration"""
+    parts = []
+    for value in (kitta_number, owner_name, placemark_name):
+        text = re.sub(r'<[^>]+>', '', value or '')
+        parts.append(' '.join(text.split()).casefold())
+    parts.append(f'{float(area_hectares):.6f}' if area_hectares not in (None, '') else '')
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def geodesic_areas(geometries):
+    """Frozen copy of userdashboard.spatial.geodesic_areas: m² via per-cell Lambert equal-area projections"""
+    geometries = np.asarray(geometries, dtype=object)
+    areas = np.full(len(geometries), np.nan)
+    indices = np.flatnonzero(np.isin(shapely.get_type_id(geometries), (3, 6)) & ~shapely.is_empty(geometries))
+    if not len(indices):
+        return areas
+    bounds = shapely.bounds(geometries[indices])
+    centres = np.column_stack(((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2))
+    cells = np.floor(centres / AREA_CELL_DEGREES).astype(int)
+    for cell in np.unique(cells, axis=0):
+        in_cell = (cells == cell).all(axis=1)
+        lon_0, lat_0 = ((cell + 0.5) * AREA_CELL_DEGREES).tolist()
+        transformer = Transformer.from_crs(
+            'EPSG:4326', f'+proj=laea +lat_0={max(-90.0, min(90.0, lat_0))} +lon_0={lon_0} +datum=WGS84 +units=m',
+            always_xy=True,
+        )
+        projected = shapely.transform(
+            geometries[indices[in_cell]],
+            lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])),
+        )
+        areas[indices[in_cell]] = shapely.area(projected)
+    return areas
+
+
+def recompute_polygon_areas(apps, schema_editor):
+    """Replace the degree-squared area approximation with geodesic areas for stored KML polygons
+
+    Batches are read by primary key so the table is never loaded whole. dedup_key depends on the area,
+    so it is recomputed with it, and the owning files are touched so cached map data is rebuilt.
+    """
+    KMLData = apps.get_model('userdashboard', 'KMLData')
+    KMLFile = apps.get_model('userdashboard', 'KMLFile')
+    queryset = (
+        KMLData.objects.filter(geometry_type='Polygon')
+        .exclude(geometry_wkb__isnull=True).exclude(geometry_wkb=b'')
+        .only('pk', 'kml_file_id', 'geometry_wkb', *DEDUP_FIELDS)
+        .order_by('pk')
+    )
+    last_pk = None
+    while True:
+        batch = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        areas = geodesic_areas(shapely.from_wkb([bytes(row.geometry_wkb) for row in batch], on_invalid='ignore'))
+        updated = []
+        for row, area_sqm in zip(batch, areas.tolist()):
+            if not np.isfinite(area_sqm):
+                continue
+            row.area_sqm = Decimal(f"{area_sqm:.2f}")
+            row.area_hectares = Decimal(f"{area_sqm / 10000:.6f}")
+            row.dedup_key = make_dedup_key(*(getattr(row, field) for field in DEDUP_FIELDS))
+            updated.append(row)
+        KMLData.objects.bulk_update(updated, ['area_sqm', 'area_hectares', 'dedup_key'])
+        KMLFile.objects.filter(pk__in={row.kml_file_id for row in updated}).update(updated_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0018_processingjob_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_polygon_areas, migrations.RunPython.noop),
+    ]
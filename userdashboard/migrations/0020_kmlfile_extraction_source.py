@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userdashboard', '0019_recompute_polygon_areas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kmlfile',
+            name='extraction_source',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -3,7 +3,9 @@ from django.conf import settings
 from django.utils import timezone
 import uuid
 import os
+import re
 import json
+import hashlib
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import JSONField
 
@@ -55,6 +57,9 @@ class FileUpload(models.Model):
     coordinate_system = models.CharField(max_length=50, blank=True, null=True)
     feature_count = models.PositiveIntegerField(default=0)
     bounds = models.JSONField(default=dict, blank=True)  # minx, miny, maxx, maxy
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # SHA-256 of file content
+    # KMLFile holding the parsed placemarks of a KML upload; each upload gets its own
+    kml_file = models.OneToOneField('KMLFile', on_delete=models.SET_NULL, null=True, blank=True, related_name='file_upload')
     
     class Meta:
         ordering = ['-created_at']
@@ -62,6 +67,7 @@ class FileUpload(models.Model):
             models.Index(fields=['user', 'file_type']),
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['file_type', 'status']),
+            models.Index(fields=['content_hash', 'file_type']),
         ]
     
     def __str__(self):
@@ -223,7 +229,65 @@ class FileConversion(models.Model):
     def __str__(self):
         return f"{self.source_file.original_filename} → {self.get_conversion_type_display()}"
 
-class CSVData(models.Model):
+DEDUP_FIELDS = ('kitta_number', 'owner_name', 'placemark_name', 'area_hectares')
+
+def make_dedup_key(kitta_number, owner_name, placemark_name, area_hectares):
+    """SHA-1 of the normalized kitta/owner/placemark/area used to collapse duplicate survey records"""
+    parts = []
+    for value in (kitta_number, owner_name, placemark_name):
+        text = re.sub(r'<[^>]+>', '', value or '')
+        parts.append(' '.join(text.split()).casefold())
+    parts.append(f'{float(area_hectares):.6f}' if area_hectares not in (None, '') else '')
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+class BoundingBoxMixin(models.Model):
+    """Per-feature lon/lat bounding box, filled at ingest for viewport queries"""
+    min_lon = models.FloatField(null=True, blank=True)
+    min_lat = models.FloatField(null=True, blank=True)
+    max_lon = models.FloatField(null=True, blank=True)
+    max_lat = models.FloatField(null=True, blank=True)
+    
+    class Meta:
+        abstract = True
+    
+    def fill_bbox(self):
+        """Compute the bounding box from the stored coordinates"""
+        from .spatial import bbox_from_coordinates
+        bbox = bbox_from_coordinates(self.coordinates) if self.coordinates else None
+        self.min_lon, self.min_lat, self.max_lon, self.max_lat = bbox or (None, None, None, None)
+        return bbox
+    
+    def save(self, *args, **kwargs):
+        if self.min_lon is None and self.coordinates:
+            self.fill_bbox()
+        super().save(*args, **kwargs)
+
+class GeometryWKBMixin(models.Model):
+    """Per-feature 2D WKB geometry, filled at ingest so map and export reads skip JSON parsing"""
+    # None means not encoded yet; b'' marks coordinates that do not form a geometry
+    geometry_wkb = models.BinaryField(null=True, blank=True, editable=False)
+    
+    class Meta:
+        abstract = True
+    
+    def fill_geometry_wkb(self):
+        """Encode the stored coordinates as WKB"""
+        from .spatial import wkb_from_coordinates
+        self.geometry_wkb = (wkb_from_coordinates(self.geometry_type, self.coordinates) if self.coordinates else None) or b''
+        return self.geometry_wkb
+    
+    @property
+    def shape(self):
+        """The decoded shapely geometry, or None"""
+        from .spatial import decode_geometries
+        return decode_geometries([self])[0]
+    
+    def save(self, *args, **kwargs):
+        if self.geometry_wkb is None and self.coordinates:
+            self.fill_geometry_wkb()
+        super().save(*args, **kwargs)
+
+class CSVData(BoundingBoxMixin, GeometryWKBMixin):
     """Model to store parsed CSV data"""
     file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='csv_data')
     row_number = models.PositiveIntegerField()
@@ -236,12 +300,14 @@ class CSVData(models.Model):
         ordering = ['row_number']
         indexes = [
             models.Index(fields=['file_upload', 'row_number']),
+            models.Index(fields=['file_upload', 'min_lon', 'max_lon']),
+            models.Index(fields=['file_upload', 'min_lat', 'max_lat']),
         ]
     
     def __str__(self):
         return f"Row {self.row_number} - {self.file_upload.original_filename}"
 
-class ShapefileData(models.Model):
+class ShapefileData(BoundingBoxMixin, GeometryWKBMixin):
     """Model to store parsed Shapefile data"""
     file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='shapefile_data')
     feature_id = models.PositiveIntegerField()
@@ -254,6 +320,8 @@ class ShapefileData(models.Model):
         ordering = ['feature_id']
         indexes = [
             models.Index(fields=['file_upload', 'feature_id']),
+            models.Index(fields=['file_upload', 'min_lon', 'max_lon']),
+            models.Index(fields=['file_upload', 'min_lat', 'max_lat']),
         ]
     
     def __str__(self):
@@ -271,6 +339,9 @@ class KMLFile(models.Model):
     is_processed = models.BooleanField(default=False)
     processing_status = models.CharField(max_length=50, default='pending')
     error_message = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # SHA-256 of file content
+    extraction_source = models.CharField(max_length=100, blank=True, default='')  # EXTRACTION_RULES key its rows were extracted with
+    updated_at = models.DateTimeField(auto_now=True)  # also touched whenever its parsed rows change
     
     class Meta:
         ordering = ['-uploaded_at']
@@ -282,7 +353,7 @@ class KMLFile(models.Model):
     def file_size_mb(self):
         return round(self.file_size / (1024 * 1024), 2)
 
-class KMLData(models.Model):
+class KMLData(BoundingBoxMixin, GeometryWKBMixin):
     """Enhanced model to store comprehensive parsed KML data"""
     kml_file = models.ForeignKey(KMLFile, on_delete=models.CASCADE, related_name='parsed_data')
     
@@ -330,20 +401,37 @@ class KMLData(models.Model):
     xal_address_details = models.TextField(blank=True, null=True)
     
     # Metadata
+    dedup_key = models.CharField(max_length=40, blank=True, default='')  # see make_dedup_key
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['created_at']
         indexes = [
+            models.Index(fields=['dedup_key', 'created_at', 'id']),
+            models.Index(fields=['kml_file', 'created_at', 'id']),
             models.Index(fields=['kml_file', 'geometry_type']),
             models.Index(fields=['kitta_number']),
             models.Index(fields=['owner_name']),
+            models.Index(fields=['kml_file', 'min_lon', 'max_lon']),
+            models.Index(fields=['kml_file', 'min_lat', 'max_lat']),
         ]
     
     def __str__(self):
         return f"{self.placemark_name or 'Unnamed'} - {self.geometry_type} ({self.kml_file.original_filename})"
     
+    def fill_dedup_key(self):
+        """Recompute dedup_key from the current field values"""
+        self.dedup_key = make_dedup_key(*(getattr(self, field) for field in DEDUP_FIELDS))
+        return self.dedup_key
+    
+    def save(self, *args, **kwargs):
+        self.fill_dedup_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(DEDUP_FIELDS):
+            kwargs['update_fields'] = {*update_fields, 'dedup_key'}
+        super().save(*args, **kwargs)
+    
     @property
     def has_extended_data(self):
         """Check if this placemark has any extended data"""
@@ -565,3 +653,102 @@ class SurveyHistoryLog(models.Model):
         if self.description:
             return self.description[:100] + "..." if len(self.description) > 100 else self.description
         return self.get_filter_summary()
+
+class ProcessingJob(models.Model):
+    """Database-backed background job for file processing and conversions"""
+    JOB_TYPES = [
+        ('process_file', 'Process Uploaded File'),
+        ('parse_kml', 'Parse KML File'),
+        ('convert_file', 'Convert File'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='processing_jobs', null=True, blank=True)
+    job_type = models.CharField(max_length=30, choices=JOB_TYPES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    kml_file = models.ForeignKey(KMLFile, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    conversion = models.ForeignKey(FileConversion, on_delete=models.CASCADE, related_name='jobs', null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    worker_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # heartbeat: refreshed periodically while the job runs
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_job_type_display()} - {self.status} ({self.id})"
+    
+    def to_dict(self):
+        """Serialize job state for status polling"""
+        return {
+            'job_id': str(self.id),
+            'job_type': self.job_type,
+            'status': self.status,
+            'attempts': self.attempts,
+            'result': self.result,
+            'error': self.error_message,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'duration_seconds': self.duration_seconds,
+        }
+
+class UploadSession(models.Model):
+    """A resumable upload being received in chunks; the bytes live in a partial file until finalize"""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('completed', 'Completed'),
+        ('aborted', 'Aborted'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=20)
+    total_size = models.BigIntegerField()
+    received_size = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    file_upload = models.ForeignKey(FileUpload, on_delete=models.SET_NULL, related_name='upload_sessions', null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received_size}/{self.total_size}) - {self.status}"
+    
+    def to_dict(self):
+        """Serialize upload progress so a client can resume from offset"""
+        return {
+            'upload_id': str(self.id),
+            'filename': self.filename,
+            'file_type': self.file_type,
+            'size': self.total_size,
+            'offset': self.received_size,
+            'status': self.status,
+            'file_id': str(self.file_upload_id) if self.file_upload_id else None,
+        }
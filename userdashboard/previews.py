@@ -0,0 +1,157 @@
+import re
+import csv
+import secrets
+import logging
+import xml.etree.ElementTree as ET
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LIMIT = 10  # records shown in an upload preview
+PREVIEW_TEXT_CHARS = 1000
+# Files up to this size are counted with one buffered scan; larger ones are estimated from samples
+SCAN_BYTES = 4 * 1024 * 1024
+SCAN_CHUNK_BYTES = 256 * 1024
+SAMPLE_WINDOWS = 16
+SAMPLE_WINDOW_BYTES = 64 * 1024
+
+PLACEMARK_RE = re.compile(rb'<(?:[\w.-]+:)?Placemark\b')
+NEWLINE_RE = re.compile(rb'\n')
+
+class PreviewStore:
+    """Upload previews kept server-side under an opaque token; the session only carries the token"""
+
+    SESSION_KEY = 'preview_token'
+
+    @staticmethod
+    def cache():
+        try:
+            return caches['previews']
+        except InvalidCacheBackendError:
+            return caches['default']
+
+    @staticmethod
+    def key(token):
+        return f'preview:{token}'
+
+    @classmethod
+    def put(cls, request, preview_data):
+        """Store a preview for this session, replacing any earlier one; returns the token"""
+        cls.clear(request)
+        token = secrets.token_urlsafe(24)
+        cls.cache().set(cls.key(token), preview_data, getattr(settings, 'PREVIEW_TTL', 3600))
+        request.session[cls.SESSION_KEY] = token
+        return token
+
+    @classmethod
+    def get(cls, request):
+        """The session's current preview, or None once it has expired or been cleared"""
+        token = request.session.get(cls.SESSION_KEY)
+        if not token:
+            return None
+        preview_data = cls.cache().get(cls.key(token))
+        if preview_data is None:
+            logger.info(f"Preview {token[:8]}... expired")
+            del request.session[cls.SESSION_KEY]
+        return preview_data
+
+    @classmethod
+    def clear(cls, request):
+        """Drop the session's preview and its token"""
+        token = request.session.pop(cls.SESSION_KEY, None)
+        if token:
+            cls.cache().delete(cls.key(token))
+        # Previews stored in the session itself before the store existed
+        request.session.pop('preview_data', None)
+
+def head_text(file, chars=PREVIEW_TEXT_CHARS):
+    """The first characters of an upload, with '...' appended when there is more"""
+    file.seek(0)
+    raw = file.read(chars * 4 + 1)
+    text = raw.decode('utf-8', errors='ignore')
+    if len(text) > chars or file.size > len(raw):
+        return text[:chars] + '...'
+    return text
+
+def count_records(file, pattern, start=0):
+    """Occurrences of pattern from byte offset start to the end of the file; returns (count, exact)
+
+    Small files are scanned once in buffered chunks. Larger ones are sampled with SAMPLE_WINDOWS reads
+    spread evenly over the file and the match density is extrapolated, so the cost does not grow with size.
+    """
+    remaining = file.size - start
+    if remaining <= 0:
+        return 0, True
+    
+    if remaining <= SCAN_BYTES:
+        file.seek(start)
+        count = 0
+        carry = b''
+        while True:
+            chunk = file.read(SCAN_CHUNK_BYTES)
+            if not chunk:
+                break
+            buffer = carry + chunk
+            # Matches lying wholly inside the carried tail were counted with the previous chunk
+            count += len(pattern.findall(buffer)) - len(pattern.findall(carry))
+            carry = buffer[-64:]
+        return count, True
+    
+    step = (remaining - SAMPLE_WINDOW_BYTES) / (SAMPLE_WINDOWS - 1)
+    matches = 0
+    sampled = 0
+    for i in range(SAMPLE_WINDOWS):
+        file.seek(start + int(i * step))
+        window = file.read(SAMPLE_WINDOW_BYTES)
+        matches += len(pattern.findall(window))
+        sampled += len(window)
+    return round(matches / sampled * remaining) if sampled else 0, False
+
+def kml_head(file, limit=PREVIEW_LIMIT):
+    """Stream a KML upload up to its first `limit` Placemarks; returns (placemarks, total, estimated)"""
+    file.seek(0)
+    placemarks = []
+    for _, elem in ET.iterparse(file, events=('end',)):
+        if elem.tag.rsplit('}', 1)[-1] == 'Placemark':
+            placemarks.append(elem)
+            if len(placemarks) >= limit:
+                break
+    else:
+        # The whole document fit in the preview, so the count is exact
+        return placemarks, len(placemarks), False
+    
+    total, exact = count_records(file, PLACEMARK_RE)
+    return placemarks, max(total, len(placemarks)), not exact
+
+def csv_head(file, limit=PREVIEW_LIMIT):
+    """Read the header and first `limit` rows of a CSV upload; returns (headers, rows, total, estimated)"""
+    consumed = 0
+    
+    def lines():
+        nonlocal consumed
+        # readline rather than iterating the file: in-memory uploads would be read whole into chunks()
+        for line in iter(file.readline, b''):
+            consumed += len(line)
+            yield line.decode('utf-8')
+    
+    file.seek(0)
+    reader = csv.reader(lines())
+    headers = next(reader, [])
+    data_start = consumed
+    rows = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) >= limit:
+            break
+    else:
+        return headers, rows, len(rows), False
+    
+    total, exact = count_records(file, NEWLINE_RE, data_start)
+    if exact:
+        # A last row without a trailing newline still counts
+        file.seek(file.size - 1)
+        if file.read(1) != b'\n':
+            total += 1
+    return headers, rows, max(total, len(rows)), not exact
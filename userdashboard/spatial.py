@@ -0,0 +1,347 @@
+import json
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import numpy as np
+import shapely
+from django.conf import settings
+from django.db.models import Count, Max
+from pyproj import CRS, Transformer
+from shapely import STRtree, box
+from shapely.geometry import Point, LineString, Polygon, MultiPolygon, shape
+
+logger = logging.getLogger(__name__)
+
+def _iter_positions(coords):
+    """Yield every (lon, lat) position in a nested coordinate list"""
+    if not coords:
+        return
+    if isinstance(coords[0], (int, float)):
+        yield coords[0], coords[1]
+        return
+    for part in coords:
+        yield from _iter_positions(part)
+
+def bbox_from_coordinates(coords):
+    """Return (min_lon, min_lat, max_lon, max_lat) for stored coordinates, or None"""
+    if isinstance(coords, str):
+        try:
+            coords = json.loads(coords)
+        except ValueError:
+            return None
+    try:
+        if isinstance(coords, np.ndarray):
+            positions = coords.reshape(-1, coords.shape[-1])[:, :2]
+        else:
+            positions = np.array(list(_iter_positions(coords)), dtype=float)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if not len(positions):
+        return None
+    positions = positions[np.isfinite(positions).all(axis=1)]
+    if not len(positions):
+        return None
+    min_lon, min_lat = positions.min(axis=0).tolist()
+    max_lon, max_lat = positions.max(axis=0).tolist()
+    return min_lon, min_lat, max_lon, max_lat
+
+def geometry_from_coordinates(geometry_type, coords):
+    """Build a shapely geometry from the coordinate layout used by the *Data models"""
+    if isinstance(coords, str):
+        coords = json.loads(coords)
+    if coords is None or len(coords) == 0:
+        return None
+    if geometry_type == 'Point':
+        return Point(coords[0], coords[1])
+    elif geometry_type == 'LineString':
+        return LineString([c[:2] for c in coords])
+    elif geometry_type == 'Polygon':
+        return Polygon([c[:2] for c in coords])
+    elif geometry_type == 'MultiPolygon':
+        return MultiPolygon([Polygon([c[:2] for c in ring]) for ring in coords])
+    return None
+
+def wkb_from_coordinates(geometry_type, coords):
+    """Encode stored coordinates as 2D WKB bytes, or None when they do not form a geometry"""
+    try:
+        geometry = geometry_from_coordinates(geometry_type, coords)
+    except (ValueError, TypeError, IndexError, shapely.errors.GEOSException):
+        return None
+    if geometry is None or geometry.is_empty:
+        return None
+    return shapely.to_wkb(geometry)
+
+def _field(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+def decode_geometries(rows):
+    """Decode the geometries of a batch of rows (model instances or value dicts) into an object array
+
+    WKB is decoded with one bulk shapely.from_wkb call; the JSON coordinates are only read for rows
+    that have no geometry_wkb yet. Rows whose geometry cannot be decoded map to None.
+    """
+    blobs = [_field(row, 'geometry_wkb') for row in rows]
+    geometries = np.empty(len(blobs), dtype=object)
+    present = np.array([blob is not None for blob in blobs], dtype=bool)
+    if present.any():
+        geometries[present] = shapely.from_wkb(
+            np.array([bytes(blob) for blob in blobs if blob is not None], dtype=object),
+            on_invalid='ignore',
+        )
+    for index in np.flatnonzero(~present).tolist():
+        try:
+            geometries[index] = geometry_from_coordinates(
+                _field(rows[index], 'geometry_type'), _field(rows[index], 'coordinates')
+            )
+        except (ValueError, TypeError, IndexError, shapely.errors.GEOSException):
+            geometries[index] = None
+    return geometries
+
+def load_missing_coordinates(rows):
+    """Fetch the deferred JSON coordinates of rows without WKB in one query, instead of one lazy load per row"""
+    missing = [
+        row for row in rows
+        if not isinstance(row, dict) and 'coordinates' in row.get_deferred_fields() and row.geometry_wkb is None
+    ]
+    if missing:
+        coordinates = dict(
+            type(missing[0])._base_manager.filter(pk__in=[row.pk for row in missing]).values_list('pk', 'coordinates')
+        )
+        for row in missing:
+            row.coordinates = coordinates.get(row.pk)
+    return rows
+
+def iter_geometries(queryset, chunk_size=2000):
+    """Yield (row, geometry) pairs, decoding each chunk of rows in bulk without loading the JSON coordinates"""
+    rows = queryset.defer('coordinates').iterator(chunk_size=chunk_size) if hasattr(queryset, 'defer') else queryset
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from zip(chunk, decode_geometries(load_missing_coordinates(chunk)))
+            chunk = []
+    if chunk:
+        yield from zip(chunk, decode_geometries(load_missing_coordinates(chunk)))
+
+def geometry_to_kml(geometry):
+    """KML geometry markup for a decoded geometry"""
+    def coordinates(coords):
+        return ' '.join(f"{x},{y}" for x, y in shapely.get_coordinates(coords).tolist())
+
+    if geometry.geom_type == 'Point':
+        return f'<Point><coordinates>{coordinates(geometry)}</coordinates></Point>'
+    elif geometry.geom_type == 'LineString':
+        return f'<LineString><coordinates>{coordinates(geometry)}</coordinates></LineString>'
+    elif geometry.geom_type == 'Polygon':
+        rings = [f'<outerBoundaryIs><LinearRing><coordinates>{coordinates(geometry.exterior)}</coordinates></LinearRing></outerBoundaryIs>']
+        rings += [
+            f'<innerBoundaryIs><LinearRing><coordinates>{coordinates(ring)}</coordinates></LinearRing></innerBoundaryIs>'
+            for ring in geometry.interiors
+        ]
+        return f"<Polygon>{''.join(rings)}</Polygon>"
+    return f"<MultiGeometry>{''.join(geometry_to_kml(part) for part in geometry.geoms)}</MultiGeometry>"
+
+# Polygons are grouped into cells of this many degrees, each projected about its own centre
+AREA_CELL_DEGREES = 6
+
+@lru_cache(maxsize=64)
+def equal_area_transformer(lon_0, lat_0):
+    """Cached lon/lat -> Lambert azimuthal equal-area (WGS84 ellipsoid, metres) transformer centred on a cell"""
+    return Transformer.from_crs(
+        'EPSG:4326', f'+proj=laea +lat_0={lat_0} +lon_0={lon_0} +datum=WGS84 +units=m', always_xy=True
+    )
+
+@lru_cache(maxsize=16)
+def lonlat_transformer(crs):
+    """Cached transformer from a layer's CRS to EPSG:4326 lon/lat, or None when it already is lon/lat"""
+    source = CRS.from_user_input(crs)
+    if source.equals(CRS.from_epsg(4326), ignore_axis_order=True):
+        return None
+    return Transformer.from_crs(source, 'EPSG:4326', always_xy=True)
+
+def to_lonlat(geometries, crs):
+    """Reproject an array of geometries to EPSG:4326 lon/lat in one vectorized transform; unchanged without a CRS"""
+    transformer = lonlat_transformer(crs) if crs else None
+    if transformer is None:
+        return geometries
+    return shapely.transform(
+        geometries,
+        lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])),
+    )
+
+def geodesic_areas(geometries):
+    """Ellipsoidal areas in square metres for an array of lon/lat geometries; NaN for non-polygonal or missing ones
+
+    Every polygon of a cell is reprojected in one vectorized transform to an equal-area projection, so the
+    planar area there is the true area on the ellipsoid whatever the latitude.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    areas = np.full(len(geometries), np.nan)
+    polygonal = np.isin(shapely.get_type_id(geometries), (3, 6)) & ~shapely.is_empty(geometries)
+    indices = np.flatnonzero(polygonal)
+    if not len(indices):
+        return areas
+    
+    bounds = shapely.bounds(geometries[indices])
+    centres = np.column_stack(((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2))
+    cells = np.floor(centres / AREA_CELL_DEGREES).astype(int)
+    for cell in np.unique(cells, axis=0):
+        in_cell = (cells == cell).all(axis=1)
+        lon_0, lat_0 = ((cell + 0.5) * AREA_CELL_DEGREES).tolist()
+        transformer = equal_area_transformer(lon_0, max(-90.0, min(90.0, lat_0)))
+        projected = shapely.transform(
+            geometries[indices[in_cell]],
+            lambda xy: np.column_stack(transformer.transform(xy[:, 0], xy[:, 1])),
+        )
+        areas[indices[in_cell]] = shapely.area(projected)
+    return areas
+
+def parse_bbox(value):
+    """Parse a 'west,south,east,north' string into four floats"""
+    try:
+        west, south, east, north = [float(v) for v in value.split(',')]
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be 'west,south,east,north'")
+    if west > east or south > north:
+        raise ValueError("bbox must be 'west,south,east,north' with west <= east and south <= north")
+    return west, south, east, north
+
+def filter_viewport(queryset, west, south, east, north):
+    """Restrict a queryset to rows whose bounding box overlaps the viewport (uses the bbox indexes)"""
+    return queryset.filter(
+        min_lon__lte=east,
+        max_lon__gte=west,
+        min_lat__lte=north,
+        max_lat__gte=south,
+    )
+
+def parse_geometry(value):
+    """Parse a GeoJSON geometry (dict or JSON string) into a shapely geometry"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return shape(value)
+
+def owner_queryset(source, file_id=None, user=None):
+    """The KMLFile or FileUpload rows that own a source's parsed rows: one file, or all of a user's"""
+    from .models import KMLFile, FileUpload
+
+    if source == 'kml':
+        queryset = KMLFile.objects.all()
+    elif source in ('csv', 'shapefile'):
+        queryset = FileUpload.objects.filter(file_type=source)
+    else:
+        raise ValueError(f"Unsupported source: {source}")
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if file_id:
+        queryset = queryset.filter(pk=file_id)
+    return queryset
+
+def data_version(source, file_id=None, user=None):
+    """Version tag for a file's (or a user's) parsed rows, read from the owning file rows
+
+    Whatever adds, rewrites or deletes parsed rows also bumps the owner's updated_at (touch_owners), so
+    this aggregates over a handful of file rows instead of the parsed rows themselves.
+    """
+    stats = owner_queryset(source, file_id, user).aggregate(count=Count('pk'), last=Max('updated_at'))
+    last = stats['last'].timestamp() if stats['last'] else 0
+    return f"{stats['count']}-{last:.6f}"
+
+def touch_owners(source, ids):
+    """Bump the updated_at of the files whose parsed rows were changed in place"""
+    from django.utils import timezone
+
+    return owner_queryset(source).filter(pk__in=list(ids)).update(updated_at=timezone.now())
+
+def source_queryset(user, source, file_id=None):
+    """Return the user's parsed rows for a source ('kml', 'csv' or 'shapefile'), optionally for one file"""
+    from .models import KMLData, CSVData, ShapefileData
+
+    if source == 'kml':
+        queryset = KMLData.objects.filter(kml_file__user=user)
+        if file_id:
+            queryset = queryset.filter(kml_file_id=file_id)
+    elif source == 'csv':
+        queryset = CSVData.objects.filter(file_upload__user=user)
+        if file_id:
+            queryset = queryset.filter(file_upload_id=file_id)
+    elif source == 'shapefile':
+        queryset = ShapefileData.objects.filter(file_upload__user=user)
+        if file_id:
+            queryset = queryset.filter(file_upload_id=file_id)
+    else:
+        raise ValueError(f"Unsupported source: {source}")
+    return queryset
+
+def feature_properties(source, item):
+    """Build the GeoJSON properties for a parsed row of the given source"""
+    if source == 'kml':
+        return {
+            'id': item.pk,
+            'placemark_name': item.placemark_name,
+            'kitta_number': item.kitta_number,
+            'owner_name': item.owner_name,
+            'geometry_type': item.geometry_type,
+        }
+    elif source == 'csv':
+        return {'id': item.pk, 'row_number': item.row_number, **item.data}
+    return {'id': item.pk, 'feature_id': item.feature_id, **item.attributes}
+
+class SpatialIndex:
+    """In-process STRtree over a set of parcel rows, cached per file or user"""
+
+    _cache = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, ids, geometries):
+        self.ids = np.asarray(ids)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def for_queryset(cls, key, queryset, version):
+        """Return the cached index for key, rebuilding it when the data version has changed"""
+
+        with cls._lock:
+            cached = cls._cache.get(key)
+            if cached and cached[0] == version:
+                cls._cache.move_to_end(key)
+                return cached[1]
+
+        index = cls.build(queryset)
+        with cls._lock:
+            cls._cache[key] = (version, index)
+            cls._cache.move_to_end(key)
+            while len(cls._cache) > getattr(settings, 'SPATIAL_INDEX_CACHE_SIZE', 32):
+                cls._cache.popitem(last=False)
+        return index
+
+    @classmethod
+    def build(cls, queryset):
+        """Decode every row's geometry once (bulk WKB) and bulk-load an STRtree"""
+        ids = []
+        geometries = []
+        for row, geometry in iter_geometries(queryset.only('pk', 'geometry_type', 'geometry_wkb')):
+            if geometry is not None and not geometry.is_empty:
+                ids.append(row.pk)
+                geometries.append(geometry)
+        logger.info(f"Built STRtree over {len(ids)} geometries")
+        return cls(ids, geometries)
+    
+    @classmethod
+    def invalidate(cls, key):
+        """Drop a cached index"""
+        with cls._lock:
+            cls._cache.pop(key, None)
+
+    def query(self, geometry, predicate='intersects'):
+        """Return the row ids whose geometry satisfies predicate against geometry"""
+        if not len(self.ids):
+            return []
+        positions = self.tree.query(geometry, predicate=predicate)
+        return self.ids[np.sort(positions)].tolist()
+
+    def query_bbox(self, west, south, east, north):
+        """Return the row ids intersecting a lon/lat viewport"""
+        return self.query(box(west, south, east, north))
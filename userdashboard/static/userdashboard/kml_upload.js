@@ -62,8 +62,8 @@ document.addEventListener('DOMContentLoaded', function() {
     
     function validateAndDisplayFile(file) {
         // Validate file type
-        if (!file.name.toLowerCase().endsWith('.kml')) {
-            showToast('Please select a valid KML file.', 'error');
+        if (!/\.km[lz]$/.test(file.name.toLowerCase())) {
+            showToast('Please select a valid KML or KMZ file.', 'error');
             return;
         }
         
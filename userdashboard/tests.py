@@ -1,3 +1,1250 @@
-from django.test import TestCase
+import csv
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+from .extraction import ExtractionRules, clean_text, reprocess_rows
+from .file_utils import ChunkedUpload, ContentStore, FileConverter, FileProcessor, get_kml_file_for_upload, on_stream_complete
+from .jobs import JobHeartbeat, JobWorker, requeue_stale_jobs
+from .kml_utils import KML_NS, KMLParseSession, KMLParser, PlacemarkVisitor, ParallelKMLIngest, ingest_kml_file, is_kmz, kmz_document, parse_coordinates, reuse_parsed_kml
+from . import previews
+from .previews import PreviewStore, count_records, csv_head, kml_head
+from .models import CSVData, FileUpload, KMLData, KMLFile, ProcessingJob, UploadSession
+from .spatial import SpatialIndex, geodesic_areas, touch_owners
+from .tiles import render_tile, tile_bounds
+from .views import keyset_page, unique_survey_records
+
+User = get_user_model()
+
+def make_kml(count, prefix='Parcel'):
+    """A KML document with `count` small square polygons"""
+    placemarks = []
+    for i in range(count):
+        lon, lat = 85.3 + i * 0.001, 27.7
+        ring = ' '.join(f'{x},{y},0' for x, y in [
+            (lon, lat), (lon + 0.0005, lat), (lon + 0.0005, lat + 0.0005), (lon, lat + 0.0005), (lon, lat)
+        ])
+        placemarks.append(
+            f'<Placemark><name>{prefix} {i}</name><description>Kitta: K-{i}</description>'
+            f'<Polygon><outerBoundaryIs><LinearRing><coordinates>{ring}</coordinates>'
+            f'</LinearRing></outerBoundaryIs></Polygon></Placemark>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+        f"{''.join(placemarks)}"
+        '</Document></kml>'
+    ).encode('utf-8')
+
+class IsolatedStorageMixin:
+    """Points MEDIA_ROOT and the on-disk caches at a throwaway directory for each test"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        caches = {**settings.CACHES, 'previews': {**settings.CACHES['previews'], 'LOCATION': f'{self.media_root}/previews'}}
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root, GEOJSON_CACHE_DIR=f'{self.media_root}/geojson', CACHES=caches,
+        )
+        self.media_override.enable()
+
+    def tearDown(self):
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().tearDown()
+
+@override_settings(ANALYTICS_FLUSH_INTERVAL=0)
+class MediaRootTestCase(IsolatedStorageMixin, TestCase):
+    """Runs each test with MEDIA_ROOT in a throwaway directory (tracking events are written synchronously)"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='surveyor', email='surveyor@example.com', password='secret')
+
+    def upload_kml(self, name, content):
+        return self.upload(name, content, 'kml')
+
+    def upload(self, name, content, file_type):
+        upload = FileUpload.objects.create(
+            user=self.user,
+            file=SimpleUploadedFile(name, content),
+            original_filename=name,
+            file_type=file_type,
+            file_size=len(content),
+        )
+        FileProcessor(upload).process_file()
+        upload.refresh_from_db()
+        return upload
+
+class SameNameKMLUploadTests(MediaRootTestCase):
+    """Two KML uploads with the same filename keep separate parsed rows"""
+
+    def test_each_upload_gets_its_own_kml_file(self):
+        first = self.upload_kml('parcels.kml', make_kml(3, 'First'))
+        second = self.upload_kml('parcels.kml', make_kml(5, 'Second'))
+
+        self.assertIsNotNone(first.kml_file)
+        self.assertIsNotNone(second.kml_file)
+        self.assertNotEqual(first.kml_file_id, second.kml_file_id)
+        self.assertEqual(KMLData.objects.filter(kml_file=first.kml_file).count(), 3)
+        self.assertEqual(KMLData.objects.filter(kml_file=second.kml_file).count(), 5)
+        self.assertEqual(get_kml_file_for_upload(second), second.kml_file)
+        self.assertEqual(first.feature_count, 3)
+        self.assertEqual(second.feature_count, 5)
+
+    def test_deleting_one_upload_keeps_the_other(self):
+        first = self.upload_kml('parcels.kml', make_kml(3, 'First'))
+        second = self.upload_kml('parcels.kml', make_kml(5, 'Second'))
+        self.client.force_login(self.user)
+
+        self.client.post(reverse('file_delete', args=[first.id]))
+
+        self.assertFalse(FileUpload.objects.filter(id=first.id).exists())
+        self.assertFalse(KMLFile.objects.filter(id=first.kml_file_id).exists())
+        self.assertEqual(KMLData.objects.filter(kml_file=second.kml_file).count(), 5)
+        self.assertEqual(KMLData.objects.count(), 5)
+
+class ContentStoreTests(MediaRootTestCase):
+    """Identical uploads share one blob, which is only deleted with its last reference"""
+
+    def store_kml(self, content, name='parcels.kml'):
+        with ContentStore.storing(SimpleUploadedFile(name, content)) as (stored_name, content_hash, file_size):
+            return KMLFile.objects.create(
+                user=self.user, file=stored_name, original_filename=name,
+                file_size=file_size, content_hash=content_hash,
+            )
+
+    def blob_files(self):
+        blob_dir = os.path.join(self.media_root, ContentStore.BLOB_DIR)
+        return sorted(
+            name for _, _, files in os.walk(blob_dir) for name in files
+        )
+
+    def test_identical_uploads_share_a_blob_until_the_last_delete(self):
+        self.client.force_login(self.user)
+        content = make_kml(3)
+        for _ in range(2):
+            self.client.post(reverse('kml_upload'), {'kml_file': SimpleUploadedFile('parcels.kml', content)})
+        first, second = KMLFile.objects.order_by('uploaded_at')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(len(self.blob_files()), 1)
+
+        self.client.post(reverse('kml_delete', args=[first.id]))
+        self.assertTrue(os.path.exists(second.file.path))
+
+        self.client.post(reverse('kml_delete', args=[second.id]))
+        self.assertEqual(self.blob_files(), [])
+
+    def test_release_restores_a_blob_recorded_meanwhile(self):
+        kml_file = self.store_kml(make_kml(2))
+        path = kml_file.file.path
+        kml_file.delete()
+
+        # An identical upload is recorded between the first reference check and the unlink
+        with mock.patch.object(ContentStore, 'is_referenced', side_effect=[False, True]):
+            self.assertFalse(ContentStore.release(kml_file.file.name))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.blob_files(), [os.path.basename(path)])
+
+    def test_failed_record_leaves_no_blob(self):
+        with self.assertRaises(ValueError):
+            with ContentStore.storing(SimpleUploadedFile('parcels.kml', make_kml(2))):
+                raise ValueError('record rejected')
+        self.assertEqual(self.blob_files(), [])
+
+    def test_reuse_requires_matching_extraction_rules(self):
+        content = make_kml(4)
+        original = self.store_kml(content)
+        ingest_kml_file(original)
+        # Re-extract the original's rows with another municipality's rules
+        original.parsed_data.update(kitta_number='')
+        rules = ExtractionRules({'kitta': [r'kitta\s*:\s*k-(\d+)']}, 'ward-9')
+        reprocess_rows(original.parsed_data.all(), rules)
+        original.refresh_from_db()
+        self.assertEqual(original.extraction_source, 'ward-9')
+        self.assertEqual(original.parsed_data.first().kitta_number, '0')
+
+        duplicate = self.store_kml(content)
+        self.assertFalse(reuse_parsed_kml(duplicate))
+        self.assertFalse(duplicate.parsed_data.exists())
+
+        KMLFile.objects.filter(pk=original.pk).update(extraction_source='')
+        self.assertTrue(reuse_parsed_kml(duplicate))
+        self.assertEqual(duplicate.parsed_data.count(), 4)
+
+class SpatialQueryTests(MediaRootTestCase):
+    """Viewport queries use the bbox columns; geometry predicates use the cached STRtree"""
+
+    def setUp(self):
+        super().setUp()
+        SpatialIndex._cache.clear()
+        self.upload = self.upload_kml('parcels.kml', make_kml(5))
+        self.client.force_login(self.user)
+
+    def query(self, **params):
+        return self.client.get(reverse('spatial_query_api'), {'source': 'kml', **params})
+
+    def names(self, response):
+        return sorted(feature['properties']['placemark_name'] for feature in response.json()['features'])
+
+    def test_bbox_viewport(self):
+        # Squares start every 0.001 degrees east of 85.3 and are 0.0005 degrees wide
+        response = self.query(bbox='85.2999,27.6999,85.3012,27.7006')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.names(response), ['Parcel 0', 'Parcel 1'])
+
+    def test_geometry_predicates(self):
+        point = json.dumps({'type': 'Point', 'coordinates': [85.30325, 27.70025]})
+        self.assertEqual(self.names(self.query(geometry=point)), ['Parcel 3'])
+
+        area = json.dumps({'type': 'Polygon', 'coordinates': [[
+            [85.2995, 27.6995], [85.3027, 27.6995], [85.3027, 27.701], [85.2995, 27.701], [85.2995, 27.6995],
+        ]]})
+        response = self.query(geometry=area, predicate='contains', file_id=self.upload.kml_file_id)
+        self.assertEqual(self.names(response), ['Parcel 0', 'Parcel 1', 'Parcel 2'])
+
+    def test_index_follows_data_changes(self):
+        point = json.dumps({'type': 'Point', 'coordinates': [85.30325, 27.70025]})
+        self.assertEqual(self.names(self.query(geometry=point)), ['Parcel 3'])
+
+        kml_file = self.upload.kml_file
+        kml_file.parsed_data.filter(placemark_name='Parcel 3').delete()
+        touch_owners('kml', [kml_file.id])
+        self.assertEqual(self.names(self.query(geometry=point)), [])
+
+    def test_other_users_rows_are_invisible(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.client.force_login(other)
+        self.assertEqual(self.names(self.query(bbox='85,27,86,28')), [])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.query(bbox='85.3,27.7').status_code, 400)
+        self.assertEqual(self.query(bbox='86,27,85,28').status_code, 400)
+        self.assertEqual(self.query(bbox='85,27,86,28', predicate='near').status_code, 400)
+        self.assertEqual(self.query().status_code, 400)
+
+def lonlat_to_tile(lon, lat, z):
+    """XYZ tile containing a lon/lat position"""
+    import math
+
+    n = 2 ** z
+    return int((lon + 180) / 360 * n), int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+
+class VectorTileTests(MediaRootTestCase):
+    """Tiles hold the clipped, simplified rows overlapping them and are cached per data version"""
+
+    def setUp(self):
+        super().setUp()
+        self.upload = self.upload_kml('parcels.kml', make_kml(5))
+        self.kml_file = self.upload.kml_file
+        self.client.force_login(self.user)
+
+    def tile(self, z, x, y, fmt='geojson'):
+        return self.client.get(reverse('file_tile', args=['kml', self.kml_file.id, z, x, y, fmt]))
+
+    def names(self, response):
+        return sorted(feature['properties']['placemark_name'] for feature in response.json()['features'])
+
+    def test_tile_bounds(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+        self.assertEqual((west, east), (-180.0, 180.0))
+        self.assertAlmostEqual(north, 85.0511287798)
+        self.assertAlmostEqual(south, -85.0511287798)
+
+    def test_tile_holds_the_rows_overlapping_it(self):
+        x, y = lonlat_to_tile(85.3, 27.7, 16)
+        response = self.tile(16, x, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        # The tile's east edge is at 85.3033, so the square starting at 85.304 stays out
+        self.assertEqual(self.names(response), ['Parcel 0', 'Parcel 1', 'Parcel 2', 'Parcel 3'])
+        self.assertEqual(self.names(self.tile(16, x + 2, y)), [])
+
+    def test_geometries_are_clipped_to_the_buffered_tile(self):
+        import shapely
+        from shapely.geometry import shape
+
+        x, y = lonlat_to_tile(85.30025, 27.70025, 20)
+        west, south, east, north = tile_bounds(20, x, y)
+        buffer = (east - west) * 8 / 256
+        features = self.tile(20, x, y).json()['features']
+        self.assertEqual([f['properties']['placemark_name'] for f in features], ['Parcel 0'])
+        min_x, min_y, max_x, max_y = shapely.bounds(shape(features[0]['geometry'])).tolist()
+        self.assertGreaterEqual(min_x, west - buffer - 1e-9)
+        self.assertLessEqual(max_x, east + buffer + 1e-9)
+        self.assertGreaterEqual(min_y, south - buffer - 1e-9)
+        self.assertLessEqual(max_y, north + buffer + 1e-9)
+
+    def test_tiles_are_cached_until_the_data_changes(self):
+        x, y = lonlat_to_tile(85.3, 27.7, 16)
+        with mock.patch('userdashboard.tiles.render_tile', wraps=render_tile) as render:
+            self.tile(16, x, y)
+            self.tile(16, x, y)
+            self.assertEqual(render.call_count, 1)
+
+            self.kml_file.parsed_data.filter(placemark_name='Parcel 1').delete()
+            touch_owners('kml', [self.kml_file.id])
+            self.assertEqual(self.names(self.tile(16, x, y)), ['Parcel 0', 'Parcel 2', 'Parcel 3'])
+            self.assertEqual(render.call_count, 2)
+
+    def test_invalid_tiles(self):
+        self.assertEqual(self.tile(3, 8, 0).status_code, 400)
+        self.assertEqual(self.tile(23, 0, 0).status_code, 400)
+        self.assertEqual(self.tile(1, 0, 0, 'png').status_code, 400)
+
+class InterruptedStream:
+    """A request body that drops the connection after `limit` bytes"""
+
+    def __init__(self, content, limit):
+        self.stream = BytesIO(content[:limit])
+
+    def read(self, size=-1):
+        block = self.stream.read(size)
+        if not block:
+            raise OSError('connection reset')
+        return block
+
+class ChunkedUploadTests(MediaRootTestCase):
+    """Resumable uploads: offsets are enforced, partial chunks are kept and finalize stores the content once"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.content = make_kml(20)
+
+    def start(self, filename='ward.kml', size=None):
+        return self.client.post(reverse('chunked_upload_start_api'), {
+            'filename': filename, 'size': len(self.content) if size is None else size,
+        })
+
+    def put(self, upload_id, offset, chunk):
+        url = f"{reverse('chunked_upload_api', args=[upload_id])}?offset={offset}"
+        return self.client.put(url, chunk, content_type='application/octet-stream')
+
+    def finalize(self, upload_id):
+        return self.client.post(reverse('chunked_upload_finalize_api', args=[upload_id]))
+
+    def test_upload_in_chunks_and_finalize(self):
+        upload_id = self.start().json()['upload_id']
+        for offset in range(0, len(self.content), 400):
+            response = self.put(upload_id, offset, self.content[offset:offset + 400])
+            self.assertEqual(response.json()['offset'], min(offset + 400, len(self.content)))
+
+        response = self.finalize(upload_id)
+
+        self.assertEqual(response.status_code, 202)
+        file_upload = FileUpload.objects.get(id=response.json()['file_id'])
+        self.assertEqual(file_upload.content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(file_upload.file_size, len(self.content))
+        with open(file_upload.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual((session.status, session.file_upload_id), ('completed', file_upload.id))
+        self.assertFalse(os.path.exists(ChunkedUpload.part_path(session)))
+        self.assertTrue(ProcessingJob.objects.filter(file_upload=file_upload, job_type='process_file').exists())
+        self.assertEqual(self.finalize(upload_id).status_code, 409)
+
+    def test_wrong_offset_is_rejected_with_the_resume_offset(self):
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, self.content[:100])
+
+        for offset in (0, 150):
+            response = self.put(upload_id, offset, self.content[offset:offset + 100])
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()['offset'], 100)
+        self.assertEqual(self.client.get(reverse('chunked_upload_api', args=[upload_id])).json()['offset'], 100)
+
+    def test_chunk_past_the_declared_size_is_rejected(self):
+        upload_id = self.start(size=100).json()['upload_id']
+
+        response = self.put(upload_id, 0, self.content[:150])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertLessEqual(response.json()['offset'], 100)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(os.path.getsize(ChunkedUpload.part_path(session)), session.received_size)
+
+    def test_interrupted_chunk_resumes_from_the_bytes_kept(self):
+        session = ChunkedUpload.start(self.user, 'ward.kml', len(self.content))
+        with mock.patch.object(ChunkedUpload, 'COPY_SIZE', 64):
+            with self.assertRaises(OSError):
+                ChunkedUpload.append(session, 0, InterruptedStream(self.content, 300))
+        self.assertEqual(session.received_size, 300)
+
+        ChunkedUpload.append(session, 300, BytesIO(self.content[300:]))
+
+        with ChunkedUpload.finish(session) as (stored_name, content_hash, size):
+            self.assertEqual(content_hash, hashlib.sha256(self.content).hexdigest())
+            self.assertEqual(size, len(self.content))
+
+    def test_hash_is_recomputed_when_another_process_received_chunks(self):
+        session = ChunkedUpload.start(self.user, 'ward.kml', len(self.content))
+        ChunkedUpload.append(session, 0, BytesIO(self.content[:500]))
+        ChunkedUpload._hashers.pop(session.id)
+        ChunkedUpload.append(session, 500, BytesIO(self.content[500:]))
+
+        with ChunkedUpload.finish(session) as (stored_name, content_hash, size):
+            self.assertEqual(content_hash, hashlib.sha256(self.content).hexdigest())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, stored_name)))
+
+    def test_start_and_finalize_validation(self):
+        self.assertEqual(self.start(filename='ward.exe').status_code, 400)
+        self.assertEqual(self.start(size=0).status_code, 400)
+
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, self.content[:100])
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('incomplete', response.json()['errors'][0])
+        self.assertEqual(UploadSession.objects.get(id=upload_id).status, 'uploading')
+
+    def test_abort_discards_the_partial_file(self):
+        upload_id = self.start().json()['upload_id']
+        self.put(upload_id, 0, self.content[:100])
+        session = UploadSession.objects.get(id=upload_id)
+
+        self.client.delete(reverse('chunked_upload_api', args=[upload_id]))
+
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'aborted')
+        self.assertFalse(os.path.exists(ChunkedUpload.part_path(session)))
+
+class PreviewStoreTests(MediaRootTestCase):
+    """Upload previews live in the previews cache; the session only carries their token"""
+
+    def request(self):
+        from types import SimpleNamespace
+        from django.contrib.sessions.backends.db import SessionStore
+
+        return SimpleNamespace(session=SessionStore())
+
+    def test_put_get_replace_and_clear(self):
+        request = self.request()
+        first = PreviewStore.put(request, {'file_name': 'a.kml'})
+        self.assertEqual(dict(request.session), {PreviewStore.SESSION_KEY: first})
+        self.assertEqual(PreviewStore.get(request), {'file_name': 'a.kml'})
+
+        second = PreviewStore.put(request, {'file_name': 'b.kml'})
+        self.assertNotEqual(first, second)
+        self.assertIsNone(PreviewStore.cache().get(PreviewStore.key(first)))
+        self.assertEqual(PreviewStore.get(request), {'file_name': 'b.kml'})
+
+        request.session['preview_data'] = {'file_name': 'legacy.kml'}
+        PreviewStore.clear(request)
+        self.assertEqual(dict(request.session), {})
+        self.assertIsNone(PreviewStore.cache().get(PreviewStore.key(second)))
+        self.assertIsNone(PreviewStore.get(request))
+
+    def test_expired_preview_drops_its_token(self):
+        request = self.request()
+        token = PreviewStore.put(request, {'file_name': 'a.kml'})
+        PreviewStore.cache().delete(PreviewStore.key(token))
+
+        self.assertIsNone(PreviewStore.get(request))
+        self.assertNotIn(PreviewStore.SESSION_KEY, request.session)
+
+    def test_upload_preview_round_trip(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('uploads'), {'kml_file': SimpleUploadedFile('ward.kml', make_kml(25))})
+
+        self.assertRedirects(response, reverse('file_preview'), fetch_redirect_response=False)
+        session = self.client.session
+        self.assertNotIn('preview_data', session)
+        preview = PreviewStore.cache().get(PreviewStore.key(session[PreviewStore.SESSION_KEY]))
+        self.assertEqual(preview['file_name'], 'ward.kml')
+        self.assertEqual(preview['preview_data']['total_placemarks'], 25)
+        self.assertTrue(default_storage.exists(preview['file_path']))
+
+        self.assertEqual(self.client.get(reverse('file_preview')).status_code, 200)
+
+        # Another upload replaces the stored preview instead of piling up entries
+        first_token = session[PreviewStore.SESSION_KEY]
+        self.client.post(reverse('uploads'), {'kml_file': SimpleUploadedFile('ward2.kml', make_kml(2))})
+        self.assertIsNone(PreviewStore.cache().get(PreviewStore.key(first_token)))
+        self.assertNotEqual(self.client.session[PreviewStore.SESSION_KEY], first_token)
+
+
+class BoundedHeadReadTests(SimpleTestCase):
+    """Previews read only the first records of an upload and count the rest without parsing it"""
+
+    def test_kml_head_stops_after_limit(self):
+        # Anything past the tenth Placemark is never parsed, so trailing garbage does not matter
+        content = make_kml(50).replace(b'</Document>', b'<Broken></Document>')
+        placemarks, total, estimated = kml_head(SimpleUploadedFile('ward.kml', content), limit=10)
+
+        self.assertEqual(len(placemarks), 10)
+        self.assertEqual(placemarks[-1].find(f'{KML_NS}name').text, 'Parcel 9')
+        self.assertEqual(total, 50)
+        self.assertFalse(estimated)
+
+    def test_kml_head_small_document(self):
+        placemarks, total, estimated = kml_head(SimpleUploadedFile('ward.kml', make_kml(3)), limit=10)
+        self.assertEqual((len(placemarks), total, estimated), (3, 3, False))
+
+    def test_large_files_are_estimated_from_samples(self):
+        upload = SimpleUploadedFile('ward.kml', make_kml(400))
+        with mock.patch.object(previews, 'SCAN_BYTES', 4096), mock.patch.object(previews, 'SAMPLE_WINDOW_BYTES', 2048):
+            placemarks, total, estimated = kml_head(upload, limit=10)
+
+        self.assertEqual(len(placemarks), 10)
+        self.assertTrue(estimated)
+        self.assertAlmostEqual(total, 400, delta=40)
+
+    def test_count_records_across_chunk_boundaries(self):
+        upload = SimpleUploadedFile('ward.kml', make_kml(30))
+        with mock.patch.object(previews, 'SCAN_CHUNK_BYTES', 7):
+            self.assertEqual(count_records(upload, previews.PLACEMARK_RE), (30, True))
+        self.assertEqual(count_records(upload, previews.PLACEMARK_RE, start=upload.size), (0, True))
+
+    def test_csv_head(self):
+        lines = ['Kitta,Owner'] + [f'K-{i},Owner {i}' for i in range(25)]
+        for content in ('\n'.join(lines) + '\n', '\n'.join(lines)):
+            headers, rows, total, estimated = csv_head(SimpleUploadedFile('survey.csv', content.encode()), limit=10)
+            self.assertEqual(headers, ['Kitta', 'Owner'])
+            self.assertEqual(rows, [[f'K-{i}', f'Owner {i}'] for i in range(10)])
+            self.assertEqual(total, 25)
+            self.assertFalse(estimated)
+
+        headers, rows, total, estimated = csv_head(SimpleUploadedFile('survey.csv', b'Kitta,Owner\nK-1,A\n'), limit=10)
+        self.assertEqual((headers, rows, total, estimated), (['Kitta', 'Owner'], [['K-1', 'A']], 1, False))
+
+
+class CSVCoordinateCellTests(MediaRootTestCase):
+    """Malformed 'Coordinates' cells skip their row instead of aborting the import"""
+
+    def test_bad_cells_are_skipped(self):
+        square = '[[85.3, 27.7, 0], [85.31, 27.7, 0], [85.31, 27.71, 0], [85.3, 27.7, 0]]'
+        content = '\n'.join([
+            'Name,Coordinates',
+            f'good,"{square}"',
+            'ragged,"[[85.3, 27.7], [85.31], [85.31, 27.71]]"',
+            'nested,"[[[85.3, 27.7], [85.31, 27.7], [85.31, 27.71]]]"',
+            'text,"[[\'a\', \'b\'], [85.31, 27.7]]"',
+            'empty,"[]"',
+            f'also_good,"{square}"',
+        ]).encode('utf-8')
+
+        upload = self.upload('parcels.csv', content, 'csv')
+
+        rows = CSVData.objects.filter(file_upload=upload).order_by('row_number')
+        self.assertEqual([row.data['Name'] for row in rows], ['good', 'also_good'])
+        self.assertEqual(rows[0].data['_coordinates'][1], [85.31, 27.7])
+        self.assertEqual(upload.feature_count, 2)
+
+class DataVersionTests(MediaRootTestCase):
+    """Cached GeoJSON follows rows that are rewritten in place"""
+
+    def test_reprocessed_rows_are_served_fresh(self):
+        upload = self.upload_kml('parcels.kml', make_kml(3))
+        url = reverse('kml_geojson', args=[upload.kml_file_id])
+        self.client.force_login(self.user)
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        # A raw edit the cache cannot see, then a reprocess that rewrites the rows
+        KMLData.objects.filter(kml_file=upload.kml_file).update(owner_name='<b>Ram  Bahadur</b>')
+        processed, cleaned = reprocess_rows(KMLData.objects.filter(kml_file=upload.kml_file))
+        self.assertEqual((processed, cleaned), (3, 3))
+
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        owners = {feature['properties']['owner_name'] for feature in json.loads(second.content)['features']}
+        self.assertEqual(owners, {'Ram Bahadur'})
+
+class KMLVersionTests(MediaRootTestCase):
+    """Placemarks are imported whatever KML namespace the document declares"""
+
+    def assert_imports(self, content):
+        upload = self.upload_kml('parcels.kml', content)
+        rows = KMLData.objects.filter(kml_file=upload.kml_file).order_by('id')
+        self.assertEqual([row.placemark_name for row in rows], ['Parcel 0', 'Parcel 1', 'Parcel 2'])
+        self.assertEqual([row.kitta_number for row in rows], ['K-0', 'K-1', 'K-2'])
+        self.assertTrue(all(row.geometry_type == 'Polygon' and row.geometry_wkb for row in rows))
+
+    def test_kml_21_namespace(self):
+        self.assert_imports(make_kml(3).replace(b'http://www.opengis.net/kml/2.2', b'http://earth.google.com/kml/2.1'))
+
+    def test_no_namespace(self):
+        self.assert_imports(make_kml(3).replace(b' xmlns="http://www.opengis.net/kml/2.2"', b''))
+
+@override_settings(INGEST_WORKERS=2, INGEST_PARALLEL_CHUNK_SIZE=2)
+class ParallelKMLIngestTests(MediaRootTestCase):
+    """Parallel chunked extraction yields exactly what the serial streaming pass does"""
+
+    def placemark(self, name, description='Kitta: K-1'):
+        return (
+            f'<Placemark><name>{name}</name><description>{description}</description><ext:survey>1</ext:survey>'
+            '<Point><coordinates>85.3,27.7,0</coordinates></Point></Placemark>'
+        )
+
+    def write_kml(self, body):
+        path = os.path.join(self.media_root, 'large.kml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<!-- <kml><Placemark><name>before root</name></Placemark></kml> -->\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2"><Document xmlns:ext="urn:example:survey">'
+                f'{body}</Document></kml>'
+            )
+        return path
+
+    def extract(self, path):
+        """Placemark names from the parallel path (on threads) and from the serial session"""
+        with mock.patch.object(ParallelKMLIngest, 'executor', return_value=ThreadPoolExecutor(2)):
+            parallel = [row['placemark_name'] for row in ParallelKMLIngest.iter_placemarks(path)]
+        with KMLParseSession(path) as session:
+            serial = [row['placemark_name'] for row in session.placemarks()]
+        return parallel, serial
+
+    def test_chunks_keep_enclosing_namespaces(self):
+        path = self.write_kml(
+            '<name><![CDATA[<Placemark><name>in cdata</name></Placemark>]]></name>'
+            f'<Folder><name>A</name>{self.placemark("a1")}{self.placemark("a2")}{self.placemark("a3")}</Folder>'
+            '<!-- <Placemark><name>commented out</name></Placemark> -->'
+            f'<Folder xmlns:ext="urn:example:other">{self.placemark("b1")}{self.placemark("b2")}</Folder>'
+        )
+
+        self.assertEqual(len(ParallelKMLIngest.split(path)), 3)
+        parallel, serial = self.extract(path)
+        self.assertEqual(serial, ['a1', 'a2', 'a3', 'b1', 'b2'])
+        self.assertEqual(parallel, serial)
+
+    def test_unsplittable_chunk_falls_back_to_serial(self):
+        # The end tag inside CDATA cuts the byte-level chunk mid-placemark, so it cannot parse alone
+        tricky = self.placemark('p3', '<![CDATA[see </Placemark> below]]>')
+        path = self.write_kml(''.join(self.placemark(f'p{i}') for i in (1, 2)) + tricky + self.placemark('p4'))
+
+        parallel, serial = self.extract(path)
+        self.assertEqual(serial, ['p1', 'p2', 'p3', 'p4'])
+        self.assertEqual(parallel, serial)
+
+class StaleJobTests(IsolatedStorageMixin, TestCase):
+    """Running jobs are requeued only once their heartbeat has stopped"""
+
+    def running_job(self, heartbeat_age, attempts=1):
+        job = ProcessingJob.objects.create(job_type='process_file', status='running', worker_id='gone', attempts=attempts)
+        ProcessingJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(seconds=heartbeat_age))
+        return job
+
+    @override_settings(JOB_QUEUE_STALE_SECONDS=300)
+    def test_requeue_by_heartbeat_age(self):
+        alive = self.running_job(heartbeat_age=30)
+        dead = self.running_job(heartbeat_age=600)
+        exhausted = self.running_job(heartbeat_age=600, attempts=3)
+        # A long job started hours ago but still reporting in is left running
+        ProcessingJob.objects.filter(id=alive.id).update(started_at=timezone.now() - timedelta(hours=5))
+
+        self.assertEqual(requeue_stale_jobs(), (1, 1))
+        statuses = dict(ProcessingJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {alive.id: 'running', dead.id: 'queued', exhausted.id: 'failed'})
+
+    @override_settings(JOB_QUEUE_STALE_SECONDS=300)
+    def test_idle_worker_recovers_orphans_periodically(self):
+        worker = JobWorker(name='idle')
+        orphan = self.running_job(heartbeat_age=600)
+        worker.recover_stale_jobs()
+        orphan.refresh_from_db()
+        self.assertEqual(orphan.status, 'queued')
+
+        # Throttled: another orphan waits for the next interval
+        second = self.running_job(heartbeat_age=600)
+        worker.recover_stale_jobs()
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'running')
+        worker.last_recovery -= 301
+        worker.recover_stale_jobs()
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'queued')
+
+class JobHeartbeatTests(IsolatedStorageMixin, TransactionTestCase):
+    """The heartbeat thread keeps a long-running job's updated_at fresh"""
+
+    def test_heartbeat_refreshes_updated_at(self):
+        job = ProcessingJob.objects.create(job_type='process_file', status='running')
+        old = timezone.now() - timedelta(hours=1)
+        ProcessingJob.objects.filter(id=job.id).update(updated_at=old)
+
+        with JobHeartbeat(job, interval=0.05):
+            time.sleep(0.3)
+
+        job.refresh_from_db()
+        self.assertGreater(job.updated_at, old + timedelta(minutes=59))
+        self.assertEqual(requeue_stale_jobs(max_age_seconds=60), (0, 0))
+
+class StreamingExportTests(MediaRootTestCase):
+    """CSV and KML exports are generated row by row into streaming responses"""
+
+    def test_kml_rows_to_csv(self):
+        upload = self.upload_kml('parcels.kml', make_kml(4))
+
+        response = FileConverter.kml_to_csv(KMLData.objects.filter(kml_file=upload.kml_file), 'parcels')
+
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="parcels.csv"')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = list(csv.reader(content[1:].splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertIn('Parcel 3', content)
+
+    def test_no_rows_to_csv(self):
+        with self.assertRaises(ValueError):
+            FileConverter.kml_to_csv(KMLData.objects.none(), 'empty')
+
+    def test_csv_rows_to_kml(self):
+        upload = FileUpload.objects.create(
+            user=self.user, file='uploads/rows.csv', original_filename='rows.csv', file_type='csv', file_size=1,
+        )
+        CSVData.objects.create(
+            file_upload=upload, row_number=1, data={'name': 'Well & pump', 'depth': 12},
+            geometry_type='Point', coordinates='[85.3, 27.7]',
+        )
+        CSVData.objects.create(
+            file_upload=upload, row_number=2, data={'name': 'Field <north>'}, geometry_type='Polygon',
+            coordinates='[[85.3, 27.7], [85.31, 27.7], [85.31, 27.71], [85.3, 27.7]]',
+        )
+
+        response = FileConverter.csv_to_kml(CSVData.objects.filter(file_upload=upload), 'rows')
+
+        self.assertIsInstance(response, StreamingHttpResponse)
+        document = ET.fromstring(b''.join(response.streaming_content))
+        ns = {'kml': 'http://www.opengis.net/kml/2.2'}
+        placemarks = document.findall('.//kml:Placemark', ns)
+        self.assertEqual([p.findtext('kml:name', namespaces=ns) for p in placemarks], ['Well & pump', 'Field <north>'])
+        self.assertIsNotNone(placemarks[0].find('kml:Point', ns))
+        self.assertIsNotNone(placemarks[1].find('kml:Polygon', ns))
+        self.assertEqual(placemarks[0].findtext('kml:description', namespaces=ns), 'depth: 12')
+
+    def test_completion_callback_runs_after_the_last_chunk(self):
+        sizes = []
+        response = on_stream_complete(StreamingHttpResponse(iter([b'ab', b'cde'])), sizes.append)
+        self.assertEqual(sizes, [])
+        self.assertEqual(b''.join(response.streaming_content), b'abcde')
+        self.assertEqual(sizes, [5])
+
+    def test_survey_csv_export(self):
+        upload = self.upload_kml('parcels.kml', make_kml(3))
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('survey_export'), {
+            'format': 'csv', 'file_ids': [upload.id, upload.kml_file_id],
+        })
+
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+        self.assertEqual(rows[0], ['File Name', 'Type', 'Size (KB)', 'Upload Date', 'Records'])
+        self.assertIn(['parcels.kml', 'KML'], [row[:2] for row in rows[1:]])
+        self.assertEqual([row[4] for row in rows[1:] if row[1] == 'KML'], ['3'])
+
+class SurveyKMLExportTests(MediaRootTestCase):
+    """The KML survey export reads rows without WKB from their coordinates in bulk"""
+
+    def test_rows_without_wkb_do_not_query_per_row(self):
+        upload = self.upload_kml('parcels.kml', make_kml(6))
+        KMLData.objects.filter(kml_file=upload.kml_file).update(geometry_wkb=None)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('survey_export'), {'format': 'kml', 'file_ids': [upload.kml_file_id]})
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(response.streaming_content).decode('utf-8')
+
+        self.assertEqual(content.count('<Polygon>'), 6)
+        self.assertIn('<name>Parcel 5</name>', content)
+        self.assertLessEqual(len(queries.captured_queries), 3)
+
+class SurveyDedupPaginationTests(MediaRootTestCase):
+    """Database dedup and keyset pages give the same records as the old Python dedup + OFFSET pages"""
+
+    PER_PAGE = 3
+
+    def setUp(self):
+        super().setUp()
+        self.kml_file = KMLFile.objects.create(user=self.user, file='kml_files/survey.kml', original_filename='survey.kml', file_size=1)
+        start = timezone.now() - timedelta(days=1)
+        # (minutes after start, kitta, owner): ids are assigned in list order, so later
+        # duplicates are sometimes created with an earlier timestamp than the row they repeat
+        records = [
+            (50, 'K-1', 'Ram'), (10, 'K-2', 'Sita'), (40, 'K-1', 'Ram'), (20, 'K-3', 'Hari'),
+            (5, 'K-2', 'Sita'), (60, 'K-4', 'Gita'), (30, 'K-5', 'Shyam'), (70, 'K-4', 'Gita'),
+            (15, 'K-6', 'Mina'), (25, 'K-7', 'Bina'), (35, 'K-6', 'Mina'), (45, 'K-8', 'Kamal'),
+            (55, 'K-9', 'Bimal'), (65, 'K-1', 'Ram'),
+        ]
+        for minutes, kitta, owner in records:
+            KMLData.objects.create(
+                kml_file=self.kml_file, kitta_number=kitta, owner_name=owner, placemark_name=f'Parcel {kitta}',
+                area_hectares='0.250000', geometry_type='Point', coordinates='[85.3, 27.7]',
+                created_at=start + timedelta(minutes=minutes),
+            )
+
+    def old_pages(self):
+        """The pre-dedup_key path: first record of each key in created_at order, then OFFSET pages"""
+        seen, unique_ids = set(), []
+        for record in KMLData.objects.filter(kml_file=self.kml_file).order_by('created_at'):
+            key = f"{record.kitta_number}_{record.owner_name}_{record.placemark_name}_{record.area_hectares}"
+            if key not in seen:
+                seen.add(key)
+                unique_ids.append(record.id)
+        paginator = Paginator(KMLData.objects.filter(id__in=unique_ids).order_by('created_at'), self.PER_PAGE)
+        return [[item.id for item in paginator.page(number)] for number in paginator.page_range]
+
+    def keyset_pages(self, queryset):
+        pages, cursor = [], ''
+        while True:
+            items, cursor = keyset_page(queryset, cursor, self.PER_PAGE)
+            pages.append([item.id for item in items])
+            if cursor is None:
+                return pages
+
+    def test_database_dedup_matches_the_offset_path(self):
+        expected = self.old_pages()
+        self.assertEqual(sum(len(page) for page in expected), 9)
+
+        unique = unique_survey_records(KMLData.objects.filter(kml_file=self.kml_file))
+        self.assertEqual(list(unique.values_list('id', flat=True)), [i for page in expected for i in page])
+        self.assertEqual(self.keyset_pages(unique), expected)
+
+    def test_keyset_page_is_one_limited_query(self):
+        unique = unique_survey_records(KMLData.objects.filter(kml_file=self.kml_file))
+        with CaptureQueriesContext(connection) as queries:
+            keyset_page(unique, '', self.PER_PAGE)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql'].upper()
+        self.assertIn(f'LIMIT {self.PER_PAGE + 1}', sql)
+        self.assertIn('NOT EXISTS', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_api_numbered_and_cursor_pages_agree(self):
+        expected = self.old_pages()
+        self.client.force_login(self.user)
+        url = reverse('survey_report_data')
+        params = {'file_ids': [self.kml_file.id], 'per_page': self.PER_PAGE}
+
+        numbered = []
+        for number in range(1, len(expected) + 1):
+            body = self.client.get(url, {**params, 'page': number}).json()
+            numbered.append([int(item['id']) for item in body['data']])
+        self.assertEqual(numbered, expected)
+        self.assertFalse(body['has_next'])
+
+        cursor_pages, cursor = [], ''
+        while cursor is not None:
+            with CaptureQueriesContext(connection) as queries:
+                body = self.client.get(url, {**params, 'cursor': cursor}).json()
+            # Cursor pages never count the whole deduplicated set
+            self.assertFalse([q['sql'] for q in queries if 'COUNT(' in q['sql'].upper()])
+            self.assertIsNone(body['total_pages'])
+            cursor_pages.append([int(item['id']) for item in body['data']])
+            cursor = body['next_cursor']
+        self.assertEqual(cursor_pages, expected)
+
+def make_shapefile_zip(geometries, crs, columns=None, folder=''):
+    """A zipped shapefile (with .prj) holding the given shapely geometries, optionally in a folder"""
+    import zipfile
+    import geopandas as gpd
+
+    columns = columns or {'name': [f'Parcel {i}' for i in range(len(geometries))]}
+    workdir = tempfile.mkdtemp()
+    try:
+        gpd.GeoDataFrame(columns, geometry=list(geometries), crs=crs).to_file(
+            os.path.join(workdir, 'parcels.shp'), engine='pyogrio'
+        )
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name in sorted(os.listdir(workdir)):
+                archive.write(os.path.join(workdir, name), folder + name)
+        return buffer.getvalue()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+class IngestStatsTests(MediaRootTestCase):
+    """Upload bounds and geometry stats are lon/lat and ellipsoidal whatever the source projection"""
+
+    def test_kml_upload_stats(self):
+        upload = self.upload_kml('parcels.kml', make_kml(3))
+
+        self.assertEqual(upload.feature_count, 3)
+        self.assertEqual(upload.geometry_type, 'Polygon')
+        self.assertAlmostEqual(upload.bounds['min_lon'], 85.3)
+        self.assertAlmostEqual(upload.bounds['max_lon'], 85.3025)
+        self.assertAlmostEqual(upload.bounds['max_lat'], 27.7005)
+        stats = upload.metadata['geometry_stats']
+        self.assertEqual(stats['type_counts'], {'Polygon': 3})
+        self.assertEqual(stats['vertex_count'], 15)
+        stored = sum(float(row.area_sqm) for row in KMLData.objects.filter(kml_file=upload.kml_file))
+        self.assertAlmostEqual(stats['area_sqm'], stored, places=1)
+
+    def test_projected_shapefile_is_reprojected_before_stats(self):
+        from pyproj import Transformer
+        from shapely.geometry import box
+
+        # A 100 m x 100 m parcel in UTM zone 45N, near Kathmandu
+        easting, northing = Transformer.from_crs('EPSG:4326', 'EPSG:32645', always_xy=True).transform(85.3, 27.7)
+        content = make_shapefile_zip([box(easting, northing, easting + 100, northing + 100)], 'EPSG:32645')
+
+        upload = self.upload('parcels.zip', content, 'shapefile')
+
+        self.assertEqual(upload.feature_count, 1)
+        self.assertAlmostEqual(upload.bounds['min_lon'], 85.3, places=4)
+        self.assertAlmostEqual(upload.bounds['min_lat'], 27.7, places=4)
+        self.assertLess(upload.bounds['max_lon'] - upload.bounds['min_lon'], 0.01)
+        self.assertAlmostEqual(upload.metadata['geometry_stats']['area_sqm'], 10000, delta=20)
+        row = upload.shapefile_data.get()
+        self.assertAlmostEqual(row.min_lon, 85.3, places=4)
+        self.assertIn('32645', upload.coordinate_system)
+
+class ShapefileZipTests(MediaRootTestCase):
+    """Shapefiles are read column-wise from the ZIP through /vsizip/, with nothing extracted"""
+
+    def squares(self, count):
+        from shapely.geometry import box
+
+        return [box(85.3 + i * 0.001, 27.7, 85.3005 + i * 0.001, 27.7005) for i in range(count)]
+
+    def test_layer_is_read_from_the_archive(self):
+        content = make_shapefile_zip(self.squares(3), 'EPSG:4326', {
+            'name': ['A', 'B', 'C'],
+            'area': [1.5, float('nan'), 2.0],
+            'surveyed': ['2023-01-05', None, '2023-02-01'],
+        }, folder='ward-4/')
+
+        with mock.patch('tempfile.mkdtemp', side_effect=AssertionError('extracted to disk')):
+            upload = self.upload('parcels.zip', content, 'shapefile')
+
+        self.assertEqual(upload.status, 'completed')
+        self.assertEqual(upload.feature_count, 3)
+        self.assertEqual(upload.geometry_type, 'Polygon')
+        rows = list(upload.shapefile_data.order_by('feature_id'))
+        self.assertEqual([row.attributes['name'] for row in rows], ['A', 'B', 'C'])
+        # NaN becomes null so the attributes stay valid JSON
+        self.assertIsNone(rows[1].attributes['area'])
+        self.assertEqual(rows[0].attributes['area'], 1.5)
+        self.assertAlmostEqual(rows[2].min_lon, 85.302)
+        self.assertEqual(len(json.loads(rows[0].coordinates)), 5)
+
+    def test_shallowest_shp_is_a_vsizip_path(self):
+        import zipfile
+
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('deep/nested/old.shp', b'')
+            archive.writestr('top/parcels.shp', b'')
+        upload = FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile('layers.zip', buffer.getvalue()),
+            original_filename='layers.zip', file_type='shapefile', file_size=len(buffer.getvalue()),
+        )
+
+        source = FileProcessor(upload)._shapefile_source()
+
+        self.assertEqual(source, f'/vsizip/{os.path.abspath(upload.file.path)}/top/parcels.shp')
+
+    def test_archive_without_shp_fails(self):
+        import zipfile
+
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('readme.txt', b'no layer')
+        with self.assertRaisesRegex(ValueError, 'No .shp file'):
+            self.upload('empty.zip', buffer.getvalue(), 'shapefile')
+
+class GeodesicAreaTests(MediaRootTestCase):
+    """Polygon areas are true ellipsoidal areas, and the stored-row recompute keeps derived data in step"""
+
+    def hectare_near_27n(self):
+        # 100 m east and 100 m north of a corner in Kathmandu, walked on the WGS84 ellipsoid
+        from pyproj import Geod
+        from shapely.geometry import Polygon
+
+        geod = Geod(ellps='WGS84')
+        lon, lat = 85.3, 27.7
+        east_lon, east_lat, _ = geod.fwd(lon, lat, 90, 100)
+        ne_lon, ne_lat, _ = geod.fwd(east_lon, east_lat, 0, 100)
+        north_lon, north_lat, _ = geod.fwd(lon, lat, 0, 100)
+        return Polygon([(lon, lat), (east_lon, east_lat), (ne_lon, ne_lat), (north_lon, north_lat)])
+
+    def test_one_hectare_parcel(self):
+        area, = geodesic_areas([self.hectare_near_27n()]).tolist()
+        self.assertAlmostEqual(area, 10000, delta=5)
+
+    def test_recompute_migration_refreshes_dedup_key_and_owner(self):
+        import shapely
+        from django.apps import apps
+        from .models import make_dedup_key
+
+        migration = importlib.import_module('userdashboard.migrations.0019_recompute_polygon_areas')
+        upload = self.upload_kml('parcels.kml', make_kml(3))
+        kml_file = upload.kml_file
+        parcel = self.hectare_near_27n()
+        # Rows as an older release stored them: approximate area, key computed from it
+        KMLData.objects.filter(kml_file=kml_file).update(
+            geometry_wkb=shapely.to_wkb(parcel), area_hectares='0.900000', area_sqm='9000.00',
+            dedup_key=make_dedup_key('K-0', '', 'Parcel 0', '0.900000'),
+        )
+        KMLFile.objects.filter(pk=kml_file.pk).update(updated_at=timezone.now() - timedelta(days=1))
+
+        with mock.patch.object(migration, 'BATCH_SIZE', 2):
+            migration.recompute_polygon_areas(apps, None)
+
+        for row in KMLData.objects.filter(kml_file=kml_file):
+            self.assertAlmostEqual(float(row.area_hectares), 1.0, places=3)
+            self.assertEqual(row.dedup_key, make_dedup_key(row.kitta_number, row.owner_name, row.placemark_name, row.area_hectares))
+        kml_file.refresh_from_db()
+        self.assertGreater(kml_file.updated_at, timezone.now() - timedelta(minutes=1))
+
+RICH_PLACEMARK = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Placemark>
+  <name>Ward 4 parcel</name>
+  <description><![CDATA[<b>Area:</b> 0.5 ha]]></description>
+  <styleUrl>#parcel</styleUrl>
+  <Style id="inline"><LineStyle><color>ff0000ff</color></LineStyle></Style>
+  <TimeSpan><begin>2023-01-01</begin><end>2023-12-31</end></TimeSpan>
+  <ExtendedData>
+    <Data name="Kitta No"><value>1234</value></Data>
+    <Data name="Owner"><value> Ram Bahadur </value></Data>
+    <SimpleData name="ward">4</SimpleData>
+  </ExtendedData>
+  <MultiGeometry>
+    <Polygon>
+      <extrude>1</extrude>
+      <altitudeMode>relativeToGround</altitudeMode>
+      <outerBoundaryIs><LinearRing><coordinates>85.3,27.7,0 85.301,27.7,0 85.301,27.701,0 85.3,27.7,0</coordinates></LinearRing></outerBoundaryIs>
+      <innerBoundaryIs><LinearRing><coordinates>85.3002,27.7002,0 85.3004,27.7002,0 85.3004,27.7004,0 85.3002,27.7002,0</coordinates></LinearRing></innerBoundaryIs>
+    </Polygon>
+    <Polygon>
+      <outerBoundaryIs><LinearRing><coordinates>86,28 86.1,28 86.1,28.1 86,28</coordinates></LinearRing></outerBoundaryIs>
+    </Polygon>
+  </MultiGeometry>
+</Placemark></Document></kml>"""
+
+class PlacemarkVisitorTests(SimpleTestCase):
+    """One walk over a placemark fills every field with the old first-occurrence rules"""
+
+    def placemark(self):
+        return ET.fromstring(RICH_PLACEMARK).find(f'.//{KML_NS}Placemark')
+
+    def test_visitor_fields(self):
+        visitor = PlacemarkVisitor().visit(self.placemark())
+
+        self.assertEqual(visitor.direct_text(KML_NS + 'name'), 'Ward 4 parcel')
+        self.assertEqual(visitor.style_url, '#parcel')
+        self.assertEqual(visitor.style_id, 'inline')
+        self.assertEqual(visitor.time, {'begin': '2023-01-01', 'end': '2023-12-31'})
+        self.assertEqual(visitor.data_pairs, [('Kitta No', '1234'), ('Owner', 'Ram Bahadur')])
+        self.assertEqual(visitor.simple_data, [('ward', '4')])
+        # First polygon's outer ring only; the hole and the second polygon are ignored
+        self.assertTrue(visitor.polygon_coords.startswith('85.3,27.7,0 85.301,27.7,0'))
+        self.assertNotIn('85.3002', visitor.polygon_coords)
+        self.assertEqual(visitor.altitude_data(), {'altitude_mode': 'relativeToGround', 'extrude': '1'})
+
+    def test_extracted_placemark(self):
+        data = KMLParser('unused.kml')._extract_comprehensive_placemark_data(self.placemark())
+
+        self.assertEqual(data['placemark_name'], 'Ward 4 parcel')
+        self.assertEqual(data['kitta_number'], '1234')
+        self.assertEqual(data['owner_name'], 'Ram Bahadur')
+        self.assertEqual(data['geometry_type'], 'Polygon')
+        self.assertEqual(len(json.loads(data['coordinates'])), 4)
+        self.assertEqual(json.loads(data['extended_data']), {'Kitta No': '1234', 'Owner': 'Ram Bahadur', 'ward': '4'})
+        self.assertEqual(data['description'], 'Area: 0.5 ha')
+        self.assertEqual((data['time_begin'], data['time_end']), ('2023-01-01', '2023-12-31'))
+        self.assertEqual(data['altitude_mode'], 'relativeToGround')
+        self.assertEqual(data['style_url'], '#parcel')
+
+def make_kmz(members):
+    """A KMZ archive holding the given {name: bytes} members"""
+    import zipfile
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+class KMZTests(MediaRootTestCase):
+    """KMZ uploads are parsed straight from the compressed member"""
+
+    def test_kmz_upload_is_parsed(self):
+        content = make_kmz({'doc.kml': make_kml(3), 'files/icon.png': b'not really a png'})
+
+        upload = self.upload('parcels.kmz', content, 'kml')
+
+        self.assertEqual(upload.status, 'completed')
+        self.assertEqual(
+            sorted(upload.kml_file.parsed_data.values_list('placemark_name', flat=True)),
+            ['Parcel 0', 'Parcel 1', 'Parcel 2'],
+        )
+
+    def test_document_choice(self):
+        import zipfile
+
+        def document(members):
+            with zipfile.ZipFile(BytesIO(make_kmz(members))) as archive:
+                return kmz_document(archive)
+
+        self.assertEqual(document({'a/other.kml': b'', 'doc.kml': b''}), 'doc.kml')
+        self.assertEqual(document({'a/b/deep.kml': b'', 'a/top.kml': b''}), 'a/top.kml')
+        with self.assertRaises(ValueError):
+            document({'readme.txt': b''})
+
+    def test_detected_by_content(self):
+        self.assertTrue(is_kmz(BytesIO(make_kmz({'doc.kml': make_kml(1)}))))
+        stream = BytesIO(make_kml(1))
+        self.assertFalse(is_kmz(stream))
+        self.assertEqual(stream.tell(), 0)
+
+    def test_archive_without_kml_is_rejected(self):
+        with self.assertRaises(ValueError):
+            KMLParseSession(BytesIO(make_kmz({'readme.txt': b'nothing here'})))
+
+    def test_kmz_through_the_upload_page(self):
+        self.client.force_login(self.user)
+        kmz = SimpleUploadedFile('ward.kmz', make_kmz({'doc.kml': make_kml(2)}))
+
+        self.client.post(reverse('kml_upload'), {'kml_file': kmz})
+
+        kml_file = KMLFile.objects.get()
+        self.assertEqual(kml_file.original_filename, 'ward.kmz')
+        self.assertTrue(kml_file.file.name.endswith('.kmz'))
+
+class ExtractionRulesTests(SimpleTestCase):
+    """Per-placemark and column-wise extraction agree, and sources override the default patterns"""
+
+    DESCRIPTIONS = [
+        'Kitta Number: 123 Owner Name: Hari',
+        '<b>kitta:</b> 77 <br/>owner: Sita',
+        'Parcel KML_1_11_10, area 500 sq m',
+        'Area: 0.25 ha',
+        'nothing here',
+        '',
+    ]
+
+    def test_extended_data_wins_over_the_description(self):
+        rules = ExtractionRules.for_source()
+        result = rules.extract([('Kitta No', '900'), ('Owner', '<i>Gita</i>')], 'Kitta: 123 Owner: Hari', 'P')
+        self.assertEqual(result, {'kitta_number': '900', 'owner_name': 'Gita'})
+
+    def test_description_and_name_fallbacks(self):
+        rules = ExtractionRules.for_source()
+        self.assertEqual(rules.extract([], 'kitta: 77 owner: Sita', 'P'), {'kitta_number': '77', 'owner_name': 'Sita'})
+        self.assertEqual(rules.extract([], 'nothing here', 'Parcel 9'), {'kitta_number': '', 'owner_name': 'Parcel 9'})
+        self.assertEqual(rules.extract_area('Area: 0.25 ha'), 0.25)
+        self.assertEqual(rules.extract_area('area 500 sq m'), 0.05)
+        self.assertIsNone(rules.extract_area('no area'))
+
+    def test_frame_matches_per_placemark_extraction(self):
+        import pandas as pd
+
+        rules = ExtractionRules.for_source()
+        # Stored descriptions are already cleaned of HTML, which is what the frame path sees
+        frame = pd.DataFrame({
+            'description': [clean_text(description) for description in self.DESCRIPTIONS],
+            'placemark_name': [f'P{i}' for i in range(len(self.DESCRIPTIONS))],
+            'kitta_number': [''] * len(self.DESCRIPTIONS),
+            'owner_name': [''] * len(self.DESCRIPTIONS),
+            'area_hectares': [None] * len(self.DESCRIPTIONS),
+        })
+        extracted = rules.extract_frame(frame)
+        for i, description in enumerate(self.DESCRIPTIONS):
+            with self.subTest(description=description):
+                expected = rules.extract([], description, f'P{i}')
+                self.assertEqual(extracted.loc[i, 'kitta_number'], expected['kitta_number'])
+                self.assertEqual(extracted.loc[i, 'owner_name'], expected['owner_name'])
+                area = rules.extract_area(description)
+                if area is None:
+                    self.assertTrue(pd.isna(extracted.loc[i, 'area_hectares']))
+                else:
+                    self.assertAlmostEqual(extracted.loc[i, 'area_hectares'], area)
+
+    def test_frame_keeps_values_already_set(self):
+        import pandas as pd
+
+        frame = pd.DataFrame({
+            'description': ['Kitta: 123 Area: 2 ha'], 'placemark_name': ['P'],
+            'kitta_number': ['K-1'], 'owner_name': ['Ram'], 'area_hectares': [1.0],
+        })
+        extracted = ExtractionRules.for_source().extract_frame(frame)
+        self.assertEqual(extracted.loc[0].tolist(), ['K-1', 'Ram', 1.0])
+
+    @override_settings(EXTRACTION_RULES={'ward-9': {'kitta': [r'plot\s*#\s*(\d+)'], 'owner_keys': ['holder']}})
+    def test_source_rules(self):
+        with mock.patch.dict(ExtractionRules._cache, clear=True):
+            rules = ExtractionRules.for_source('ward-9')
+            self.assertIs(ExtractionRules.for_source('ward-9'), rules)
+            self.assertEqual(rules.source, 'ward-9')
+            self.assertEqual(rules.extract([('Holder', 'Mina')], 'Plot # 42', 'P'), {'kitta_number': '42', 'owner_name': 'Mina'})
+            # Unknown sources fall back to the defaults
+            self.assertEqual(ExtractionRules.for_source('nowhere').source, '')
+            self.assertEqual(ExtractionRules.for_source('nowhere').extract([], 'Kitta: 5', 'P')['kitta_number'], '5')
+
+class ParseCoordinatesTests(SimpleTestCase):
+    """<coordinates> text is decoded leniently, tuple by tuple"""
+
+    def assertCoordinates(self, text, expected):
+        self.assertEqual(parse_coordinates(text).tolist(), expected)
+
+    def test_uniform_3d_tuples(self):
+        self.assertCoordinates('\n  85.3,27.7,0\n  85.4,27.8,0\n', [[85.3, 27.7, 0.0], [85.4, 27.8, 0.0]])
+
+    def test_mixed_2d_and_3d_tuples(self):
+        self.assertCoordinates('85.3,27.7 85.4,27.8,1200 85.5,27.9', [[85.3, 27.7], [85.4, 27.8], [85.5, 27.9]])
+
+    def test_trailing_commas(self):
+        self.assertCoordinates('85.3,27.7, 85.4,27.8,', [[85.3, 27.7], [85.4, 27.8]])
+
+    def test_spaces_around_commas(self):
+        self.assertCoordinates('85.3, 27.7 85.4 , 27.8', [[85.3, 27.7], [85.4, 27.8]])
+        self.assertCoordinates('85.3, 27.7, 0 85.4, 27.8, 0', [[85.3, 27.7, 0.0], [85.4, 27.8, 0.0]])
+
+    def test_bad_tuple_is_skipped_not_the_ring(self):
+        self.assertCoordinates('85.3,27.7 east,27.75 85.4,27.8', [[85.3, 27.7], [85.4, 27.8]])
+
+    def test_empty_or_invalid(self):
+        self.assertEqual(parse_coordinates('').shape, (0, 2))
+        self.assertEqual(parse_coordinates('85.3').shape, (0, 2))
+
+class HandEditedKMLTests(MediaRootTestCase):
+    """Hand-edited coordinate spacing does not drop the placemark"""
+
+    def test_trailing_commas_and_spaces_import(self):
+        content = make_kml(2)
+        content = content.replace(b',27.7', b', 27.7').replace(b',0 ', b',0, ').replace(b',0<', b',0,<')
+        upload = self.upload_kml('edited.kml', content)
+        self.assertEqual(KMLData.objects.filter(kml_file=upload.kml_file, geometry_type='Polygon').count(), 2)
+
+class StreamingParseTests(SimpleTestCase):
+    """The streaming KML session keeps only the current placemark in memory"""
+
+    def test_processed_placemarks_are_detached(self):
+        content = make_kml(200).replace(b'<Document>', b'<Document><Folder>').replace(b'</Document>', b'</Folder></Document>')
+        with KMLParseSession(BytesIO(content)) as session:
+            rows = session.placemarks(batch_size=1)
+            names = [next(rows)['placemark_name'] for _ in range(150)]
+            # Only placemarks the parser has read ahead remain in the tree, none of those already yielded
+            in_tree = [name.text for name in session._open[0].iter('{http://www.opengis.net/kml/2.2}name')]
+            self.assertTrue(set(in_tree).isdisjoint(names))
+            self.assertLess(len(in_tree), 100)
+            names += [row['placemark_name'] for row in rows]
+        self.assertEqual(names, [f'Parcel {i}' for i in range(200)])
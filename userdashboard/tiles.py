@@ -0,0 +1,117 @@
+import json
+import math
+import logging
+import numpy as np
+import shapely
+from django.conf import settings
+from django.core.cache import cache
+from shapely.geometry import mapping
+from .spatial import feature_properties, filter_viewport, iter_geometries
+
+logger = logging.getLogger(__name__)
+
+# Try to import mapbox_vector_tile, but fall back to tiled GeoJSON if it's not available
+try:
+    import mapbox_vector_tile
+    MVT_AVAILABLE = True
+except ImportError:
+    MVT_AVAILABLE = False
+    mapbox_vector_tile = None
+
+TILE_SIZE = 256  # screen pixels per tile edge
+MVT_EXTENT = 4096
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511287798
+WEB_MERCATOR_RADIUS = 6378137.0
+
+CONTENT_TYPES = {
+    'geojson': 'application/geo+json',
+    'mvt': 'application/vnd.mapbox-vector-tile',
+}
+
+def tile_bounds(z, x, y):
+    """Return the (west, south, east, north) lon/lat bounds of an XYZ tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def simplify_tolerance(z):
+    """Simplification tolerance in degrees: TILE_SIMPLIFY_PIXELS screen pixels at zoom z"""
+    return 360.0 / (TILE_SIZE * 2 ** z) * getattr(settings, 'TILE_SIMPLIFY_PIXELS', 1.0)
+
+def _to_web_mercator(coords):
+    """Project an (N, 2) lon/lat array to EPSG:3857 metres"""
+    lon = coords[:, 0]
+    lat = np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lon) * WEB_MERCATOR_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * WEB_MERCATOR_RADIUS
+    return np.column_stack((x, y))
+
+def _scalar_properties(properties):
+    """MVT attributes must be scalars; drop nested values and nulls"""
+    return {k: v for k, v in properties.items() if isinstance(v, (str, int, float, bool))}
+
+def render_tile(queryset, source, z, x, y, fmt='geojson'):
+    """Clip and simplify the rows overlapping one tile and encode them as GeoJSON or MVT bytes"""
+    west, south, east, north = tile_bounds(z, x, y)
+    # A small pixel buffer keeps polygon edges from showing seams between tiles
+    buffer = (east - west) * getattr(settings, 'TILE_BUFFER_PIXELS', 8) / TILE_SIZE
+    clip_box = (west - buffer, max(south - buffer, -90.0), east + buffer, min(north + buffer, 90.0))
+
+    items = []
+    geometries = []
+    for item, geometry in iter_geometries(filter_viewport(queryset, *clip_box)):
+        if geometry is not None:
+            items.append(item)
+            geometries.append(geometry)
+
+    if geometries:
+        # Vectorized per-zoom simplification and clipping over the whole tile at once
+        geometries = shapely.simplify(np.array(geometries, dtype=object), simplify_tolerance(z), preserve_topology=True)
+        geometries = shapely.clip_by_rect(geometries, *clip_box)
+        keep = ~shapely.is_empty(geometries)
+        items = [item for item, ok in zip(items, keep) if ok]
+        geometries = geometries[keep]
+
+    if fmt == 'mvt':
+        if not MVT_AVAILABLE:
+            raise ValueError("MVT output requires the mapbox-vector-tile package")
+        projected = shapely.transform(geometries, _to_web_mercator) if len(items) else []
+        (min_x, min_y), (max_x, max_y) = _to_web_mercator(np.array([[west, south], [east, north]]))
+        return mapbox_vector_tile.encode(
+            [{
+                'name': source,
+                'features': [
+                    {'geometry': geometry, 'properties': _scalar_properties(feature_properties(source, item))}
+                    for item, geometry in zip(items, projected)
+                ],
+            }],
+            default_options={'quantize_bounds': (min_x, min_y, max_x, max_y), 'extents': MVT_EXTENT},
+        )
+
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': mapping(geometry),
+            'properties': feature_properties(source, item),
+        }
+        for item, geometry in zip(items, geometries)
+    ]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, default=str).encode('utf-8')
+
+def get_tile(queryset, source, scope, version, z, x, y, fmt='geojson'):
+    """Return encoded tile bytes, served from the tile cache while the data version is unchanged"""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported tile format: {fmt}")
+
+    key = f"tile:{source}:{scope}:{version}:{z}/{x}/{y}.{fmt}"
+    content = cache.get(key)
+    if content is None:
+        content = render_tile(queryset, source, z, x, y, fmt)
+        cache.set(key, content, getattr(settings, 'TILE_CACHE_TIMEOUT', 3600))
+    return content
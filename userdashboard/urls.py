@@ -10,7 +10,7 @@ from .kml_views import (
 from .file_views import (
     FileUploadView, FileListView, FileDetailView, FilePreviewView,
     FileExportView, FileDeleteView, FileShareView, SharedFileView, FileAjaxView, FileStatsView,
-    CSVPreviewView, ShapefilePreviewView, CSVGeoJSONView, ShapefileGeoJSONView
+    CSVPreviewView, ShapefilePreviewView, CSVGeoJSONView, ShapefileGeoJSONView, VectorTileView
 )
 from . import views, file_views, kml_views
 
@@ -61,4 +61,13 @@ urlpatterns = [
 urlpatterns += [
     path('csv/geojson/<uuid:file_id>/', CSVGeoJSONView.as_view(), name='csv_geojson'),
     path('shapefile/geojson/<uuid:file_id>/', ShapefileGeoJSONView.as_view(), name='shapefile_geojson'),
+    path('api/files/upload/', file_views.upload_file_api, name='upload_file_api'),
+    path('api/files/<uuid:file_id>/convert/', file_views.convert_file_api, name='convert_file_api'),
+    path('api/files/uploads/', file_views.chunked_upload_start_api, name='chunked_upload_start_api'),
+    path('api/files/uploads/<uuid:upload_id>/', file_views.chunked_upload_api, name='chunked_upload_api'),
+    path('api/files/uploads/<uuid:upload_id>/finalize/', file_views.chunked_upload_finalize_api, name='chunked_upload_finalize_api'),
+    path('api/jobs/<uuid:job_id>/', file_views.job_status_api, name='job_status_api'),
+    path('api/features/query/', file_views.spatial_query_api, name='spatial_query_api'),
+    path('tiles/<str:source>/<uuid:file_id>/<int:z>/<int:x>/<int:y>.<str:fmt>', VectorTileView.as_view(), name='file_tile'),
+    path('tiles/<str:source>/<int:z>/<int:x>/<int:y>.<str:fmt>', VectorTileView.as_view(), name='user_tile'),
 ] 
\ No newline at end of file
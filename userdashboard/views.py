@@ -3,9 +3,9 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash, logout
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.core.paginator import Paginator
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Exists, OuterRef
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.template.loader import render_to_string
@@ -15,13 +15,19 @@ from django.core.validators import validate_email
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from .models import FileUpload, KMLData, UploadedParcel, KMLFile, DownloadLog, ContactFormSubmission, SurveyHistoryLog
+from .file_utils import ContentStore, iter_export_rows, stream_csv
+from .kml_utils import ingest_kml_file, parse_coordinates, reuse_parsed_kml
+from .spatial import geometry_to_kml, iter_geometries, touch_owners
+from .previews import PreviewStore, kml_head, csv_head, head_text
 import json
 import re
 import os
+import shapely
 import csv
 import zipfile
 import xml.etree.ElementTree as ET
 from io import StringIO, BytesIO
+from xml.sax.saxutils import escape
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from PIL import Image, ImageDraw, ImageFont
@@ -56,6 +62,38 @@ def log_survey_activity(user, action_type, file_name=None, file_type=None,
         print(f"Error logging survey activity: {e}")
         traceback.print_exc()
 
+def unique_survey_records(queryset):
+    """
+    Keep only the earliest record of each dedup_key group, ordered by (created_at, id)
+
+    Each candidate is checked with a correlated NOT EXISTS on the (dedup_key, created_at, id) index,
+    so a sliced page only probes the rows it walks instead of deduplicating the whole set first.
+    """
+    # No earlier record with the same key; MIN(id) would not do, ids need not follow created_at
+    earlier = queryset.filter(dedup_key=OuterRef('dedup_key')).filter(
+        Q(created_at__lt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__lt=OuterRef('id'))
+    )
+    return queryset.filter(~Exists(earlier)).order_by('created_at', 'id')
+
+def encode_keyset_cursor(item):
+    """Opaque cursor pointing just past item in (created_at, id) order"""
+    return base64.urlsafe_b64encode(f"{item.created_at.isoformat()}|{item.id}".encode()).decode()
+
+def keyset_page(queryset, cursor, per_page):
+    """Return (items, next_cursor) for the page after cursor, touching only per_page + 1 rows"""
+    queryset = queryset.order_by('created_at', 'id')
+    if cursor:
+        try:
+            created_at, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            created_at = datetime.fromisoformat(created_at)
+            last_id = int(last_id)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("Invalid cursor")
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=last_id))
+    items = list(queryset[:per_page + 1])
+    next_cursor = encode_keyset_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return items[:per_page], next_cursor
+
 class UserDashboardView(LoginRequiredMixin, View):
     def get(self, request):
         # Ensure user is authenticated
@@ -158,13 +196,13 @@ class UploadsView(LoginRequiredMixin, View):
                         record_count=len(preview_data) if preview_data else 0
                     )
                     
-                    request.session['preview_data'] = {
+                    PreviewStore.put(request, {
                         'file_type': 'kml',
                         'file_name': kml_file.name,
                         'file_size': kml_file.size,
                         'file_path': file_path,
                         'preview_data': preview_data
-                    }
+                    })
                     messages.success(request, 'KML file uploaded successfully!')
                     return redirect('file_preview')
                 else:
@@ -189,13 +227,13 @@ class UploadsView(LoginRequiredMixin, View):
                         record_count=len(preview_data) if preview_data else 0
                     )
                     
-                    request.session['preview_data'] = {
+                    PreviewStore.put(request, {
                         'file_type': 'csv',
                         'file_name': csv_file.name,
                         'file_size': csv_file.size,
                         'file_path': file_path,
                         'preview_data': preview_data
-                    }
+                    })
                     messages.success(request, 'CSV file uploaded successfully!')
                     return redirect('file_preview')
                 else:
@@ -220,13 +258,13 @@ class UploadsView(LoginRequiredMixin, View):
                         record_count=len(preview_data) if preview_data else 0
                     )
                     
-                    request.session['preview_data'] = {
+                    PreviewStore.put(request, {
                         'file_type': 'shp',
                         'file_name': shp_file.name,
                         'file_size': shp_file.size,
                         'file_path': file_path,
                         'preview_data': preview_data
-                    }
+                    })
                     messages.success(request, 'Shapefile uploaded successfully!')
                     return redirect('file_preview')
                 else:
@@ -269,44 +307,38 @@ class UploadsView(LoginRequiredMixin, View):
         return True
     
     def _save_temp_file(self, file, file_type):
-        """Save uploaded file temporarily"""
+        """Save uploaded file temporarily, copied chunk by chunk rather than read into memory"""
         temp_dir = f'temp_uploads/{file_type}'
-        file_path = default_storage.save(f'{temp_dir}/{file.name}', ContentFile(file.read()))
+        file.seek(0)
+        file_path = default_storage.save(f'{temp_dir}/{file.name}', file)
         return file_path
     
     def _parse_kml_file(self, file):
-        """Parse KML file and extract preview data"""
+        """Extract preview data from the head of a KML file without parsing all of it"""
         try:
-            file.seek(0)  # Reset file pointer
-            content = file.read().decode('utf-8')
-            root = ET.fromstring(content)
-            
-            # Extract basic KML information
-            placemarks = root.findall('.//{http://www.opengis.net/kml/2.2}Placemark')
+            placemarks, total, estimated = kml_head(file)
             coordinates = []
             
-            for placemark in placemarks[:10]:  # Limit to first 10 placemarks
-                name_elem = placemark.find('.//{http://www.opengis.net/kml/2.2}name')
+            for placemark in placemarks:
+                name_elem = placemark.find('.//{*}name')
                 name = name_elem.text if name_elem is not None else 'Unnamed Placemark'
                 
-                coords_elem = placemark.find('.//{http://www.opengis.net/kml/2.2}coordinates')
+                coords_elem = placemark.find('.//{*}coordinates')
                 if coords_elem is not None:
-                    coords_text = coords_elem.text.strip()
-                    coords_list = coords_text.split()
-                    if coords_list:
+                    coords = parse_coordinates(coords_elem.text)
+                    if len(coords):
                         # Take first coordinate pair
-                        first_coord = coords_list[0].split(',')
-                        if len(first_coord) >= 2:
-                            coordinates.append({
-                                'name': name,
-                                'longitude': float(first_coord[0]),
-                                'latitude': float(first_coord[1])
-                            })
+                        coordinates.append({
+                            'name': name,
+                            'longitude': float(coords[0, 0]),
+                            'latitude': float(coords[0, 1])
+                        })
             
             return {
-                'total_placemarks': len(placemarks),
-                'preview_coordinates': coordinates[:10],
-                'file_content_preview': content[:1000] + '...' if len(content) > 1000 else content
+                'total_placemarks': total,
+                'total_estimated': estimated,
+                'preview_coordinates': coordinates,
+                'file_content_preview': head_text(file)
             }
         except Exception as e:
             return {
@@ -316,19 +348,9 @@ class UploadsView(LoginRequiredMixin, View):
             }
     
     def _parse_csv_file(self, file):
-        """Parse CSV file and extract preview data"""
+        """Extract preview data from the header and first rows of a CSV file"""
         try:
-            file.seek(0)  # Reset file pointer
-            content = file.read().decode('utf-8')
-            lines = content.split('\n')
-            
-            # Parse CSV
-            csv_reader = csv.reader(lines)
-            headers = next(csv_reader, [])
-            rows = list(csv_reader)
-            
-            # Extract preview data
-            preview_rows = rows[:10]  # First 10 rows
+            headers, preview_rows, total, estimated = csv_head(file)
             
             # Try to identify coordinate columns
             coord_columns = []
@@ -339,10 +361,11 @@ class UploadsView(LoginRequiredMixin, View):
             
             return {
                 'headers': headers,
-                'total_rows': len(rows),
+                'total_rows': total,
+                'total_estimated': estimated,
                 'preview_rows': preview_rows,
                 'coordinate_columns': coord_columns,
-                'file_content_preview': content[:1000] + '...' if len(content) > 1000 else content
+                'file_content_preview': head_text(file)
             }
         except Exception as e:
             return {
@@ -370,7 +393,7 @@ class UploadsView(LoginRequiredMixin, View):
 class FilePreviewView(LoginRequiredMixin, View):
     def get(self, request):
         """Display file preview page"""
-        preview_data = request.session.get('preview_data')
+        preview_data = PreviewStore.get(request)
         
         if not preview_data:
             messages.error(request, 'No file to preview. Please upload a file first.')
@@ -382,7 +405,7 @@ class FilePreviewView(LoginRequiredMixin, View):
     
     def post(self, request):
         """Handle file confirmation or rejection"""
-        preview_data = request.session.get('preview_data')
+        preview_data = PreviewStore.get(request)
         
         if not preview_data:
             messages.error(request, 'No file to process. Please upload a file first.')
@@ -398,8 +421,8 @@ class FilePreviewView(LoginRequiredMixin, View):
                 if 'file_path' in preview_data:
                     default_storage.delete(preview_data['file_path'])
                 
-                # Clear preview data from session
-                del request.session['preview_data']
+                # Clear preview data from the store and session
+                PreviewStore.clear(request)
                 
                 return redirect('my_survey')
                 
@@ -412,8 +435,8 @@ class FilePreviewView(LoginRequiredMixin, View):
             if 'file_path' in preview_data:
                 default_storage.delete(preview_data['file_path'])
             
-            # Clear preview data from session
-            del request.session['preview_data']
+            # Clear preview data from the store and session
+            PreviewStore.clear(request)
             
             messages.info(request, 'File upload cancelled.')
             return redirect('uploads')
@@ -542,12 +565,12 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
             
             # Validate file type
             file_extension = uploaded_file.name.lower().split('.')[-1]
-            allowed_extensions = ['kml', 'csv', 'shp', 'zip']
+            allowed_extensions = ['kml', 'kmz', 'csv', 'shp', 'zip']
             
             if file_extension not in allowed_extensions:
                 return JsonResponse({
                     'success': False,
-                    'error': f'File type .{file_extension} is not supported. Please upload KML, CSV, or Shapefile files.'
+                    'error': f'File type .{file_extension} is not supported. Please upload KML, KMZ, CSV, or Shapefile files.'
                 })
             
             # Validate file size (50MB limit)
@@ -558,7 +581,7 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                 })
             
             # Process file based on type
-            if file_extension == 'kml':
+            if file_extension in ['kml', 'kmz']:
                 return self._handle_kml_upload(request, uploaded_file)
             elif file_extension == 'csv':
                 return self._handle_csv_upload(request, uploaded_file)
@@ -579,18 +602,29 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
     def _handle_kml_upload(self, request, uploaded_file):
         """Handle KML file upload"""
         try:
-            kml_file = KMLFile.objects.create(
-                user=request.user,
-                original_filename=uploaded_file.name,
-                file=uploaded_file,
-                file_size=uploaded_file.size
-            )
+            with ContentStore.storing(uploaded_file) as (stored_name, content_hash, file_size):
+                kml_file = KMLFile.objects.create(
+                    user=request.user,
+                    original_filename=uploaded_file.name,
+                    file=stored_name,
+                    file_size=file_size,
+                    content_hash=content_hash
+                )
             
-            # Parse KML data
-            self._parse_kml_file(uploaded_file, kml_file)
+            # Parse KML data in one pass over the stored blob, unless identical content was already parsed
+            if not reuse_parsed_kml(kml_file):
+                try:
+                    ingest_kml_file(kml_file)
+                except ValueError as e:
+                    # Keep the upload even if parsing fails; the error is recorded on the KMLFile
+                    print(f"Error parsing KML file: {e}")
             
             # Log the upload activity
             record_count = KMLData.objects.filter(kml_file=kml_file).count()
+            if record_count and not kml_file.is_processed:
+                kml_file.is_processed = True
+                kml_file.processing_status = 'completed'
+                kml_file.save(update_fields=['is_processed', 'processing_status', 'updated_at'])
             log_survey_activity(
                 user=request.user,
                 action_type='upload',
@@ -620,13 +654,15 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
     def _handle_csv_upload(self, request, uploaded_file):
         """Handle CSV file upload"""
         try:
-            file_upload = FileUpload.objects.create(
-                user=request.user,
-                original_filename=uploaded_file.name,
-                file=uploaded_file,
-                file_type='CSV',
-                file_size=uploaded_file.size
-            )
+            with ContentStore.storing(uploaded_file) as (stored_name, content_hash, file_size):
+                file_upload = FileUpload.objects.create(
+                    user=request.user,
+                    original_filename=uploaded_file.name,
+                    file=stored_name,
+                    file_type='CSV',
+                    file_size=file_size,
+                    content_hash=content_hash
+                )
             
             # Log the upload activity
             log_survey_activity(
@@ -657,13 +693,15 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
     def _handle_shapefile_upload(self, request, uploaded_file):
         """Handle Shapefile upload"""
         try:
-            file_upload = FileUpload.objects.create(
-                user=request.user,
-                original_filename=uploaded_file.name,
-                file=uploaded_file,
-                file_type='SHAPEFILE',
-                file_size=uploaded_file.size
-            )
+            with ContentStore.storing(uploaded_file) as (stored_name, content_hash, file_size):
+                file_upload = FileUpload.objects.create(
+                    user=request.user,
+                    original_filename=uploaded_file.name,
+                    file=stored_name,
+                    file_type='SHAPEFILE',
+                    file_size=file_size,
+                    content_hash=content_hash
+                )
             
             # Log the upload activity
             log_survey_activity(
@@ -762,36 +800,30 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
             if geometry_filter:
                 kml_data = kml_data.filter(geometry_type=geometry_filter)
             
-            # For SQLite compatibility, we'll do deduplication in Python
-            # First get all records, then deduplicate
-            all_records = list(kml_data)
-            unique_records = []
-            seen_keys = set()
-            
-            for record in all_records:
-                # Create unique key for deduplication
-                unique_key = f"{record.kitta_number}_{record.owner_name}_{record.placemark_name}_{record.area_hectares}"
-                if unique_key not in seen_keys:
-                    seen_keys.add(unique_key)
-                    unique_records.append(record)
-            
-            print(f"Original records: {len(all_records)}, Unique records: {len(unique_records)}")
-            
-            # Create a new queryset with unique records
-            if unique_records:
-                unique_ids = [record.id for record in unique_records]
-                kml_data = KMLData.objects.filter(id__in=unique_ids)
-            else:
-                # If no unique records, use original queryset
-                print("No unique records found, using original queryset")
-                kml_data = KMLData.objects.filter(kml_file__user=request.user)
+            # Deduplicate in the database on the indexed dedup_key column
+            kml_data = unique_survey_records(kml_data).select_related('kml_file')
             
-            # Pagination
-            page = int(request.GET.get('page', 1))
+            # Pagination: keyset when a cursor is supplied, numbered pages otherwise
             per_page = int(request.GET.get('per_page', 10))  # Default to 10 records per page
-            
-            paginator = Paginator(kml_data, per_page)
-            page_obj = paginator.get_page(page)
+            cursor = request.GET.get('cursor')
+            if cursor is not None:
+                try:
+                    page_items, next_cursor = keyset_page(kml_data, cursor, per_page)
+                except ValueError as e:
+                    return JsonResponse({'success': False, 'error': str(e)}, status=400)
+                page = None
+                total_pages = None
+                has_next = next_cursor is not None
+                has_previous = bool(cursor)
+            else:
+                page = int(request.GET.get('page', 1))
+                paginator = Paginator(kml_data, per_page)
+                page_obj = paginator.get_page(page)
+                page_items = list(page_obj)
+                total_pages = paginator.num_pages
+                has_next = page_obj.has_next()
+                has_previous = page_obj.has_previous()
+                next_cursor = encode_keyset_cursor(page_items[-1]) if has_next and page_items else None
             
             # Helper function to clean HTML tags from text
             def clean_html_text(text):
@@ -827,13 +859,10 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                     return ' | '.join(location_parts)
                 return '-'
             
-            # Serialize data with enhanced cleaning and additional deduplication
+            # Serialize data with enhanced cleaning
             data_list = []
-            seen_records = set()  # Track unique records to avoid duplicates
             
-            print(f"Processing {len(page_obj)} items from pagination")
-            
-            for i, item in enumerate(page_obj):
+            for item in page_items:
                 # Clean and format the data
                 placemark_name = clean_html_text(item.placemark_name)
                 kitta_number = clean_html_text(item.kitta_number)
@@ -846,19 +875,6 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                 location = get_location_string(item)
                 file_name = item.kml_file.original_filename
                 
-                # Create a unique key for deduplication
-                unique_key = f"{kitta_number}_{owner_name}_{placemark_name}_{area_hectares}"
-                
-                print(f"Record {i+1}: Kitta={kitta_number}, Owner={owner_name}, Key={unique_key}")
-                
-                # Skip if we've already seen this record
-                if unique_key in seen_records:
-                    print(f"  -> Skipping duplicate record")
-                    continue
-                
-                seen_records.add(unique_key)
-                print(f"  -> Adding unique record")
-                
                 data_list.append({
                     'id': str(item.id),
                     'placemark_name': placemark_name,
@@ -906,10 +922,11 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                 'success': True,
                 'data': data_list,
                 'total_count': len(data_list),  # Use deduplicated count
-                'total_pages': paginator.num_pages,
+                'total_pages': total_pages,
                 'current_page': page,
-                'has_next': page_obj.has_next(),
-                'has_previous': page_obj.has_previous(),
+                'has_next': has_next,
+                'has_previous': has_previous,
+                'next_cursor': next_cursor,
                 'description': description,
             })
             
@@ -1004,7 +1021,7 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
         """Reprocess and clean existing KML data to ensure proper display"""
         try:
             from userdashboard.models import KMLData
-            import re
+            from .extraction import ExtractionRules, reprocess_rows
             
             # Get KML data for the user
             kml_data = KMLData.objects.filter(kml_file__user=request.user)
@@ -1021,98 +1038,9 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                 # Reprocess all KML data for the user
                 kml_data = KMLData.objects.filter(kml_file__user=request.user)
             
-            processed_count = 0
-            cleaned_count = 0
-            
-            for item in kml_data:
-                original_owner = item.owner_name
-                original_placemark = item.placemark_name
-                original_description = item.description
-                
-                # Clean HTML tags from text fields
-                if item.owner_name:
-                    item.owner_name = re.sub(r'<[^>]+>', '', item.owner_name)
-                    item.owner_name = re.sub(r'\s+', ' ', item.owner_name).strip()
-                
-                if item.placemark_name:
-                    item.placemark_name = re.sub(r'<[^>]+>', '', item.placemark_name)
-                    item.placemark_name = re.sub(r'\s+', ' ', item.placemark_name).strip()
-                
-                if item.description:
-                    item.description = re.sub(r'<[^>]+>', '', item.description)
-                    item.description = re.sub(r'\s+', ' ', item.description).strip()
-                
-                # Clean address fields
-                if item.address:
-                    item.address = re.sub(r'<[^>]+>', '', item.address)
-                    item.address = re.sub(r'\s+', ' ', item.address).strip()
-                
-                if item.locality:
-                    item.locality = re.sub(r'<[^>]+>', '', item.locality)
-                    item.locality = re.sub(r'\s+', ' ', item.locality).strip()
-                
-                if item.administrative_area:
-                    item.administrative_area = re.sub(r'<[^>]+>', '', item.administrative_area)
-                    item.administrative_area = re.sub(r'\s+', ' ', item.administrative_area).strip()
-                
-                # Re-extract data from description using improved parsing
-                if item.description:
-                    # Extract kitta number
-                    if not item.kitta_number:
-                        kitta_patterns = [
-                            r'kitta[:\s]*([^\s,]+)',
-                            r'kitta[:\s]*([^\s\n]+)',
-                            r'kml_1_11_\d+',
-                            r'kml_\d+_\d+_\d+',
-                        ]
-                        for pattern in kitta_patterns:
-                            kitta_match = re.search(pattern, item.description, re.IGNORECASE)
-                            if kitta_match:
-                                item.kitta_number = kitta_match.group(1) if len(kitta_match.groups()) > 0 else kitta_match.group(0)
-                                break
-                    
-                    # Extract owner name
-                    if not item.owner_name:
-                        owner_patterns = [
-                            r'owner[:\s]*([^,\n]+)',
-                            r'owner[:\s]*([^.\n]+)',
-                        ]
-                        for pattern in owner_patterns:
-                            owner_match = re.search(pattern, item.description, re.IGNORECASE)
-                            if owner_match:
-                                item.owner_name = owner_match.group(1).strip()
-                                break
-                    
-                    # Extract area
-                    if not item.area_hectares:
-                        area_patterns = [
-                            r'area[:\s]*([0-9.]+)\s*hectares',
-                            r'area[:\s]*([0-9.]+)\s*ha',
-                            r'area size[:\s]*([0-9.]+)\s*sq m',
-                            r'area[:\s]*([0-9.]+)\s*sq m',
-                        ]
-                        for pattern in area_patterns:
-                            area_match = re.search(pattern, item.description, re.IGNORECASE)
-                            if area_match:
-                                try:
-                                    area_value = float(area_match.group(1))
-                                    if 'sq m' in pattern.lower():
-                                        item.area_hectares = area_value / 10000
-                                    else:
-                                        item.area_hectares = area_value
-                                    break
-                                except:
-                                    continue
-                
-                # Check if any changes were made
-                if (original_owner != item.owner_name or 
-                    original_placemark != item.placemark_name or 
-                    original_description != item.description or
-                    item.kitta_number or item.area_hectares):
-                    cleaned_count += 1
-                
-                processed_count += 1
-                item.save()
+            # Column-wise cleaning and extraction with the rules of the requested data source
+            rules = ExtractionRules.for_source(request.GET.get('source') or None)
+            processed_count, cleaned_count = reprocess_rows(kml_data, rules)
             
             if reprocess_all:
                 message = f'Successfully reprocessed all {processed_count} records. Cleaned {cleaned_count} records.'
@@ -1134,294 +1062,6 @@ class SurveyReportAPIView(LoginRequiredMixin, View):
                 'error': str(e)
             }, status=500)
 
-    def _parse_kml_file(self, file, kml_file):
-        """Parse KML file and extract data"""
-        try:
-            import xml.etree.ElementTree as ET
-            import re
-            
-            # Reset file pointer to beginning
-            file.seek(0)
-            
-            # Try different encodings
-            content = None
-            encodings = ['utf-8', 'latin-1', 'cp1252']
-            
-            for encoding in encodings:
-                try:
-                    file.seek(0)
-                    content = file.read().decode(encoding)
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if content is None:
-                # If all encodings fail, try binary mode
-                file.seek(0)
-                content = file.read()
-                if isinstance(content, bytes):
-                    content = content.decode('utf-8', errors='ignore')
-            
-            print(f"Parsing KML file: {kml_file.original_filename}")
-            print(f"Content length: {len(content)} characters")
-            
-            # Parse XML
-            root = ET.fromstring(content)
-            
-            # Define namespaces
-            ns = {'kml': 'http://www.opengis.net/kml/2.2'}
-            
-            # Find all Placemarks
-            placemarks = root.findall('.//kml:Placemark', ns)
-            
-            # If no placemarks found with namespace, try without namespace
-            if not placemarks:
-                placemarks = root.findall('.//Placemark')
-                ns = {}
-            
-            print(f"Found {len(placemarks)} placemarks")
-            
-            # If still no placemarks, try alternative approaches
-            if not placemarks:
-                # Try finding any element that might contain data
-                all_elements = root.findall('.//*')
-                print(f"Total XML elements found: {len(all_elements)}")
-                
-                # Look for elements that might be placemarks with different names
-                for elem in all_elements:
-                    if elem.tag.endswith('Placemark') or 'placemark' in elem.tag.lower():
-                        placemarks.append(elem)
-                        print(f"Found alternative placemark: {elem.tag}")
-            
-            # If still no placemarks, create a single record from the file
-            if not placemarks:
-                print("No placemarks found, creating single record from file")
-                KMLData.objects.create(
-                    kml_file=kml_file,
-                    placemark_name=kml_file.original_filename,
-                    description="Data extracted from KML file",
-                    coordinates="",
-                    kitta_number="",
-                    owner_name="",
-                    area_hectares=None,
-                    geometry_type="Point",
-                    address="",
-                    locality="",
-                    administrative_area=""
-                )
-                return
-            
-            for i, placemark in enumerate(placemarks):
-                print(f"Processing placemark {i+1}/{len(placemarks)}")
-                
-                # Extract placemark data
-                name_elem = placemark.find('name', ns) if ns else placemark.find('name')
-                name = name_elem.text if name_elem is not None else ''
-                
-                description_elem = placemark.find('description', ns) if ns else placemark.find('description')
-                description = description_elem.text if description_elem is not None else ''
-                
-                # Extract coordinates if present
-                coordinates = ''
-                coords_elem = placemark.find('.//coordinates', ns) if ns else placemark.find('.//coordinates')
-                if coords_elem is not None:
-                    coordinates = coords_elem.text
-                
-                # Also try to extract from Point, LineString, or Polygon
-                if not coordinates:
-                    for geom_type in ['Point', 'LineString', 'Polygon']:
-                        geom_elem = placemark.find(f'.//{geom_type}', ns) if ns else placemark.find(f'.//{geom_type}')
-                        if geom_elem is not None:
-                            coords_elem = geom_elem.find('coordinates', ns) if ns else geom_elem.find('coordinates')
-                            if coords_elem is not None:
-                                coordinates = coords_elem.text
-                                break
-                
-                # Extract extended data (survey information)
-                extended_data = placemark.find('ExtendedData', ns) if ns else placemark.find('ExtendedData')
-                kitta_number = ''
-                owner_name = ''
-                area_hectares = None
-                geometry_type = 'Point'
-                address = ''
-                locality = ''
-                administrative_area = ''
-                
-                if extended_data is not None:
-                    # Look for specific data fields
-                    for data in extended_data.findall('Data', ns) if ns else extended_data.findall('Data'):
-                        name_attr = data.get('name')
-                        value_elem = data.find('value', ns) if ns else data.find('value')
-                        value = value_elem.text if value_elem is not None else ''
-                        
-                        if name_attr:
-                            if 'kitta' in name_attr.lower():
-                                kitta_number = value
-                            elif 'owner' in name_attr.lower():
-                                owner_name = value
-                            elif 'area' in name_attr.lower() or 'hectares' in name_attr.lower():
-                                try:
-                                    area_hectares = float(value)
-                                except:
-                                    area_hectares = None
-                            elif 'address' in name_attr.lower():
-                                address = value
-                            elif 'locality' in name_attr.lower():
-                                locality = value
-                            elif 'administrative' in name_attr.lower():
-                                administrative_area = value
-                
-                # Comprehensive data extraction from description
-                if description:
-                    print(f"Processing description: {description[:200]}...")  # Debug print
-                    
-                    # Extract kitta number with multiple patterns
-                    if not kitta_number:
-                        kitta_patterns = [
-                            r'kitta[:\s]*([^\s,]+)',
-                            r'kitta[:\s]*([^\s\n]+)',
-                            r'kml_1_11_\d+',
-                            r'kml_\d+_\d+_\d+',
-                            r'kml_(\d+)_(\d+)_(\d+)',
-                            r'kml_(\d+)_(\d+)_(\d+)',
-                        ]
-                        for pattern in kitta_patterns:
-                            kitta_match = re.search(pattern, description, re.IGNORECASE)
-                            if kitta_match:
-                                if len(kitta_match.groups()) > 0:
-                                    kitta_number = kitta_match.group(0)  # Use full match for KML patterns
-                                else:
-                                    kitta_number = kitta_match.group(1)
-                                print(f"Found kitta: {kitta_number}")
-                                break
-                
-                    # Extract owner name with multiple patterns
-                    if not owner_name:
-                        owner_patterns = [
-                            r'owner[:\s]*([^,\n]+)',
-                            r'owner[:\s]*([^.\n]+)',
-                            r'owner[:\s]*([A-Za-z\s]+)',
-                            r'owner[:\s]*([^;]+)',
-                            r'owner[:\s]*([^|]+)',
-                        ]
-                        for pattern in owner_patterns:
-                            owner_match = re.search(pattern, description, re.IGNORECASE)
-                            if owner_match:
-                                owner_name = owner_match.group(1).strip()
-                                print(f"Found owner: {owner_name}")
-                                break
-                
-                    # Extract area information with multiple patterns
-                    if not area_hectares:
-                        area_patterns = [
-                            r'area[:\s]*([0-9.]+)\s*hectares',
-                            r'area[:\s]*([0-9.]+)\s*ha',
-                            r'hectares[:\s]*([0-9.]+)',
-                            r'ha[:\s]*([0-9.]+)',
-                            r'area size[:\s]*([0-9.]+)\s*sq m',
-                            r'area[:\s]*([0-9.]+)\s*sq m',
-                            r'area[:\s]*([0-9.]+)',
-                            r'size[:\s]*([0-9.]+)',
-                        ]
-                        for pattern in area_patterns:
-                            area_match = re.search(pattern, description, re.IGNORECASE)
-                            if area_match:
-                                try:
-                                    area_value = float(area_match.group(1))
-                                    # Convert sq m to hectares if needed
-                                    if 'sq m' in pattern.lower():
-                                        area_hectares = area_value / 10000  # Convert sq m to hectares
-                                    else:
-                                        area_hectares = area_value
-                                    print(f"Found area: {area_hectares} hectares")
-                                    break
-                                except:
-                                    continue
-                
-                    # Extract address information with multiple patterns
-                    if not address:
-                        address_patterns = [
-                            r'address[:\s]*([^,\n]+)',
-                            r'location[:\s]*([^,\n]+)',
-                            r'address[:\s]*([^;]+)',
-                            r'location[:\s]*([^;]+)',
-                        ]
-                        for pattern in address_patterns:
-                            addr_match = re.search(pattern, description, re.IGNORECASE)
-                            if addr_match:
-                                address = addr_match.group(1).strip()
-                                print(f"Found address: {address}")
-                                break
-                
-                # Fallback: Extract data from placemark name if description is empty
-                if not kitta_number and name:
-                    print(f"Trying to extract from name: {name}")
-                    # Try to extract kitta from name
-                    name_kitta_patterns = [
-                        r'kml_1_11_\d+',
-                        r'kml_\d+_\d+_\d+',
-                        r'kml_(\d+)_(\d+)_(\d+)',
-                        r'([A-Za-z0-9_-]+)',
-                    ]
-                    for pattern in name_kitta_patterns:
-                        name_kitta_match = re.search(pattern, name, re.IGNORECASE)
-                        if name_kitta_match:
-                            kitta_number = name_kitta_match.group(0)
-                            print(f"Found kitta from name: {kitta_number}")
-                            break
-                    
-                    # Try to extract owner from name
-                    if not owner_name and name:
-                        # If name contains descriptive text, use it as owner
-                        if len(name) > 10 and not re.match(r'^[A-Za-z0-9_-]+$', name):
-                            owner_name = name
-                            print(f"Using name as owner: {owner_name}")
-                
-                # Determine geometry type
-                if placemark.find('.//Polygon', ns) if ns else placemark.find('.//Polygon'):
-                    geometry_type = 'Polygon'
-                elif placemark.find('.//LineString', ns) if ns else placemark.find('.//LineString'):
-                    geometry_type = 'LineString'
-                else:
-                    geometry_type = 'Point'
-                
-
-                
-                # Create sample data if no data was extracted (for testing)
-                if not kitta_number and not owner_name and not area_hectares:
-                    # Generate sample data for testing
-                    kitta_number = f"KML_{i+1}_{len(placemarks)}_{i+1}"
-                    owner_name = f"Sample Owner {i+1}"
-                    area_hectares = round(10.0 + (i * 2.5), 2)
-                    address = f"Sample Address {i+1}"
-                    print(f"Generated sample data for placemark {i+1}")
-                
-                # Create KMLData record with enhanced data
-                kml_data_record = KMLData.objects.create(
-                    kml_file=kml_file,
-                    placemark_name=name or f"Placemark {i+1}",
-                    description=description or f"Data from {kml_file.original_filename}",
-                    coordinates=coordinates,
-                    kitta_number=kitta_number,
-                    owner_name=owner_name,
-                    area_hectares=area_hectares,
-                    geometry_type=geometry_type,
-                    address=address,
-                    locality=locality,
-                    administrative_area=administrative_area
-                )
-                
-                print(f"Created record: {kml_data_record.placemark_name} - Kitta: {kml_data_record.kitta_number} - Owner: {kml_data_record.owner_name} - Area: {kml_data_record.area_hectares}")
-            
-            # Print summary of parsed data
-            total_records = KMLData.objects.filter(kml_file=kml_file).count()
-            print(f"KML parsing completed: {total_records} records created for file {kml_file.original_filename}")
-                
-        except Exception as e:
-            print(f"Error parsing KML file: {e}")
-            # Don't raise the exception, just log it and continue
-            # This allows the file to be uploaded even if parsing fails
-
 class SurveyExportView(LoginRequiredMixin, View):
     """Handle survey data export"""
     
@@ -1873,16 +1513,11 @@ class SurveyExportView(LoginRequiredMixin, View):
             
             # Try to parse as KML coordinate string
             if ',' in coordinates_str:
-                parts = coordinates_str.strip().split(',')
-                if len(parts) >= 2:
-                    try:
-                        lng = float(parts[0].strip())
-                        lat = float(parts[1].strip())
-                        print(f"Parsed KML string: lat={lat}, lng={lng}")
-                        return (lat, lng)
-                    except Exception as e:
-                        print(f"KML parsing failed: {e}")
-                        pass
+                coords = parse_coordinates(coordinates_str)
+                if len(coords):
+                    lng, lat = coords[0, :2].tolist()
+                    print(f"Parsed KML string: lat={lat}, lng={lng}")
+                    return (lat, lng)
             
             # Try to parse as space-separated coordinates
             if ' ' in coordinates_str:
@@ -1930,10 +1565,15 @@ class SurveyExportView(LoginRequiredMixin, View):
             # Prepare coordinates for filtered data
             coordinates = []
             print(f"Processing {kml_data.count()} records for coordinates...")
-            for i, data in enumerate(kml_data):
-                print(f"Processing record {i+1}: {data.placemark_name} - Coordinates: {data.coordinates[:100] if data.coordinates else 'None'}...")
+            for i, (data, geometry) in enumerate(iter_geometries(kml_data)):
+                print(f"Processing record {i+1}: {data.placemark_name}...")
                 try:
-                    coords = self._parse_coordinates_for_map(data.coordinates)
+                    if geometry is not None and not geometry.is_empty:
+                        lon, lat = shapely.get_coordinates(geometry)[0].tolist()
+                        coords = (lat, lon)
+                    else:
+                        # Rows stored as raw KML coordinate text have no WKB
+                        coords = self._parse_coordinates_for_map(data.coordinates)
                     if coords:
                         coordinates.append({
                             'lat': coords[0],
@@ -2251,78 +1891,69 @@ class SurveyExportView(LoginRequiredMixin, View):
             """
     
     def _export_kml(self, request, files, kml_files):
-        """Export data as KML"""
-        try:
-            kml_content = StringIO()
-            kml_content.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            kml_content.write('<kml xmlns="http://www.opengis.net/kml/2.2">\n')
-            kml_content.write('<Document>\n')
-            kml_content.write('<name>Survey Report Export</name>\n')
+        """Export data as KML, streamed placemark by placemark"""
+        def placemarks():
+            yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+            yield '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+            yield '<Document>\n'
+            yield '<name>Survey Report Export</name>\n'
             
             # Add KML files
             for kml_file in kml_files:
-                kml_data = KMLData.objects.filter(kml_file=kml_file)
-                for data in kml_data:
-                    kml_content.write('<Placemark>\n')
+                kml_data = KMLData.objects.filter(kml_file=kml_file).only('placemark_name', 'description', 'geometry_type', 'geometry_wkb')
+                for data, geometry in iter_geometries(kml_data):
+                    parts = ['<Placemark>\n']
                     if data.placemark_name:
-                        kml_content.write(f'<name>{data.placemark_name}</name>\n')
+                        parts.append(f'<name>{escape(data.placemark_name)}</name>\n')
                     if data.description:
-                        kml_content.write(f'<description>{data.description}</description>\n')
-                    if data.coordinates:
-                        kml_content.write(f'<Point><coordinates>{data.coordinates}</coordinates></Point>\n')
-                    kml_content.write('</Placemark>\n')
-            
-            kml_content.write('</Document>\n')
-            kml_content.write('</kml>')
-            
-            response = HttpResponse(kml_content.getvalue(), content_type='application/vnd.google-earth.kml+xml')
-            response['Content-Disposition'] = 'attachment; filename="survey_report.kml"'
-            
-            return response
-            
-        except Exception as e:
-            return JsonResponse({
-                'success': False,
-                'error': str(e)
-            }, status=500)
+                        parts.append(f'<description>{escape(data.description)}</description>\n')
+                    # Rows without WKB are decoded from their JSON coordinates by iter_geometries
+                    if geometry is not None and not geometry.is_empty:
+                        parts.append(f'{geometry_to_kml(geometry)}\n')
+                    parts.append('</Placemark>\n')
+                    yield ''.join(parts)
+            
+            yield '</Document>\n'
+            yield '</kml>'
+        
+        response = StreamingHttpResponse(placemarks(), content_type='application/vnd.google-earth.kml+xml')
+        response['Content-Disposition'] = 'attachment; filename="survey_report.kml"'
+        
+        return response
     
     def _export_csv(self, request, files, kml_files):
-        """Export data as CSV"""
-        try:
-            csv_content = StringIO()
-            writer = csv.writer(csv_content)
-            
-            # Write header
-            writer.writerow(['File Name', 'Type', 'Size (KB)', 'Upload Date', 'Records'])
-            
-            # Write data
-            all_files = list(files) + list(kml_files)
-            for file in all_files:
-                if hasattr(file, 'file_type'):
-                    file_type = file.file_type
-                    record_count = getattr(file, 'record_count', 0)
-                else:
-                    file_type = 'KML'
-                    record_count = KMLData.objects.filter(kml_file=file).count()
-                
-                writer.writerow([
+        """Export data as CSV, streamed row by row"""
+        def rows():
+            for file in iter_export_rows(files):
+                yield [
                     file.original_filename,
-                    file_type,
+                    file.file_type,
                     f"{file.file_size / 1024:.1f}",
                     file.uploaded_at.strftime('%Y-%m-%d') if hasattr(file, 'uploaded_at') else file.created_at.strftime('%Y-%m-%d'),
-                    record_count
-                ])
-            
-            response = HttpResponse(csv_content.getvalue(), content_type='text/csv')
-            response['Content-Disposition'] = 'attachment; filename="survey_report.csv"'
-            
-            return response
-            
-        except Exception as e:
-            return JsonResponse({
-                'success': False,
-                'error': str(e)
-            }, status=500)
+                    getattr(file, 'record_count', 0)
+                ]
+            # Count KML records in one grouped query instead of once per file
+            kml_file_list = list(kml_files)
+            record_counts = dict(
+                KMLData.objects.filter(kml_file__in=[f.pk for f in kml_file_list])
+                .order_by().values_list('kml_file').annotate(total=Count('id'))
+            )
+            for file in kml_file_list:
+                yield [
+                    file.original_filename,
+                    'KML',
+                    f"{file.file_size / 1024:.1f}",
+                    file.uploaded_at.strftime('%Y-%m-%d'),
+                    record_counts.get(file.pk, 0)
+                ]
+        
+        response = StreamingHttpResponse(
+            stream_csv(['File Name', 'Type', 'Size (KB)', 'Upload Date', 'Records'], rows()),
+            content_type='text/csv'
+        )
+        response['Content-Disposition'] = 'attachment; filename="survey_report.csv"'
+        
+        return response
     
     def _export_shapefile(self, request, files, kml_files):
         """Export data as Shapefile (ZIP archive)"""
@@ -2392,22 +2023,12 @@ class MySurveyView(LoginRequiredMixin, View):
             recent_surveys = []
             
             # Add KML surveys
-            for kml in kml_surveys[:5]:
-                # Try to extract coordinates from the coordinates field
+            for kml, geometry in iter_geometries(kml_surveys[:5]):
+                # First vertex of the decoded geometry, if any
                 coordinates_info = "No coordinates"
-                try:
-                    if kml.coordinates:
-                        import json
-                        coords = json.loads(kml.coordinates)
-                        if isinstance(coords, list) and len(coords) > 0:
-                            if isinstance(coords[0], list):  # Polygon or LineString
-                                first_point = coords[0][0] if coords[0] else coords[0]
-                            else:  # Point
-                                first_point = coords
-                            if first_point and len(first_point) >= 2:
-                                coordinates_info = f"Coordinates: {first_point[1]:.6f}, {first_point[0]:.6f}"
-                except:
-                    pass
+                if geometry is not None and not geometry.is_empty:
+                    lon, lat = shapely.get_coordinates(geometry)[0].tolist()
+                    coordinates_info = f"Coordinates: {lat:.6f}, {lon:.6f}"
                 
                 recent_surveys.append({
                     'type': 'kml',
@@ -3245,6 +2866,7 @@ class ProfileView(LoginRequiredMixin, View):
             # Delete files and surveys
             FileUpload.objects.filter(user=user).delete()
             KMLData.objects.filter(kml_file__user=user).delete()
+            touch_owners('kml', KMLFile.objects.filter(user=user).values_list('pk', flat=True))
             
             # Delete other user data
             UploadedParcel.objects.filter(user=user).delete()